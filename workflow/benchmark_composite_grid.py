@@ -0,0 +1,98 @@
+"""
+Benchmark vectorized composite grid against the per grid cell .loc assignment
+"""
+import time
+import argparse
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_region_mask import create_region_index
+from create_composite_grid import composite_from_region_index
+
+#----------------------------------------------------------
+def create_synthetic_sets(nlat, nlon, set_names, nmonth=0):
+    """Create synthetic model output for each set together with subregion coordinates
+    :param: nlat:          number of latitudes
+    :param: nlon:          number of longitudes
+    :param: set_names:     list of set names
+    :param: nmonth:        number of months (0 for annual data)
+    :return:               xarray with Set dimension and list of (lon, lat) coordinates for each subregion
+    """
+    lat = np.linspace(25, 50, nlat)
+    lon = np.linspace(235, 295, nlon)
+
+    dims   = ('Set', 'lat', 'lon')
+    coords = {'Set': set_names, 'lat': lat, 'lon': lon}
+    shape  = [len(set_names), nlat, nlon]
+    if (nmonth > 0):
+        dims   = dims + ('month',)
+        coords['month'] = np.arange(1, nmonth+1)
+        shape.append(nmonth)
+
+    rng = np.random.default_rng(0)
+    da  = xr.DataArray(rng.random(shape), dims=dims, coords=coords)
+
+    # Split the grid into horizontal bands with one band per subregion
+    region_coords = []
+    for lat_band in np.array_split(lat, len(set_names)):
+        region_coords.append([(x, y) for y in lat_band for x in lon])
+
+    return da, region_coords
+
+#----------------------------------------------------------
+def composite_loop(da, region_coords, set_names):
+    """Create a composite grid with one .loc assignment per grid cell
+    """
+    composite_grid = xr.DataArray(np.empty(da.isel(Set=0).shape), dims=da.isel(Set=0).dims)
+    composite_grid = composite_grid.assign_coords({dim: da[dim].values for dim in composite_grid.dims})
+
+    for key, notnull_coords in zip(set_names, region_coords):
+        for lon, lat in notnull_coords:
+            composite_grid.loc[lat, lon] = da.sel(Set=key, lat=lat, lon=lon)
+
+    return composite_grid
+
+#----------------------------------------------------------
+def composite_vectorized(da, region_coords, set_names):
+    """Create a composite grid with a single gather across the Set axis
+    """
+    region_index = create_region_index(da.lat.values, da.lon.values, region_coords)
+
+    return composite_from_region_index(da, region_index, set_names)
+
+#----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Benchmark composite grid creation')
+parser.add_argument('--grids', nargs='+', default=['20x34', '360x720'], help='Grid sizes as nlatxnlon')
+parser.add_argument('--nmonth', type=int, default=0, help='Number of trailing months (0 for annual data)')
+parser.add_argument('--max_loop_cells', type=int, default=20000, help='Skip the loop for grids with more cells')
+args = parser.parse_args()
+
+set_names = ['Set1', 'Set2', 'Set3']
+
+for grid in args.grids:
+    nlat, nlon = [int(n) for n in grid.split('x')]
+    da, region_coords = create_synthetic_sets(nlat, nlon, set_names, args.nmonth)
+
+    start = time.perf_counter()
+    composite_vec = composite_vectorized(da, region_coords, set_names)
+    time_vec = time.perf_counter() - start
+
+    if (nlat * nlon > args.max_loop_cells):
+        # Time the loop on a subset of cells and extrapolate to the full grid
+        nsub = args.max_loop_cells // len(set_names)
+        sub_coords = [notnull_coords[:nsub] for notnull_coords in region_coords]
+        start = time.perf_counter()
+        composite_loop(da, sub_coords, set_names)
+        time_loop = (time.perf_counter() - start) * nlat * nlon / sum(len(c) for c in sub_coords)
+        loop_label = 'loop (extrapolated)'
+    else:
+        start = time.perf_counter()
+        composite_ref = composite_loop(da, region_coords, set_names)
+        time_loop = time.perf_counter() - start
+        loop_label = 'loop'
+        assert np.array_equal(composite_ref.values, composite_vec.transpose(*composite_ref.dims).values)
+
+    print('%-8s %s: %10.4f s   vectorized: %8.4f s   speedup: %8.1fx' % (grid, loop_label, time_loop, time_vec, time_loop / time_vec))
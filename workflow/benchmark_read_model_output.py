@@ -0,0 +1,99 @@
+"""
+Benchmark reading select variables from ELM h0 history files with and without pruning variables at open time
+"""
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_read_data import read_model_output
+
+#----------------------------------------------------------
+def create_synthetic_history(fpath, caseid, yr_start, yr_end, nvar, nlat, nlon):
+    """Create synthetic monthly h0 history files with nvar variables
+    :param: fpath:         directory path
+    :param: caseid:        model run case id
+    :param: yr_start:      start year
+    :param: yr_end:        end year
+    :param: nvar:          number of time varying variables in each file
+    :param: nlat:          number of latitudes
+    :param: nlon:          number of longitudes
+    """
+    rng    = np.random.default_rng(0)
+    coords = {'lat': np.linspace(36.75, 47.25, nlat), 'lon': np.linspace(260.5, 278, nlon)}
+
+    for yr in range(yr_start, yr_end+1):
+        time_vals = xr.date_range(str(yr) + '-02-01', periods=12, freq='MS', calendar='noleap', use_cftime=True)
+
+        ds = xr.Dataset(coords=dict(coords, time=time_vals))
+        ds['time_bounds'] = (('time', 'nbnd'), np.zeros([12, 2]))
+        ds['area']        = (('lat', 'lon'), rng.random([nlat, nlon]))
+        ds['landfrac']    = (('lat', 'lon'), rng.random([nlat, nlon]))
+        for ind in range(nvar):
+            var = 'GPP' if ind == 0 else 'VAR' + str(ind).zfill(3)
+            ds[var] = (('time', 'lat', 'lon'), rng.random([12, nlat, nlon]).astype(np.float32))
+
+        ds.to_netcdf(fpath + '/' + caseid + '.elm.h0.' + str(yr) + '-02-01-00000.nc')
+
+#----------------------------------------------------------
+def read_model_output_all_vars(yr_start, yr_end, fpath, caseid, varnames):
+    """Previous reader opening all variables before subsetting
+    """
+    fnames = []
+    for yr in range(int(yr_start), int(yr_end)+1):
+        fnames.append(fpath + '/' + caseid + '.elm.h0.' + str(yr) + '-02-01-00000.nc')
+
+    with xr.open_mfdataset(fnames, combine='nested', concat_dim='time') as ds:
+        ds = ds[varnames]
+
+    return(ds)
+
+#----------------------------------------------------------
+def time_reader(reader, nrepeat, *args):
+    """Time opening and loading a variable and trace the peak memory
+    :return:               (open time, open and load time, peak memory in MB)
+    """
+    open_times = []
+    load_times = []
+    for i in range(nrepeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        da    = reader(*args)
+        open_times.append(time.perf_counter() - start)
+        da.load()
+        load_times.append(time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return min(open_times), min(load_times), peak/1e6
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Benchmark pruned h0 history reader against opening all variables')
+parser.add_argument('--nvar', type=int, default=100, help='Number of time varying variables in each file')
+parser.add_argument('--nyears', type=int, default=10, help='Number of yearly history files')
+parser.add_argument('--nlat', type=int, default=20, help='Number of latitudes')
+parser.add_argument('--nlon', type=int, default=34, help='Number of longitudes')
+parser.add_argument('--nrepeat', type=int, default=3, help='Number of repeats (minimum time is reported)')
+args = parser.parse_args()
+
+caseid   = 'synthetic'
+yr_start = 2001
+yr_end   = yr_start + args.nyears - 1
+
+with tempfile.TemporaryDirectory() as fpath:
+    create_synthetic_history(fpath, caseid, yr_start, yr_end, args.nvar, args.nlat, args.nlon)
+
+    results = {}
+    for name, reader in [('all variables', read_model_output_all_vars), ('pruned', read_model_output)]:
+        results[name] = time_reader(reader, args.nrepeat, yr_start, yr_end, fpath, caseid, 'GPP')
+
+    df = pd.DataFrame(results, index=['open [s]', 'open + load [s]', 'peak memory [MB]']).T
+    print('%d files, %d variables, %d x %d grid' % (args.nyears, args.nvar, args.nlat, args.nlon))
+    print(df.to_string(float_format='%.3f'))
+    print('Speedup (open): %.1fx' % (df.loc['all variables', 'open [s]'] / df.loc['pruned', 'open [s]']))
@@ -0,0 +1,141 @@
+"""
+Check that the vectorized corn soybean rotation (apply_corn_soy_rotation) gives the same PCT_CFT as the
+original loop over years and grid cells on a synthetic land use timeseries
+"""
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+import xarray as xr
+import netCDF4 as nc
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_corn_soy_rotation import apply_corn_soy_rotation
+
+#----------------------------------------------------------
+def create_synthetic_landuse(fname, nlat, nlon, ncft, yr_start=1998, yr_end=2017):
+    """Create synthetic land use timeseries with PCT_CFT [time * cft * lsmlat * lsmlon] on a half degree grid
+    :param: fname:         netcdf file name
+    :param: nlat:          number of latitudes
+    :param: nlon:          number of longitudes
+    :param: ncft:          number of cfts
+    :param: yr_start:      first year of the timeseries
+    :param: yr_end:        last year of the timeseries
+    """
+    rng   = np.random.default_rng(0)
+    years = np.arange(yr_start, yr_end+1)
+
+    ds = nc.Dataset(fname, 'w', format='NETCDF3_64BIT')
+    ds.createDimension('time', None)
+    ds.createDimension('cft', ncft)
+    ds.createDimension('lsmlat', nlat)
+    ds.createDimension('lsmlon', nlon)
+
+    ds.createVariable('time', 'i4', ('time',))[:]       = years
+    ds.createVariable('lsmlat', 'f8', ('lsmlat',))[:]   = 20.25 + 0.5 * np.arange(nlat)
+    ds.createVariable('lsmlon', 'f8', ('lsmlon',))[:]   = 230.25 + 0.5 * np.arange(nlon)
+    ds.createVariable('PCT_CFT', 'f8', ('time', 'cft', 'lsmlat', 'lsmlon'))[:] = 100 * rng.random([len(years), ncft, nlat, nlon])
+    ds.close()
+
+#----------------------------------------------------------
+def synthetic_hist_trans(fname, lat_range, lon_range, frac_missing=0.5):
+    """Fraction of grid with rotation for a subset of the grid as LUH2 (latitudes decreasing), nan where no rotation occurs
+    :param: fname:         land use timeseries file name
+    :param: lat_range:     latitude range of the subset
+    :param: lon_range:     longitude range of the subset
+    :param: frac_missing:  fraction of grid cells without rotation
+    :return:               data array [lsmlat * lsmlon]
+    """
+    rng = np.random.default_rng(1)
+
+    with xr.open_dataset(fname, decode_times=False) as ds:
+        lat = ds['lsmlat'].values
+        lon = ds['lsmlon'].values
+
+    lat = lat[(lat >= lat_range[0]) & (lat <= lat_range[1])][::-1]
+    lon = lon[(lon >= lon_range[0]) & (lon <= lon_range[1])]
+
+    rot_frac = rng.uniform(0.05, 1, size=(len(lat), len(lon)))
+    rot_frac[rng.random(rot_frac.shape) < frac_missing] = np.nan
+
+    return xr.DataArray(rot_frac, dims=('lsmlat', 'lsmlon'), coords={'lsmlat': lat, 'lsmlon': lon})
+
+#----------------------------------------------------------
+def apply_corn_soy_rotation_loop(ds_old, outVar, hist_trans):
+    """Original corn soybean rotation, one grid cell at a time (create_landuse_ts_corn_soy_rot.py before vectorization)
+    :param: ds_old:        source landuse timeseries netcdf dataset
+    :param: outVar:        PCT_CFT variable of the new landuse timeseries (copy of the source values)
+    :param: hist_trans:    fraction of grid with rotation [lsmlat * lsmlon], nan where no rotation occurs
+    """
+    for yr in range(2000, 2016, 2):
+        for lat in hist_trans['lsmlat'].values:
+            for lon in hist_trans['lsmlon'].values:
+                time_inds = np.where(ds_old['time'][:] == yr)[0][0]
+                lat_inds  = np.where(ds_old['lsmlat'][:]  == lat)[0][0]
+                lon_inds  = np.where(ds_old['lsmlon'][:]  == lon)[0][0]
+                if(~np.isnan(hist_trans.sel(lsmlat= lat, lsmlon=lon).values)):
+                    outVar[time_inds, 2, lat_inds, lon_inds] = outVar[time_inds, 2, lat_inds, lon_inds] + hist_trans.sel(lsmlat= lat, lsmlon=lon).values * outVar[time_inds, 8, lat_inds, lon_inds]
+                    outVar[time_inds, 8, lat_inds, lon_inds] = (1 - hist_trans.sel(lsmlat= lat, lsmlon=lon).values) * outVar[time_inds, 8, lat_inds, lon_inds]
+    for yr in range(2001, 2016, 2):
+        for lat in hist_trans['lsmlat'].values:
+            for lon in hist_trans['lsmlon'].values:
+                time_inds = np.where(ds_old['time'][:] == yr)[0][0]
+                lat_inds  = np.where(ds_old['lsmlat'][:]  == lat)[0][0]
+                lon_inds  = np.where(ds_old['lsmlon'][:]  == lon)[0][0]
+                if(~np.isnan(hist_trans.sel(lsmlat= lat, lsmlon=lon).values)):
+                    outVar[time_inds, 8, lat_inds, lon_inds] = outVar[time_inds, 8, lat_inds, lon_inds] + hist_trans.sel(lsmlat= lat, lsmlon=lon).values * outVar[time_inds, 2, lat_inds, lon_inds]
+                    outVar[time_inds, 2, lat_inds, lon_inds] = (1 - hist_trans.sel(lsmlat= lat, lsmlon=lon).values) * outVar[time_inds, 2, lat_inds, lon_inds]
+
+#----------------------------------------------------------
+def rotated_pct_cft(fname_old, fname_new, hist_trans, rotation_fn):
+    """Copy PCT_CFT of the source file to a new file and apply the rotation
+    :return:               (rotated PCT_CFT, elapsed time of the rotation in seconds)
+    """
+    ds_old = nc.Dataset(fname_old)
+    ds     = nc.Dataset(fname_new, 'w', format='NETCDF3_64BIT')
+    for dname, the_dim in ds_old.dimensions.items():
+        ds.createDimension(dname, len(the_dim) if not the_dim.isunlimited() else None)
+
+    outVar    = ds.createVariable('PCT_CFT', ds_old['PCT_CFT'].datatype, ds_old['PCT_CFT'].dimensions)
+    outVar[:] = ds_old['PCT_CFT'][:]
+
+    start   = time.time()
+    rotation_fn(ds_old, outVar, hist_trans)
+    elapsed = time.time() - start
+
+    pct_cft = outVar[:]
+    ds.close()
+    ds_old.close()
+
+    return pct_cft, elapsed
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Check vectorized corn soybean rotation against the original loop on a synthetic land use timeseries')
+parser.add_argument('--nlat', type=int, default=40, help='Number of latitudes of the synthetic grid')
+parser.add_argument('--nlon', type=int, default=60, help='Number of longitudes of the synthetic grid')
+parser.add_argument('--ncft', type=int, default=10, help='Number of cfts')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    fname_old = os.path.join(tmpdir, 'landuse.timeseries.nc')
+    create_synthetic_landuse(fname_old, args.nlat, args.nlon, args.ncft)
+
+    # Subset away from the grid edges, as the US subset of the global grid
+    hist_trans = synthetic_hist_trans(fname_old, lat_range=(25, 35), lon_range=(240, 250))
+
+    pct_cft_loop, loop_time = rotated_pct_cft(fname_old, os.path.join(tmpdir, 'loop.nc'), hist_trans,
+                                              apply_corn_soy_rotation_loop)
+    pct_cft_vec, vec_time   = rotated_pct_cft(fname_old, os.path.join(tmpdir, 'vectorized.nc'), hist_trans,
+                                              apply_corn_soy_rotation)
+
+    with xr.open_dataset(fname_old, decode_times=False) as ds_old:
+        pct_cft_old = ds_old['PCT_CFT'].values
+
+print('Loop %.2f s, vectorized %.3f s, %d grid cells with rotation' % (loop_time, vec_time, int(hist_trans.notnull().sum())))
+
+assert not np.array_equal(pct_cft_loop, pct_cft_old), 'Rotation did not modify PCT_CFT'
+np.testing.assert_array_equal(pct_cft_vec, pct_cft_loop)
+print('Vectorized rotation gives the same PCT_CFT as the loop')
@@ -0,0 +1,111 @@
+"""
+Check that the readers in util_read_data return the same dimensions and values from the Zarr store
+(convert_history_zarr.py) as from the yearly NetCDF history files, on synthetic h0 and h1 files
+"""
+import tempfile
+import argparse
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+import util_read_data
+from util_read_data import read_model_output, read_spinup_model_output, read_col_lev_model_output, read_valid_model_data
+from util_history_zarr import convert_history_to_zarr, read_history_zarr
+from util_regridding import pft_regrid_plan
+
+#----------------------------------------------------------
+def create_synthetic_history(fpath, caseid, yr_start, yr_end, nlat, nlon, npft):
+    """Create synthetic monthly h0 (gridded) and h1 (pft level) history files
+    :param: fpath:         directory path
+    :param: caseid:        model run case id
+    :param: yr_start:      start year
+    :param: yr_end:        end year
+    :param: nlat:          number of latitudes
+    :param: nlon:          number of longitudes
+    :param: npft:          number of pfts in the h1 files
+    :return:               dictionary of list of file names for each history tape (and site level h0 files)
+    """
+    rng    = np.random.default_rng(0)
+    fnames = {'h0': [], 'h1': [], 'site': []}
+
+    for yr in range(yr_start, yr_end+1):
+        time_vals = xr.date_range(str(yr) + '-02-01', periods=12, freq='MS', calendar='noleap', use_cftime=True)
+
+        ds = xr.Dataset(coords={'time': time_vals, 'lat': np.linspace(36.75, 47.25, nlat), 'lon': np.linspace(260.5, 278, nlon)})
+        ds['area'] = (('lat', 'lon'), rng.random([nlat, nlon]))
+        ds['GPP']  = (('time', 'lat', 'lon'), rng.random([12, nlat, nlon]))
+        ds['NEE']  = (('time', 'lat', 'lon'), rng.random([12, nlat, nlon]))
+        fnames['h0'].append(fpath + '/' + caseid + '.elm.h0.' + str(yr) + '-02-01-00000.nc')
+        ds.to_netcdf(fnames['h0'][-1])
+
+        ds = xr.Dataset(coords={'time': time_vals, 'lat': np.linspace(36.75, 47.25, nlat), 'lon': np.linspace(260.5, 278, nlon)})
+        ds['pfts1d_ixy']        = (('pft',), np.tile(np.arange(1, nlon+1), npft // nlon + 1)[:npft].astype(float))
+        ds['pfts1d_jxy']        = (('pft',), np.repeat(np.arange(1, nlat+1), npft // nlat + 1)[:npft].astype(float))
+        ds['pfts1d_itype_veg']  = (('pft',), (np.arange(npft) % 3 + 17).astype(float))
+        ds['GPP']               = (('time', 'pft'), rng.random([12, npft]))
+        fnames['h1'].append(fpath + '/' + caseid + '.elm.h1.' + str(yr) + '-02-01-00000.nc')
+        ds.to_netcdf(fnames['h1'][-1])
+
+        # Site level h0 files
+        time_vals = xr.date_range(str(yr) + '-01-01', periods=365, freq='D', calendar='noleap', use_cftime=True)
+
+        ds = xr.Dataset(coords={'time': time_vals})
+        for var in ['GPP', 'CRPYLD', 'PLANTDAY']:
+            ds[var] = (('time', 'lndgrid'), rng.random([365, 1]))
+        fnames['site'].append(fpath + '/' + caseid + '_site.elm.h0.' + str(yr) + '-01-01-00000.nc')
+        ds.to_netcdf(fnames['site'][-1])
+
+    return fnames
+
+#----------------------------------------------------------
+def read_all(fpath, caseid, yr_start, yr_end):
+    """Read the synthetic files with each reader
+    :return:               dictionary of loaded dataset for each reader
+    """
+    # Site level files in memory from the previous read are read again
+    util_read_data.site_history_cache.clear()
+
+    # Second request reads the preloaded variable from memory and the remaining variable from the files
+    read_valid_model_data(fpath, caseid + '_site', range(yr_start, yr_end+1), ['GPP'], preload_varnames=['CRPYLD'])
+
+    return {'read_valid_model_data':     read_valid_model_data(fpath, caseid + '_site', range(yr_start, yr_end+1),
+                                                               ['CRPYLD', 'PLANTDAY']),
+            'read_model_output':                 read_model_output(yr_start, yr_end, fpath, caseid, ['GPP', 'NEE']).load(),
+            'read_spinup_model_output':  read_spinup_model_output(yr_start, yr_end, 1, fpath, caseid, '-02-01', ['GPP'],
+                                                                  decode_times=False).load(),
+            'read_col_lev_model_output': read_col_lev_model_output(yr_start, yr_end, fpath, caseid).load()}
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Check that Zarr and NetCDF history reads give the same dimensions and values')
+parser.add_argument('--nyears', type=int, default=3, help='Number of yearly history files')
+args = parser.parse_args()
+
+caseid   = 'synthetic'
+yr_start = 2001
+yr_end   = yr_start + args.nyears - 1
+
+with tempfile.TemporaryDirectory() as fpath:
+    fnames = create_synthetic_history(fpath, caseid, yr_start, yr_end, nlat=4, nlon=5, npft=20)
+
+    ds_netcdf = read_all(fpath, caseid, yr_start, yr_end)
+
+    for hist in ['h0', 'h1', 'site']:
+        convert_history_to_zarr(fnames[hist])
+        assert read_history_zarr(fnames[hist]) is not None, 'Zarr store of the ' + hist + ' files is not used'
+
+    ds_zarr = read_all(fpath, caseid, yr_start, yr_end)
+
+    for reader in ds_netcdf:
+        assert set(ds_netcdf[reader].data_vars) == set(ds_zarr[reader].data_vars), reader
+        for var in ds_netcdf[reader].data_vars:
+            assert ds_netcdf[reader][var].dims == ds_zarr[reader][var].dims, \
+                '%s %s: NetCDF %s, Zarr %s' % (reader, var, ds_netcdf[reader][var].dims, ds_zarr[reader][var].dims)
+            np.testing.assert_array_equal(ds_netcdf[reader][var].values, ds_zarr[reader][var].values)
+        print('%s: same dimensions and values' % reader)
+
+    # Regridding plan is built from the h1 metadata of both readers
+    assert np.array_equal(pft_regrid_plan(ds_netcdf['read_col_lev_model_output']).flat_index,
+                          pft_regrid_plan(ds_zarr['read_col_lev_model_output']).flat_index)
+    print('pft_regrid_plan: same plan')
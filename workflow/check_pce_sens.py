@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Check the native PCE evaluation and Sobol sensitivities in utils.py without UQTk: random Legendre-Uniform
+expansions are evaluated with numpy Legendre polynomials, and mean, variance, main, total and joint
+sensitivities are compared against Gauss-Legendre tensor quadrature of the expansion
+"""
+import argparse
+import itertools
+import numpy as np
+from numpy.polynomial import legendre
+
+import utils as mu
+
+#----------------------------------------------------------
+def random_multiindex(rng, ndim, order, npc):
+    """Random multiindex with the constant term and npc-1 other terms up to total order
+    :param: rng:           numpy random generator
+    :param: ndim:          number of dimensions
+    :param: order:         maximum total order
+    :param: npc:           number of terms
+    :return:               multiindex (npc, ndim)
+    """
+    terms = np.array([mi for mi in itertools.product(range(order+1), repeat=ndim) if 0 < sum(mi) <= order])
+    terms = terms[rng.choice(len(terms), size=min(npc-1, len(terms)), replace=False)]
+
+    return np.vstack([np.zeros((1, ndim), dtype=int), terms])
+
+#----------------------------------------------------------
+def pce_eval_reference(xdata, mi, pccf):
+    """Evaluate a Legendre-Uniform PC expansion term by term with numpy Legendre polynomials"""
+    ydata = np.zeros(xdata.shape[0])
+    for term, cf in zip(mi, pccf):
+        psi = np.ones(xdata.shape[0])
+        for idim, order in enumerate(term):
+            psi *= legendre.legval(xdata[:, idim], np.eye(order+1)[order])
+        ydata += cf * psi
+
+    return ydata
+
+#----------------------------------------------------------
+def quadrature_sens(mi, pccf):
+    """Mean, variance, main, total and joint Sobol sensitivities by tensor Gauss-Legendre quadrature
+    :return:               mainsens, totsens (ndim,), jointsens (ndim, ndim), mean, var
+    """
+    ndim  = mi.shape[1]
+    nq    = mi.max() + 1
+
+    # Quadrature of the uniform density on [-1,1], exact for the squared expansion
+    xq, wq = legendre.leggauss(nq)
+    wq     = wq / 2
+
+    grid  = np.array(list(itertools.product(xq, repeat=ndim)))
+    fgrid = pce_eval_reference(grid, mi, pccf).reshape((nq,) * ndim)
+
+    def expect(f, axes):
+        """Expectation over the given axes"""
+        for axis in sorted(axes, reverse=True):
+            f = np.tensordot(f, wq, axes=([axis], [0]))
+        return f
+
+    def cond_var(keep):
+        """Variance of the conditional expectation given the kept dimensions"""
+        fcond = expect(fgrid, [i for i in range(ndim) if i not in keep])
+        return expect(fcond**2, range(len(keep))) - mean**2
+
+    mean = expect(fgrid, range(ndim))
+    var  = expect(fgrid**2, range(ndim)) - mean**2
+
+    mainsens  = np.array([cond_var([i]) for i in range(ndim)]) / var
+    totsens   = np.array([1 - cond_var([j for j in range(ndim) if j != i]) / var for i in range(ndim)])
+    jointsens = np.diag(mainsens)
+    for i, j in itertools.combinations(range(ndim), 2):
+        jointsens[i, j] = cond_var([i, j]) / var - mainsens[i] - mainsens[j]
+
+    return mainsens, totsens, jointsens, mean, var
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Check native PCE evaluation and Sobol sensitivities against quadrature')
+parser.add_argument('--ndim', type=int, default=4, help='Number of dimensions')
+parser.add_argument('--order', type=int, default=3, help='Maximum total order')
+parser.add_argument('--nout', type=int, default=20, help='Number of outputs')
+parser.add_argument('--tol', type=float, default=1e-10, help='Tolerance on the absolute difference')
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+
+# Half of the outputs share a multiindex, so pce_sens_grouped stacks their coefficients
+mi_shared = random_multiindex(rng, args.ndim, args.order, 15)
+mis = [mi_shared if (iout % 2 == 0) else random_multiindex(rng, args.ndim, args.order, 15) for iout in range(args.nout)]
+cfs = [rng.normal(size=mi.shape[0]) for mi in mis]
+
+mainsens, totsens, jointsens, mean, var = mu.pce_sens_batch('LU', mis, cfs)
+grouped = mu.pce_sens_grouped('LU', mis, cfs)
+
+xdata  = rng.uniform(-1, 1, size=(100, args.ndim))
+maxerr = {'ydata': 0.0, 'mainsens': 0.0, 'totsens': 0.0, 'jointsens': 0.0, 'mean': 0.0, 'var': 0.0, 'grouped': 0.0}
+
+for iout in range(args.nout):
+    maxerr['ydata'] = max(maxerr['ydata'], np.max(np.abs(mu.pce_eval(xdata, 'LU', mis[iout], cfs[iout]) -
+                                                         pce_eval_reference(xdata, mis[iout], cfs[iout]))))
+
+    native = [mainsens[iout], totsens[iout], jointsens[iout], mean[iout], var[iout]]
+    for name, nat, ref in zip(['mainsens', 'totsens', 'jointsens', 'mean', 'var'], native, quadrature_sens(mis[iout], cfs[iout])):
+        maxerr[name] = max(maxerr[name], np.max(np.abs(nat - ref)))
+
+    for nat, grp in zip([mainsens, totsens, mean, var], grouped):
+        maxerr['grouped'] = max(maxerr['grouped'], np.max(np.abs(nat[iout] - grp[iout])))
+
+for name in maxerr:
+    print('Maximum absolute difference %-10s %.3e' % (name, maxerr[name]))
+
+failed = [name for name in maxerr if not (maxerr[name] <= args.tol)]
+if (len(failed) > 0):
+    raise AssertionError('Native PCE differs from the reference for ' + ', '.join(failed))
+print('Native PCE evaluation and sensitivities agree with quadrature')
@@ -0,0 +1,103 @@
+"""
+Check the site observation climatologies served by read_site_level_obs (reduce_obs_climatology) against annual and
+monthly statistics estimated one year and month at a time, on synthetic daily and monthly observation files
+"""
+import os
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+import util_read_data
+import util_stats_cache
+from util_read_data import read_site_level_obs, site_obs_climatology
+
+#----------------------------------------------------------
+def write_site_obs(site, crop, freq, nyears, rng):
+    """Write synthetic site observations with missing values
+    :param: site:          site ID
+    :param: crop:          crop name
+    :param: freq:          D for daily or monthly (middle of the month) observations
+    :param: nyears:        number of years
+    :param: rng:           numpy random generator
+    """
+    if (freq == 'D'):
+        time_vals = pd.date_range('2002-01-01', str(2002 + nyears - 1) + '-12-31', freq='D')
+    else:
+        time_vals = pd.date_range('2002-01-01', periods=12*nyears, freq='MS') + pd.Timedelta(days=14)
+
+    ds = xr.Dataset(coords={'time': time_vals})
+    for var in ['GPP', 'ER']:
+        values = rng.random(len(time_vals))
+        values[rng.random(len(time_vals)) < 0.002] = np.nan
+        ds[var] = ('time', values)
+
+    obsdir = util_read_data.site_obs_dir + site + '_' + crop + '/'
+    os.makedirs(obsdir)
+    ds.to_netcdf(obsdir + site + '_' + crop + '_select_var.nc')
+
+    return ds
+
+#----------------------------------------------------------
+def reference_stats(da, daily_data, month_str):
+    """Annual and monthly climatologies one year and month at a time
+    :return:               dictionary of (time period, est_mon_total) and values (monthly values for each month)
+    """
+    da    = da.to_series()
+    years = da.index.year
+    if daily_data:
+        days = pd.Series(1, index=da.index)
+    else:
+        days = pd.Series(da.index.days_in_month, index=da.index)
+
+    annual_total = np.nanmean([(da[years == yr] * days[years == yr]).sum(skipna=False) for yr in np.unique(years)])
+    annual_mean  = np.mean([da[years == yr].mean() for yr in np.unique(years)])
+
+    monthly_total = {}
+    monthly_mean  = {}
+    for mon, name in enumerate(month_str, start=1):
+        in_mon = (da.index.month == mon)
+        totals = [(da[in_mon & (years == yr)] * days[in_mon & (years == yr)]).sum(skipna=False) for yr in np.unique(years)]
+        monthly_total[name] = np.nanmean(totals)
+        monthly_mean[name]  = da[in_mon].mean()
+
+    return {('Annual', True): annual_total, ('Annual', False): annual_mean,
+            ('Monthly', True): monthly_total, ('Monthly', False): monthly_mean}
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Check site observation climatologies against statistics estimated one year and month at a time')
+parser.add_argument('--nyears', type=int, default=4, help='Number of years of observations')
+args = parser.parse_args()
+
+rng       = np.random.default_rng(0)
+month_str = util_read_data.all_mon_str
+crop      = 'Corn'
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    util_read_data.site_obs_dir       = tmpdir + '/'
+    util_stats_cache.stats_cache_dir  = tmpdir + '/stats_cache/'
+
+    for site, freq in [('US-Daily', 'D'), ('US-Monthly', 'M')]:
+        ds_obs = write_site_obs(site, crop, freq, args.nyears, rng)
+
+        for var, conv_factor in [('GPP', 1.0), ('ER', 2.0)]:
+            ref = reference_stats(ds_obs[var], freq == 'D', month_str)
+
+            # Annual statistics first, daily observations only need monthly totals for monthly statistics
+            for time_period in ['Annual', 'Monthly']:
+                for est_mon_total in [True, False]:
+                    if (time_period == 'Annual'):
+                        obs = read_site_level_obs(site, crop, var, conv_factor, time_period, est_mon_total)
+                        np.testing.assert_allclose(obs, ref[(time_period, est_mon_total)] / conv_factor, rtol=1e-10)
+                    else:
+                        for month in month_str:
+                            obs = read_site_level_obs(site, crop, var, conv_factor, time_period, est_mon_total, month)
+                            np.testing.assert_allclose(obs, ref[(time_period, est_mon_total)][month] / conv_factor, rtol=1e-10)
+
+        print('%s: annual and monthly climatologies agree' % site)
+
+    site_obs_climatology.cache_clear()
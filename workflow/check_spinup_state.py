@@ -0,0 +1,112 @@
+"""
+Check that the incremental spinup state (update_spinup_state) gives the same equilibrium drift as reading all
+spinup history files (read_spinup_model_output) on a synthetic spinup, as history files are added and modified
+"""
+import os
+import tempfile
+import argparse
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_read_data import read_spinup_model_output
+from util_equilibrium import equilibrium_drift, update_spinup_state
+
+#----------------------------------------------------------
+def write_spinup_file(fpath, caseid, yr, nyears_file, nlat, nlon, rng):
+    """Write a synthetic monthly spinup history file with pools drifting towards equilibrium
+    :param: fpath:         directory path
+    :param: caseid:        model run case id
+    :param: yr:            first year of the file
+    :param: nyears_file:   number of years in the file
+    :param: nlat:          number of latitudes
+    :param: nlon:          number of longitudes
+    :param: rng:           numpy random generator
+    :return:               file name
+    """
+    ntime     = 12 * nyears_file
+    time_vals = 365 * (yr - 1) + 365 / 12 * np.arange(1, ntime + 1)
+    years     = time_vals[:, np.newaxis, np.newaxis] / 365
+
+    ds = xr.Dataset(coords={'time': ('time', time_vals, {'units': 'days since 0001-01-01 00:00:00', 'calendar': 'noleap'}),
+                            'lat': np.linspace(36.75, 47.25, nlat), 'lon': np.linspace(260.5, 278, nlon)})
+    ds['TOTECOSYSC'] = (('time', 'lat', 'lon'), 2e4 * (1 - np.exp(-years / 50)) + rng.normal(0, 10, [ntime, nlat, nlon]))
+    ds['NEE']        = (('time', 'lat', 'lon'), np.sin(2 * np.pi * years) + rng.normal(0, 0.1, [ntime, nlat, nlon]))
+    ds['GPP']        = (('time', 'lat', 'lon'), rng.random([ntime, nlat, nlon]))
+
+    # Grid cells without land
+    ds['TOTECOSYSC'][:, 0, 0] = np.nan
+
+    fname = fpath + '/' + caseid + '.elm.h0.' + str(yr).zfill(4) + '-01-01-00000.nc'
+    ds.to_netcdf(fname)
+
+    return fname
+
+#----------------------------------------------------------
+def compare_drift(fpath, caseid, yr_end, yr_step, varnames, nyears, nfiles):
+    """Equilibrium drift from the incremental state and from all history files
+    :param: nfiles:        number of history files written so far
+    :return:               (number of newly read files, maximum absolute difference of each drift variable)
+    """
+    ds_state, new_fnames = update_spinup_state(fpath + '/state.nc', 1, yr_end, yr_step, fpath, caseid, '-01-01', varnames, min_age=0)
+    ds_all = read_spinup_model_output(1, nfiles * yr_step, yr_step, fpath, caseid, '-01-01', varnames, decode_times=False).load()
+
+    assert np.array_equal(ds_state['time'].values, ds_all['time'].values), 'Time steps of the state differ'
+
+    drift = []
+    for ds in [ds_state, ds_all]:
+        ds = ds.assign_coords(time=ds['time'] / 365)
+        drift.append(equilibrium_drift(ds, varnames, nyears=nyears))
+
+    maxerr = {}
+    for var in ['mean', 'slope', 'rel_drift', 'nvalid', 'converged']:
+        diff = np.abs(drift[0][var].values.astype(float) - drift[1][var].values.astype(float))
+        assert np.array_equal(np.isnan(drift[0][var].values.astype(float)), np.isnan(drift[1][var].values.astype(float))), var
+        maxerr[var] = np.nanmax(diff)
+
+    return len(new_fnames), maxerr
+
+# -----------------------------------------------------------
+parser = argparse.ArgumentParser(description='Check that incremental and full spinup reads give the same equilibrium drift')
+parser.add_argument('--nfiles', type=int, default=6, help='Number of spinup history files')
+parser.add_argument('--yr_step', type=int, default=5, help='Years in each history file')
+parser.add_argument('--tol', type=float, default=1e-10, help='Tolerance on the absolute difference')
+args = parser.parse_args()
+
+caseid   = 'synthetic_spinup'
+varnames = ['TOTECOSYSC', 'NEE', 'GPP']
+yr_end   = args.nfiles * args.yr_step
+nyears   = yr_end // 2
+rng      = np.random.default_rng(0)
+
+with tempfile.TemporaryDirectory() as fpath:
+    fnames = [write_spinup_file(fpath, caseid, yr, args.yr_step, 4, 5, rng) for yr in range(1, yr_end + 1, args.yr_step)]
+
+    # Files are written while the spinup runs, the state is updated after each file
+    for fname in fnames:
+        mtime = os.path.getmtime(fname)
+        os.utime(fname, (mtime - 3600, mtime - 3600))
+
+    checks = []
+    for nfiles in range(1, args.nfiles + 1):
+        for fname in fnames[nfiles:]:
+            os.rename(fname, fname + '.later')
+        checks.append(('%d files' % nfiles, compare_drift(fpath, caseid, yr_end, args.yr_step, varnames, nyears, nfiles)))
+        for fname in fnames[nfiles:]:
+            os.rename(fname + '.later', fname)
+
+    # Modified history file is read again
+    write_spinup_file(fpath, caseid, 1, args.yr_step, 4, 5, rng)
+    checks.append(('modified file', compare_drift(fpath, caseid, yr_end, args.yr_step, varnames, nyears, args.nfiles)))
+
+    # Unchanged files are not read
+    checks.append(('no new files', compare_drift(fpath, caseid, yr_end, args.yr_step, varnames, nyears, args.nfiles)))
+
+for name, (nnew, maxerr) in checks:
+    print('%-14s %d new files, maximum absolute difference %s' % (name, nnew, ', '.join('%s %.1e' % item for item in maxerr.items())))
+    assert all(err <= args.tol for err in maxerr.values()), name
+
+assert [nnew for name, (nnew, maxerr) in checks] == [1] * args.nfiles + [1, 0]
+print('Incremental spinup state gives the same equilibrium drift as reading all history files')
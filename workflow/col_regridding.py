@@ -1,13 +1,7 @@
-import os
-import numpy as np
-import xarray as xr
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
+import argparse
 
-from util_read_data import *
-from util_spatial_plots import *
 from util_myDict_labels import *
+from util_regrid_cases import *
 
 # ----------------------------------------------------
 # Modified from PFT-Gridding.ipynb in ctsm_python_gallery
@@ -15,200 +9,40 @@ from util_myDict_labels import *
 # ----------------------------------------------------
 
 # -----------------------------------------------------------
-def convert_2D_to_5D(mod_ds, mod_res, yr_start, yr_end, var):
-    """ Convert 2D output to 5D output 
-    :param mod_ds:   ELM h1 output in xarray format
-    :param mod_ds:   ELM restart output in xarray format
-    :param: yr_start start year for reading model output
-    :param: yr_end   end year for reading model output
-    :param varname:  ELM output variable name
-    :return:         regridded xarray [years * month * cft * lat * lon]
-    """
-    # Reading in variables from ELM output file
-    years     = np.arange(yr_start, yr_end+1, 1)
-    month     = np.arange(0, 12, 1)
-    
-    lat       = mod_ds.lat # For smallville - mod_ds.lat[0]
-    lon       = mod_ds.lon # For smallville - mod_ds.lon[0]
-    time      = mod_ds.time
-    ixy       = mod_ds.cols1d_ixy.isel(time=0)
-    jxy       = mod_ds.cols1d_jxy.isel(time=0)
-    coltype   = mod_res.cols1d_ityp  # Get coltype information from the restart file
-    var_data  = mod_ds[var]
-
-    nlat      = len(lat.values)
-    nlon      = len(lon.values)
-    ntime     = len(time.values)
-    ncol      = np.max(coltype).astype(int)
-    num_years = len(time)//12
-
-    # Creating gridded array
-    gridded = np.empty([ntime, ncol.values+1, nlat, nlon])
-
-    # Assign ELM output variable values to the correct locations in the empty grid
-    gridded[:, coltype.values.astype(int), jxy.values.astype(int) - 1, ixy.values.astype(int) - 1] = var_data.values
-
-    # Adding dimensions and coordinates
-    gridded_da      = xr.DataArray(gridded, dims=('time', 'col', 'lat', 'lon'))
-    gridded_da      = gridded_da.assign_coords(time=mod_ds.time, col=range(0, ncol.values+1), lat=lat.values, lon=lon.values)
-    gridded_da.name = var
-
-    # Reshaping the time dimension to year, month
-    reshaped       = gridded_da.values.reshape(num_years, 12, *gridded_da.values.shape[1:])
-    output_reshape = xr.DataArray(reshaped, dims=('years', 'month', 'col', 'lat', 'lon'))
-    output_reshape = output_reshape.assign_coords(years=years, month=month, col=range(0, ncol.values+1), lat=lat.values, lon=lon.values)
-  
-    return output_reshape
-
-# -----------------------------------------------------------
-def apply_cropwts_cft(lu_ts, yr_start, yr_end, output_reshape):
-    """ Apply crop weight mask to cfts
-    :param lu_ts:          land use timeseries
-    :param output_reshape: reshaped model output
-    :return:               reshaped model output with crop weights applied to cfts
-    """
-    # Reading in variables from land use timeseriees file
-    pctcft  = lu_ts.PCT_CFT
-    pctcrop = lu_ts.PCT_CROP
-
-    # Defining proportion of each crop type (pctcft) within the grid crop area (pctcrop)
-    cropwts     = (pctcft/100) * (pctcrop/100)
-
-    # Masking regions with crop area <0.5%
-    cropwtsmask = cropwts.where(cropwts>0.005)
-
-    # Plotting multiple DataArrays in a Dataset
-    da_plot = cropwtsmask.isel(time=150, cft=[2, 8])
-
-    # Replace zero values with nan
-    da_plot.values[da_plot.values == 0] = np.nan
-
-    subplot_titles = ['Corn','Soybean']
-    cmap_col = 'jet'
-
-    facet_plot_US(da_plot, subplot_titles, colplot='cft', colwrap=1, cmap_col=cmap_col, cbar_label='Crop weight mask [unitless]', 
-                  fig_wt=11, fig_ht=14, fig_extent=fig_extent, show_states=True, fname='cropwtsmask_US_Midwest_corn_soybean.png')
-
-    # Renaming dimensions
-    cropwtsmask = cropwtsmask.rename({'time':'years', 'cft':'col', 'lsmlat':'lat', 'lsmlon':'lon'})
-
-    # Subset masks between years
-    cropwtsmask = cropwtsmask.sel(years = cropwtsmask.years.isin(range(yr_start, yr_end+1)))
-
-    # Subset only 36 cfts from the re gridded output
-    output_reshape_cft = output_reshape.isel(col = slice(215, 251))
-
-    # Assign cft names to crop weights mask
-    cropwtsmask['col'] = output_reshape_cft.col
-
-    # Apply the crop weight mask to cfts level model output
-    output_cft_cropwts = output_reshape_cft * cropwtsmask
-
-    # Subsetting the natural PFTs to prepare for concatenation
-    output_reshape_pft = output_reshape.isel(col = slice(0, 215))
-
-    # Concatenate pft and crops weight applied cfts
-    output_reshape_cropwts = xr.concat([output_reshape_pft, output_cft_cropwts], dim='col')
-
-    return output_reshape_cropwts
-
-# -----------------------------------------------------------
-def reshape_time_dim(output_reshape_cropwts, mod_ds):
-    """ Reshape years x month to time dimension
-    :param output_reshape_cropwts: reshaped model output with crop weights applied to cfts
-                                   dim - years x month x col x lat x lon
-    :param mod_ds:                 ELM h1 output in xarray format
-    :return:                       reshaped model output with time dimension
-                                   dim - time x col x lat x lon
-    """
-    lat = output_reshape_cropwts.lat
-    lon = output_reshape_cropwts.lon
-    col = output_reshape_cropwts.col
-
-    # Reshaping the time dimension to year, month
-    reshaped       = output_reshape_cropwts.values.reshape(len(mod_ds.time), *output_reshape_cropwts.values.shape[2:])
-    output_reshape_final = xr.DataArray(reshaped, dims=('time', 'col', 'lat', 'lon'))
-    output_reshape_final = output_reshape_final.assign_coords(time=mod_ds.time.values, col=col.values, lat=lat.values, lon=lon.values)
-
-    return output_reshape_final
-
-# -----------------------------------------------------------
-# Read ELM h1 output file containing output in 1D vector format
-#caseid = '20220512_20x34_corn_soy_rot_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220512_20x34_corn_soy_rot_US-Ro1_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220512_20x34_corn_soy_rot_US-UiC_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220512_20x34_corn_soy_rot_default_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220609_20x34_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220609_20x34_US-Ro1_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20220609_20x34_US-UiC_param_ELM_USRDAT_ICBELMCNCROP_trans'
-caseid = '20230114_20x34_corn_soy_rot_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_corn_soy_rot_US-Ro1_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_corn_soy_rot_US-UiC_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_corn_soy_rot_default_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_US-Ro1_param_ELM_USRDAT_ICBELMCNCROP_trans'
-#caseid = '20230114_20x34_US-UiC_param_ELM_USRDAT_ICBELMCNCROP_trans'
-
-fpath  = '/compyfs/sinh210/e3sm_scratch/' + caseid + '/run/'
-
 # Four steps for creating the files with and without weights
-# 1. check out_fname
-# 2. check varnames (only ER is saved with weights applied)
-# 3. check if apply_cropwts_cft is called or not (only ER is saved with weights applied)
-# 4. check correct lu_ts is used with the set (2 lu ts with and without crop rotation)
+# 1. check --out_suffix
+# 2. check --varnames (only ER is saved with weights applied)
+# 3. check --cropwts_vars (only ER is saved with weights applied)
+# 4. land use timeseries with or without crop rotation is selected from the caseid
 
-# ER at pft level is saved with and without PCT_CROP and PCT_CFT weight being applied
+# ER at col level is saved with and without PCT_CROP and PCT_CFT weight being applied
 # When plotting the whole grid we use ER with the pct_crop and pct_cft weights being applied
 # When plotting outputs to observations for corn/soybean only the percent fraction 
 # is not applied since we are only focussing on the fraction of the grid with corn/soybean on it.
-#out_fname = caseid + '_column_regridded.nc'
-out_fname = caseid + '_column_regridded_weight_applied.nc'
-
-#varnames = ['ER', 'TOTCOLC', 'TOTSOMC']
-varnames = ['ER']
-
-yr_start = 2001
-yr_end   = 2010
-mod_ds   = read_col_lev_model_output(yr_start, yr_end, fpath, caseid)
+#   python col_regridding.py --varnames ER TOTCOLC TOTSOMC --cropwts_vars --out_suffix _column_regridded
+#   python col_regridding.py --varnames ER --cropwts_vars ER --out_suffix _column_regridded_weight_applied
+def main():
+    """ Regrid ELM h1 output of the cases given on the command line """
+    parser = argparse.ArgumentParser(description='Read ELM h1 output in 2D vector format [time, col] and convert to 4D format [time, col, lat, lon]')
+    parser.add_argument('--caseids', nargs='+', default=list(myDict_caseid.values()), help='Case names (default all cases in myDict_caseid)')
+    parser.add_argument('--varnames', nargs='+', default=['ER'], help='ELM output variable names')
+    parser.add_argument('--cropwts_vars', nargs='*', default=['ER'], help='Variables with crop weights applied to cfts')
+    parser.add_argument('--out_suffix', default='_column_regridded_weight_applied', help='Suffix of the output file name')
+    parser.add_argument('--yr_start', type=int, default=2001, help='Start year for reading model output')
+    parser.add_argument('--yr_end', type=int, default=2010, help='End year for reading model output')
+    parser.add_argument('--chunk_size', type=int, default=12, help='Number of months regridded at a time (bounds peak memory)')
+    parser.add_argument('--compact', action='store_true', help='Only write occupied (col, grid cell) pairs as float32')
+    parser.add_argument('--nproc', type=int, default=1, help='Number of cases regridded in parallel')
+    parser.add_argument('--plot_cropwts', action='store_true', help='Plot corn and soybean crop weight mask of the land use timeseries')
+    args = parser.parse_args()
+
+    if args.plot_cropwts:
+        plot_cases_cropwts_mask(args.caseids)
+
+    regrid_cases(args.caseids, nproc=args.nproc, varnames=args.varnames, type_dim='col',
+                 yr_start=args.yr_start, yr_end=args.yr_end, cropwts_vars=args.cropwts_vars,
+                 out_suffix=args.out_suffix, chunk_size=args.chunk_size, compact=args.compact)
 
-# Open a restart file to access cols1d_ityp value that is not stored in h1 files
-fname_res = fpath + '/' + caseid + '.elm.r.' + str(2010) + '-01-01-00000.nc'
-mod_res = xr.open_dataset(fname_res)
-
-for ind, var in enumerate(varnames):
-   # Convert 2D output to 5D output
-   output_reshape = convert_2D_to_5D(mod_ds, mod_res, yr_start, yr_end, var)
-
-   # Read in land use timeseries data
-   # land use timeseries with corn soybean rotation
-   fname = '/compyfs/sinh210/mygetregionaldata/landuse.timeseries_20x34pt_f19_US_Midwest_sub_cru_hist_50pfts_corn_soy_rot_c220216.nc'
-
-   # land use timeseries without corn soybean rotation
-   #fname = '/compyfs/sinh210/mygetregionaldata/landuse.timeseries_20x34pt_f19_US_Midwest_sub_cru_hist_50pfts_c220413.nc'
-   lu_ts = xr.open_mfdataset(fname)
-
-   #output_reshape_cropwts = output_reshape
-   if(var == 'ER'):
-       # Apply crop weight mask to cfts
-       output_reshape_cropwts = apply_cropwts_cft(lu_ts, yr_start, yr_end, output_reshape)
-   #else:
-   #    # Skip applying crop weight masks to cfts
-   #    output_reshape_cropwts = output_reshape
-
-   # Reshape years x month to time dimension
-   output_reshape_final = reshape_time_dim(output_reshape_cropwts, mod_ds)
-
-   # Assign variable name
-   output_reshape_final.name = var
-
-   # Copy attributes
-   output_reshape_final.attrs = mod_ds[var].attrs
-
-   if (ind == 0):
-      mod_ds_regridded = output_reshape_final
-   else:
-      mod_ds_regridded = xr.merge([mod_ds_regridded, output_reshape_final])
-
-# Write xarray to a new NetCDF file
-os.chdir('/compyfs/sinh210/e3sm_scratch/regridded_output/')
-mod_ds_regridded.to_netcdf(path=out_fname, mode='w')
+# -----------------------------------------------------------
+if __name__ == '__main__':
+    main()
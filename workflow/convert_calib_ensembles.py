@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+Convert calibration ensembles and index files of a site and crop from text to .npy files,
+which subplots_shade.py reads as memory maps instead of parsing the text files
+"""
+import os
+import time
+import argparse
+import numpy as np
+
+import utils as mu
+
+# Ensembles (samples x outputs) and other float arrays
+ensemble_files = ['ytrain.dat', 'post_pred.dat']
+float_files    = ['xdata_all.txt'] + ['ydata_plot_' + key + '.dat' for key in ['GPP', 'ER', 'LE', 'H']]
+
+# Index files
+int_files = ['ind_y_stat.dat'] + [prefix + key + '.dat' for prefix in ['ind_plot_', 'ind_y_stat_', 'ind_z_stat_']
+                                  for key in ['GPP', 'ER', 'LE', 'H']]
+
+#   python convert_calib_ensembles.py --site US-Ne3 --crop Corn
+parser = argparse.ArgumentParser(description='Convert calibration ensembles of a site and crop from text to .npy files')
+parser.add_argument('--site', default='', help='Site ID')
+parser.add_argument('--crop', default='', help='Modeled crop name')
+args = parser.parse_args()
+
+os.chdir('../site_calib_outputs/')
+
+fnamepre = args.site + '_' + args.crop + '_'
+
+for fnames, dtype, fortran in [(ensemble_files, float, True), (float_files, float, False), (int_files, int, False)]:
+    for fname in fnames:
+        fname = fnamepre + fname
+        if not os.path.exists(fname):
+            continue
+
+        start = time.time()
+        npy   = mu.save_calib_array(fname, dtype=dtype, fortran=fortran)
+        text_time = time.time() - start
+
+        start = time.time()
+        data  = mu.load_calib_array(fname, dtype=dtype)
+        np.asarray(data).sum()
+        npy_time = time.time() - start
+
+        print('%s %s: %.1f MB -> %.1f MB, text %.2f s, npy %.3f s' % (npy, data.shape, os.path.getsize(fname)/1e6,
+              os.path.getsize(npy)/1e6, text_time, npy_time))
@@ -0,0 +1,34 @@
+"""
+Convert yearly ELM history files of each case into a single Zarr store (<caseid>.elm.<hist>.zarr)
+that util_read_data readers use instead of the yearly NetCDF files
+"""
+import time
+import argparse
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_myDict_labels import *
+from util_history_zarr import *
+
+#   python convert_history_zarr.py --hist h0 h1
+#   python convert_history_zarr.py --caseids <caseid> --hist h0 --yr_start 2001 --yr_end 2010
+parser = argparse.ArgumentParser(description='Convert yearly ELM history files of each case into a single Zarr store')
+parser.add_argument('--caseids', nargs='+', default=list(myDict_caseid.values()), help='Case names (default all cases in myDict_caseid)')
+parser.add_argument('--rundir', default='/compyfs/sinh210/e3sm_scratch/', help='Directory containing ELM case directories')
+parser.add_argument('--hist', nargs='+', default=['h0', 'h1'], help='History tapes')
+parser.add_argument('--yr_start', type=int, default=yr_start, help='Start year')
+parser.add_argument('--yr_end', type=int, default=yr_end, help='End year')
+parser.add_argument('--mon_day_str', default='-02-01', help='Month and day in the yearly file names')
+args = parser.parse_args()
+
+for caseid in args.caseids:
+    for hist in args.hist:
+        start = time.time()
+
+        fnames = []
+        for yr in range(args.yr_start, args.yr_end+1):
+            fnames.append(args.rundir + caseid + '/run/' + caseid + '.elm.' + hist + '.' + str(yr).zfill(4) + args.mon_day_str + '-00000.nc')
+
+        store = convert_history_to_zarr(fnames)
+        print('%s: %.1f s' % (store, time.time() - start))
@@ -1,94 +1,85 @@
 import numpy as np
 import pandas as pd
 import xarray as xr
-import pickle
 
 __author__ = 'Eva Sinha'
 __email__  = 'eva.sinha@pnnl.gov'
 
 from util_myDict_labels import *
+from util_region_mask import *
+
+# Dictionary for subregions
+myDict_region = {'Set1': 'Northern_Rockies',
+                 'Set2': 'Upper_Midwest',
+                 'Set3': 'Ohio_Valley'}
+
+myDict_region_no_rot = {'Set1_no_rot': 'Northern_Rockies',
+                        'Set2_no_rot': 'Upper_Midwest',
+                        'Set3_no_rot': 'Ohio_Valley'}
 
 #----------------------------------------------------------
-def create_composite_grid(da_merge, varname):
-    """Create a composite grid by merging certain regions from each set
-    :param: da_merge:      xarray
-    :param: varname:       variable of interest
+def composite_from_region_index(da, region_index, set_names):
+    """Select values for each grid cell from the set assigned to its subregion
+    :param: da:            xarray with Set, lat, and lon dimensions (and any other trailing dimensions)
+    :param: region_index:  integer array [lat * lon] with position of the set in set_names, -1 outside subregions
+    :param: set_names:     list of set names for each subregion
+    :return:               xarray without Set dimension, nan for grid cells outside subregions
     """
+    # Move Set, lat, and lon to the front so the selection can be done along the first axis
+    other_dims = [dim for dim in da.dims if dim not in ('Set', 'lat', 'lon')]
+    da_sets    = da.sel(Set=list(set_names)).transpose('Set', 'lat', 'lon', *other_dims)
 
-    lat  = da_merge.lat
-    lon  = da_merge.lon
+    values  = np.asarray(da_sets.values, dtype=float)
+    in_grid = region_index >= 0
 
-    nlat = len(lat.values)
-    nlon = len(lon.values)
+    # Gather the set value for every grid cell in a single take along the Set axis
+    take_index = np.where(in_grid, region_index, 0)
+    take_index = take_index.reshape(1, *take_index.shape, *([1] * len(other_dims)))
+    composite  = np.take_along_axis(values, take_index, axis=0)[0]
 
-    # Create empty gridded array
-    composite_grid = np.empty([nlat, nlon])
+    # Grid cells outside the subregions are set to nan
+    composite[~in_grid] = np.nan
 
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=('lat', 'lon'))
-    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values)
-    composite_grid.name = varname
+    composite_grid = xr.DataArray(composite, dims=('lat', 'lon', *other_dims))
+    composite_grid = composite_grid.assign_coords({dim: da_sets[dim].values for dim in ('lat', 'lon', *other_dims)})
 
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
+    return composite_grid
 
-    # Dictionary for subregions
-    myDict_region = {'Set1': 'Northern_Rockies',
-                     'Set2': 'Upper_Midwest',
-                     'Set3': 'Ohio_Valley'}
+#----------------------------------------------------------
+def build_composite_grid(da_merge, varname, myDict_region, composite_name, dims=None):
+    """Create a composite grid by merging certain regions from each set
+    :param: da_merge:       xarray
+    :param: varname:        variable of interest
+    :param: myDict_region:  dictionary mapping set name to subregion name
+    :param: composite_name: set name for the composite grid
+    :param: dims:           dimension order of the composite grid (default lat, lon, followed by other dimensions)
+    """
+    region_index = read_region_mask(da_merge.lat.values, da_merge.lon.values, list(myDict_region.values()))
 
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
+    composite_grid = composite_from_region_index(da_merge[varname], region_index, list(myDict_region))
+    if dims is not None:
+        composite_grid = composite_grid.transpose(*dims)
+    composite_grid.name = varname
 
-        for lon, lat in notnull_coords:
-            composite_grid.loc[lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
+    composite_grid = composite_grid.expand_dims(Set = [composite_name])
 
-    composite_grid = composite_grid.expand_dims(Set = ['Composite'])
-    
     return composite_grid
- 
+
 #----------------------------------------------------------
-def create_no_rot_composite_grid(da_merge, varname):
+def create_composite_grid(da_merge, varname):
     """Create a composite grid by merging certain regions from each set
     :param: da_merge:      xarray
     :param: varname:       variable of interest
     """
+    return build_composite_grid(da_merge, varname, myDict_region, 'Composite', dims=('lat', 'lon'))
 
-    lat  = da_merge.lat
-    lon  = da_merge.lon
-
-    nlat = len(lat.values)
-    nlon = len(lon.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([nlat, nlon])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=('lat', 'lon'))
-    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values)
-    composite_grid.name = varname
-
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    # Dictionary for subregions
-    myDict_region = {'Set1_no_rot': 'Northern_Rockies',
-                     'Set2_no_rot': 'Upper_Midwest',
-                     'Set3_no_rot': 'Ohio_Valley'}
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
-
-        for lon, lat in notnull_coords:
-            composite_grid.loc[lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
-
-    composite_grid = composite_grid.expand_dims(Set = ['No_rot_Composite'])
-    
-    return composite_grid
+#----------------------------------------------------------
+def create_no_rot_composite_grid(da_merge, varname):
+    """Create a composite grid by merging certain regions from each set
+    :param: da_merge:      xarray
+    :param: varname:       variable of interest
+    """
+    return build_composite_grid(da_merge, varname, myDict_region_no_rot, 'No_rot_Composite', dims=('lat', 'lon'))
 
 #----------------------------------------------------------
 def create_composite_grid_monthly(da_merge, varname):
@@ -96,42 +87,7 @@ def create_composite_grid_monthly(da_merge, varname):
     :param: da_merge:      xarray
     :param: varname:       variable of interest
     """
-
-    lat    = da_merge.lat
-    lon    = da_merge.lon
-    month  = da_merge.month
-
-    nlat   = len(lat.values)
-    nlon   = len(lon.values)
-    nmonth = len(month.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([nlat, nlon, nmonth])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=('lat', 'lon', 'month'))
-    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values, month=month.values)
-    composite_grid.name = varname
-
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    # Dictionary for subregions
-    myDict_region = {'Set1': 'Northern_Rockies',
-                     'Set2': 'Upper_Midwest',
-                     'Set3': 'Ohio_Valley'}
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
-
-        for lon, lat in notnull_coords:
-            composite_grid.loc[lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
-
-    composite_grid = composite_grid.expand_dims(Set = ['Composite'])
-    
-    return composite_grid
+    return build_composite_grid(da_merge, varname, myDict_region, 'Composite', dims=('lat', 'lon', 'month'))
 
 #----------------------------------------------------------
 def create_no_rot_composite_grid_monthly(da_merge, varname):
@@ -139,132 +95,23 @@ def create_no_rot_composite_grid_monthly(da_merge, varname):
     :param: da_merge:      xarray
     :param: varname:       variable of interest
     """
-
-    lat    = da_merge.lat
-    lon    = da_merge.lon
-    month  = da_merge.month
-
-    nlat   = len(lat.values)
-    nlon   = len(lon.values)
-    nmonth = len(month.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([nlat, nlon, nmonth])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=('lat', 'lon', 'month'))
-    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values, month=month.values)
-    composite_grid.name = varname
-
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    # Dictionary for subregions
-    myDict_region = {'Set1_no_rot': 'Northern_Rockies',
-                     'Set2_no_rot': 'Upper_Midwest',
-                     'Set3_no_rot': 'Ohio_Valley'}
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
-
-        for lon, lat in notnull_coords:
-            composite_grid.loc[lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
-
-    composite_grid = composite_grid.expand_dims(Set = ['No_rot_Composite'])
-    
-    return composite_grid
+    return build_composite_grid(da_merge, varname, myDict_region_no_rot, 'No_rot_Composite', dims=('lat', 'lon', 'month'))
 
 #----------------------------------------------------------
 def create_regridded_composite_grid(da_merge, varname, plot_var):
     """Create a composite grid by merging certain regions from each set
     :param: da_merge:      xarray
     :param: varname:       variable of interest
+    :param: plot_var:      pft or col dimension
     """
+    return build_composite_grid(da_merge, varname, myDict_region, 'Composite', dims=(plot_var, 'lat', 'lon'))
 
-    pft  = da_merge[plot_var]
-    lat  = da_merge.lat
-    lon  = da_merge.lon
-
-    npft = len(pft.values)
-    nlat = len(lat.values)
-    nlon = len(lon.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([npft, nlat, nlon])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=(plot_var, 'lat', 'lon'))
-    if(plot_var == 'pft'):
-       composite_grid = composite_grid.assign_coords(pft=pft.values, lat=lat.values, lon=lon.values)
-    if(plot_var == 'col'):
-       composite_grid = composite_grid.assign_coords(col=pft.values, lat=lat.values, lon=lon.values)
-    composite_grid.name = varname
-
-    # Dictionary for subregions
-    myDict_region = {'Set1': 'Northern_Rockies',
-                     'Set2': 'Upper_Midwest',
-                     'Set3': 'Ohio_Valley'}
-
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
-
-        for lon, lat in notnull_coords:
-            composite_grid.loc[:, lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
-
-    composite_grid = composite_grid.expand_dims(Set = ['Composite'])
- 
-    return composite_grid
 #----------------------------------------------------------
-
 def create_no_rot_regridded_composite_grid(da_merge, varname, plot_var):
     """Create a composite grid by merging certain regions from each set
     :param: da_merge:      xarray
     :param: varname:       variable of interest
+    :param: plot_var:      pft or col dimension
     """
-
-    pft  = da_merge[plot_var]
-    lat  = da_merge.lat
-    lon  = da_merge.lon
-
-    npft = len(pft.values)
-    nlat = len(lat.values)
-    nlon = len(lon.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([npft, nlat, nlon])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=(plot_var, 'lat', 'lon'))
-    if(plot_var == 'pft'):
-       composite_grid = composite_grid.assign_coords(pft=pft.values, lat=lat.values, lon=lon.values)
-    if(plot_var == 'col'):
-       composite_grid = composite_grid.assign_coords(col=pft.values, lat=lat.values, lon=lon.values)
-    composite_grid.name = varname
-
-    # Dictionary for subregions
-    myDict_region = {'Set1_no_rot': 'Northern_Rockies',
-                     'Set2_no_rot': 'Upper_Midwest',
-                     'Set3_no_rot': 'Ohio_Valley'}
-
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
-
-        for lon, lat in notnull_coords:
-            composite_grid.loc[:, lat, lon] = da_merge[varname].sel(Set=key, lat=lat, lon=lon)
-
-    composite_grid = composite_grid.expand_dims(Set = ['No_rot_Composite'])
- 
-    return composite_grid
+    return build_composite_grid(da_merge, varname, myDict_region_no_rot, 'No_rot_Composite', dims=(plot_var, 'lat', 'lon'))
 #----------------------------------------------------------
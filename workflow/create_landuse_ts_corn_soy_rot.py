@@ -4,6 +4,8 @@ Python modules for plotting time series
 
 import os
 import sys
+import time
+import argparse
 import matplotlib as mpl
 mpl.use('Agg')
 import numpy as np
@@ -15,12 +17,80 @@ __email__  = 'eva.sinha@pnnl.gov'
 
 from util_spatial_plots import *
 from util_myDict_labels import *
+from util_corn_soy_rotation import *
+
+# -----------------------------------------------------------
+def create_copy_variable(ds, varin, nc_format, complevel):
+   """ Create variable in new netcdf file with the same dimensions and attributes as source variable
+   :param ds:        new netcdf dataset
+   :param varin:     source netcdf variable
+   :param nc_format: format of the new netcdf file
+   :param complevel: zlib compression level for NETCDF4 format (0 for no compression)
+   :return:          new netcdf variable
+   """
+   # _FillValue can only be set when the variable is created
+   attrs      = {k: varin.getncattr(k) for k in varin.ncattrs()}
+   fill_value = attrs.pop('_FillValue', None)
+
+   kwargs = {}
+   if (nc_format.startswith('NETCDF4') and varin.ndim > 0 and complevel > 0):
+      kwargs = dict(zlib=True, shuffle=True, complevel=complevel)
+
+      # ELM reads one time slice at a time, so each chunk holds a single time slice
+      if (varin.dimensions[0] == 'time' and all(varin.shape)):
+         kwargs['chunksizes'] = (1,) + varin.shape[1:]
+
+   outVar = ds.createVariable(varin.name, varin.datatype, varin.dimensions, fill_value=fill_value, **kwargs)
+
+   # ----- Copy variable attributes -----
+   outVar.setncatts(attrs)
+
+   return outVar
+
+# -----------------------------------------------------------
+def copy_variable_values(varin, outVar, time_chunk, raw=True):
+   """ Copy variable values a block of time slices at a time
+   :param varin:      source netcdf variable
+   :param outVar:     new netcdf variable
+   :param time_chunk: number of time slices copied at a time
+   :param raw:        copy stored values without masking and scaling
+   :return:           copy throughput in MB/s
+   """
+   start = time.time()
+
+   if raw:
+      varin.set_auto_maskandscale(False)
+      outVar.set_auto_maskandscale(False)
+
+   if (varin.ndim > 0 and varin.dimensions[0] == 'time'):
+      ntime = varin.shape[0]
+      for t_start in range(0, ntime, time_chunk):
+         t_slice = slice(t_start, min(t_start + time_chunk, ntime))
+         outVar[t_slice] = varin[t_slice]
+   else:
+      outVar[:] = varin[:]
+
+   if raw:
+      varin.set_auto_maskandscale(True)
+      outVar.set_auto_maskandscale(True)
+
+   nbytes  = varin.size * varin.dtype.itemsize if varin.dtype != str else 0
+   elapsed = max(time.time() - start, 1e-9)
+
+   return nbytes / 1e6 / elapsed
 
 # -----------------------------------------------------------
 # Create modified landuse timeseries with corn soybean rotation
 # based on LUH2 tansition from c4 perennial to c3 n-fixing
-def modify_landuse_ts(fpath, fname, hist_trans):
-
+def modify_landuse_ts(fpath, fname, hist_trans, nc_format='NETCDF3_64BIT', complevel=0, time_chunk=1):
+   """ Create modified landuse timeseries with corn soybean rotation
+   :param fpath:      path of the source landuse timeseries
+   :param fname:      source landuse timeseries file name
+   :param hist_trans: fraction of grid with rotation [lsmlat * lsmlon], nan where no rotation occurs
+   :param nc_format:  format of the new netcdf file (NETCDF3_64BIT or NETCDF4)
+   :param complevel:  zlib compression level for NETCDF4 format (0 for no compression)
+   :param time_chunk: number of time slices copied at a time (bounds memory)
+   """
    filename_old = fpath + fname   
    ds_old       = nc.Dataset(filename_old)
 
@@ -31,7 +101,7 @@ def modify_landuse_ts(fpath, fname, hist_trans):
    if os.path.exists(filename):
       os.remove(filename)
     
-   ds = nc.Dataset(filename, 'w', format='NETCDF3_64BIT')
+   ds = nc.Dataset(filename, 'w', format=nc_format)
 
    # ----- Copy dimensions -----
    # https://gist.github.com/guziy/8543562 
@@ -41,15 +111,12 @@ def modify_landuse_ts(fpath, fname, hist_trans):
 
    # ----- Copy variables -----
    for v_name, varin in ds_old.variables.items():
-      print (v_name, varin.datatype, varin.dimensions) 
-      
-      outVar = ds.createVariable(v_name, varin.datatype, varin.dimensions)
+      outVar = create_copy_variable(ds, varin, nc_format, complevel)
 
-      # ----- Copy variable attributes -----
-      outVar.setncatts({k: varin.getncattr(k) for k in varin.ncattrs()})
-    
       # ----- Copy variable values -----
-      outVar[:] = varin[:]
+      # Variables not modified by the rotation are copied as stored values
+      mb_per_s = copy_variable_values(varin, outVar, time_chunk, raw=(v_name != 'PCT_CFT'))
+      print (v_name, varin.datatype, varin.dimensions, '%.1f MB/s' % mb_per_s)
 
       if (v_name == 'PCT_CFT'):
          # Grid cells where corn soybean rotation occurs
@@ -57,33 +124,20 @@ def modify_landuse_ts(fpath, fname, hist_trans):
          # corn should have sum of corn + rotat_frac*soybean area and soybean should have (1-rotat_frac)*soybean %
          # in odd years (2001 2003 2005 2007 2009 2011 2013 2015)
          # soybean should have sum of soybean + rotat_frac*corn area and corn should have (1-rotat_frac)*corn %
-         for yr in range(2000, 2016, 2):
-            for lat in hist_trans['lsmlat'].values:
-               for lon in hist_trans['lsmlon'].values :  
-                 # print(np.where(ds_old['time'][:] == yr))
-                  time_inds = np.where(ds_old['time'][:] == yr)[0][0]
-                  lat_inds  = np.where(ds_old['lsmlat'][:]  == lat)[0][0]
-                  lon_inds  = np.where(ds_old['lsmlon'][:]  == lon)[0][0]
-                  if(~np.isnan(hist_trans.sel(lsmlat= lat, lsmlon=lon).values)):
-                     #print(hist_trans.sel(lsmlat= lat, lsmlon=lon).values)
-                     #print(outVar[time_inds, 2, lat_inds, lon_inds], outVar[time_inds, 8, lat_inds, lon_inds])
-                     outVar[time_inds, 2, lat_inds, lon_inds] = outVar[time_inds, 2, lat_inds, lon_inds] + hist_trans.sel(lsmlat= lat, lsmlon=lon).values * outVar[time_inds, 8, lat_inds, lon_inds]
-                     outVar[time_inds, 8, lat_inds, lon_inds] = (1 - hist_trans.sel(lsmlat= lat, lsmlon=lon).values) * outVar[time_inds, 8, lat_inds, lon_inds]
-                     #print(outVar[time_inds, 2, lat_inds, lon_inds], outVar[time_inds, 8, lat_inds, lon_inds])
-         for yr in range(2001, 2016, 2):
-            for lat in hist_trans['lsmlat'].values:
-               for lon in hist_trans['lsmlon'].values :  
-                  time_inds = np.where(ds_old['time'][:] == yr)[0][0]
-                  lat_inds  = np.where(ds_old['lsmlat'][:]  == lat)[0][0]
-                  lon_inds  = np.where(ds_old['lsmlon'][:]  == lon)[0][0]
-                  if(~np.isnan(hist_trans.sel(lsmlat= lat, lsmlon=lon).values)):
-                     outVar[time_inds, 8, lat_inds, lon_inds] = outVar[time_inds, 8, lat_inds, lon_inds] + hist_trans.sel(lsmlat= lat, lsmlon=lon).values * outVar[time_inds, 2, lat_inds, lon_inds]
-                     outVar[time_inds, 2, lat_inds, lon_inds] = (1 - hist_trans.sel(lsmlat= lat, lsmlon=lon).values) * outVar[time_inds, 2, lat_inds, lon_inds]
+         apply_corn_soy_rotation(ds_old, outVar, hist_trans)
 
    # ----- Close the output file -----
    ds.close()
+   ds_old.close()
 
 # -----------------------------------------------------------
+# The land use timeseries read by the model is written as NETCDF3_64BIT by default, compression is opt-in
+#   python create_landuse_ts_corn_soy_rot.py --nc_format NETCDF4 --complevel 1
+parser = argparse.ArgumentParser(description='Create land use timeseries with corn soybean rotation')
+parser.add_argument('--nc_format', default='NETCDF3_64BIT', choices=['NETCDF3_64BIT', 'NETCDF4'], help='Format of the new land use timeseries')
+parser.add_argument('--complevel', type=int, default=0, help='zlib compression level for NETCDF4 format (0 for no compression)')
+args = parser.parse_args()
+
 # ----- Open landuse timeseries netcdf file -----
 fpath_surf  = '/compyfs/inputdata/lnd/clm2/surfdata_map/'
 fname_surf  = 'landuse.timeseries_360x720cru_hist_50pfts_simyr1850-2015_c220216.nc'
@@ -146,4 +200,4 @@ xr_plot_US(landuse_ts.isel(time=160), plot_title=plot_title, cmap_col=cmap_col,
            fig_wt=6.0, fig_ht=6.0, fig_extent=fig_extent, show_states=True, fname='landuse_ts_PCT_CROP_2010.png')
 
 # Create modified landuse timeseries with corn soybean rotation
-modify_landuse_ts(fpath_surf, fname_surf, hist_trans)
+modify_landuse_ts(fpath_surf, fname_surf, hist_trans, nc_format=args.nc_format, complevel=args.complevel)
@@ -3,6 +3,7 @@ Python modules for making spatial plots of ELM outputs
 """
 import os
 import sys
+import argparse
 import matplotlib as mpl
 mpl.use('Agg')
 import numpy as np
@@ -13,7 +14,10 @@ __author__ = 'Eva Sinha'
 __email__  = 'eva.sinha@pnnl.gov'
 
 from util_vector_plots import *
+from util_spatial_plots import facet_plot
 from util_read_data import *
+from util_site_weights import *
+from util_equilibrium import *
 #------------------------------------
 
 # Dictionary containing units
@@ -32,18 +36,36 @@ yr_start = 1
 yr_end   = 220
 yr_step  = 20
 
+# Number of years at the end of the final spinup used for estimating drift
+drift_nyears = 100
+
 caseid_ad_spinup    = '20230114_20x34_corn_soy_rot_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP_ad_spinup'
 caseid_final_spinup = '20230114_20x34_corn_soy_rot_US-Ne3_param_ELM_USRDAT_ICBELMCNCROP'
 
+#   python evaluate_equilibrium_state.py
+#   python evaluate_equilibrium_state.py --incremental   (only read history files written since the last run)
+parser = argparse.ArgumentParser(description='Evaluate whether ELM spinup has reached equilibrium')
+parser.add_argument('--incremental', action='store_true', help='Keep a state file of history files already read and only read new history files')
+parser.add_argument('--state_dir', default='/compyfs/sinh210/e3sm_scratch/spinup_state/', help='Directory for the state files')
+args = parser.parse_args()
+
 # Read ELM model output for ad spinup
 mon_day_str = '-01-01'
 fpath = '/compyfs/sinh210/e3sm_scratch/' + caseid_ad_spinup + '/run/'
-ds_model_ad_spinup = read_spinup_model_output(yr_start, yr_end, yr_step, fpath, caseid_ad_spinup, mon_day_str, varnames, decode_times=False)
+if args.incremental:
+   ds_model_ad_spinup, new_fnames = update_spinup_state(args.state_dir + caseid_ad_spinup + '_spinup_state.nc', yr_start, yr_end, yr_step, fpath, caseid_ad_spinup, mon_day_str, varnames)
+   print('ad spinup: %d time steps, %d new history files' % (ds_model_ad_spinup.sizes['time'], len(new_fnames)))
+else:
+   ds_model_ad_spinup = read_spinup_model_output(yr_start, yr_end, yr_step, fpath, caseid_ad_spinup, mon_day_str, varnames, decode_times=False)
 ds_model_ad_spinup['time'] = ds_model_ad_spinup['time']/365
 
 # Read ELM model output for final spinup
 fpath = '/compyfs/sinh210/e3sm_scratch/' + caseid_final_spinup + '/run/'
-ds_model_final_spinup = read_spinup_model_output(yr_start+20, yr_end, yr_step, fpath, caseid_final_spinup, mon_day_str, varnames, decode_times=False)
+if args.incremental:
+   ds_model_final_spinup, new_fnames = update_spinup_state(args.state_dir + caseid_final_spinup + '_spinup_state.nc', yr_start+20, yr_end, yr_step, fpath, caseid_final_spinup, mon_day_str, varnames)
+   print('final spinup: %d time steps, %d new history files' % (ds_model_final_spinup.sizes['time'], len(new_fnames)))
+else:
+   ds_model_final_spinup = read_spinup_model_output(yr_start+20, yr_end, yr_step, fpath, caseid_final_spinup, mon_day_str, varnames, decode_times=False)
 
 # Shift final spinup time
 ds_model_final_spinup['time'] = ds_model_final_spinup['time']/365 + 200
@@ -55,6 +77,16 @@ ds_model_merge = xr.merge([ds_model_ad_spinup, ds_model_final_spinup])
 for ind, var in enumerate(varnames):
    ds_model_merge[var] = ds_model_merge[var]/conv_factor[var]
 
+# Drift over the end of the final spinup for every grid cell and variable
+ds_drift = equilibrium_drift(ds_model_merge, varnames, nyears=drift_nyears)
+print(equilibrium_summary(ds_drift).to_string(float_format='%.4g'))
+
+# Compact report with one row for each grid cell and variable
+write_equilibrium_report(ds_drift, '../figures/Equilibrium_report.csv')
+
+# Map of cells that have not converged for each variable
+facet_plot(1 - ds_drift['converged'], colplot='variable', colwrap=3, fig_wt=15, fig_ht=8, fname='Equilibrium_not_converged.png')
+
 # Convert to pandas dataframe
 site_data = [{'SiteID':'US-Ne3', 'lat':41.1651, 'lon':263.5234},
              {'SiteID':'US-Ro1', 'lat':44.7143, 'lon':266.9102},
@@ -62,17 +94,14 @@ site_data = [{'SiteID':'US-Ne3', 'lat':41.1651, 'lon':263.5234},
 
 site_data = pd.DataFrame(data = site_data)
 
-for ind, row in site_data.iterrows():
-
-   # Interpolate values for the site
-   ds_plot = ds_model_merge.interp(lat=row['lat'], lon=row['lon']).to_array()
+# Interpolate values for all sites with bilinear weights estimated once for the grid and sites
+site_wts      = site_bilinear_weights(ds_model_merge['lat'].values, ds_model_merge['lon'].values, site_data)
+ds_plot_merge = apply_site_weights(ds_model_merge.to_array(), site_wts)
+ds_plot_merge = ds_plot_merge.swap_dims({'site': 'SiteID'}).drop_vars(['lat', 'lon'])
 
-   ds_plot.coords['SiteID'] = row['SiteID']
+for ind, row in site_data.iterrows():
 
-   if(ind == 0):
-      ds_plot_merge = ds_plot
-   else:
-      ds_plot_merge = xr.concat([ds_plot_merge, ds_plot], dim='SiteID')
+   ds_plot = ds_plot_merge.sel(SiteID = row['SiteID'])
 
    # Make plot evaluting whether equilibrium is reached for the site
    xarray_facet_line_plot(ds_plot, facet_col='variable', \
@@ -3,6 +3,8 @@ Python modules for making spatial plots of ELM outputs
 """
 import os
 import sys
+import argparse
+import functools
 import matplotlib as mpl
 mpl.use('Agg')
 import numpy as np
@@ -18,67 +20,60 @@ from util_read_data import *
 from util_myDict_labels import *
 from util_estimate_dataset_stats import *
 from util_plot_composite import *
+from util_case_ensemble import *
 
-# ---------- Plot annual fluxes ----------
-# List of variable names that we want to keep
-varnames = ['GPP', 'ER']
+# -----------------------------------------------------------
+def main():
+   """ Make spatial plots of annual and summer monthly ELM output of all cases """
+   #   python plot_ELM_output.py --nproc 7
+   parser = argparse.ArgumentParser(description='Make spatial plots of annual and summer monthly ELM output of all cases')
+   parser.add_argument('--nproc', type=int, default=None, help='Number of cases read in parallel (default one per case up to the number of cores)')
+   args = parser.parse_args()
 
-for ind, var in enumerate(varnames):
+   # List of variable names that we want to keep
+   varnames = ['GPP', 'ER', 'EFLX_LH_TOT', 'FSH', 'TLAI']
 
-   #iterate through dictionary
-   for i, key in enumerate(myDict_caseid):
+   # ---------- Estimate statistics ----------
+   # Annual and summer monthly statistics of all variables are estimated in a single pass through the
+   # history files of each case (in parallel with --nproc)
+   ds_stats = read_case_ensemble(functools.partial(case_monthly_stats, varnames=varnames), nproc=args.nproc)
 
-      # Read ELM model output for select variables
-      fpath = '/compyfs/sinh210/e3sm_scratch/' + myDict_caseid[key] + '/run/'
-      ds_model = read_model_output(yr_start, yr_end, fpath, myDict_caseid[key], var)
+   # ---------- Plot annual fluxes ----------
+   for ind, var in enumerate(['GPP', 'ER']):
 
-      # Estimate mean annual from monthly data
-      da_plot = create_mean_annual_da(ds_model, var, conv_factor[var], est_mon_total=True)
-      
-      # Merge all datasets into a single dataset
-      da_plot = da_plot.expand_dims(Set = [key])
+      # Mean annual total from monthly data
+      da_plot_merge = ds_stats[var + '_annual_total'].rename(var).to_dataset()
 
-      if (i == 0):
-         da_plot_merge = da_plot
-      else:
-         da_plot_merge = xr.merge([da_plot_merge, da_plot])
-
-   # Create a composite grid and plot composite grid and difference between composite grid and original set
-   create_plot_composite(da_plot_merge, var, time_period='Annual', fname_abb='fig_regional_Annual')
-
-# ---------- Plot monthly fluxes ----------
-# List of variable names that we want to keep
-varnames = ['GPP', 'ER', 'EFLX_LH_TOT', 'FSH', 'TLAI']
-
-# Whether to estimate monthly total
-est_mon_total = [True, True, False, False, False]
-select_month = 'August'
-
-for ind, var in enumerate(varnames):
-
-   #iterate through dictionary
-   for i, key in enumerate(myDict_caseid):
-
-      # Read ELM model output for select variables
-      fpath = '/compyfs/sinh210/e3sm_scratch/' + myDict_caseid[key] + '/run/'
-      ds_model = read_model_output(yr_start, yr_end, fpath, myDict_caseid[key], var)
- 
-      # Estimate average monthly for summer months
-      da_plot = create_summer_average_monthly(ds_model, sum_mon, sum_mon_str, var, conv_factor[var], est_mon_total[ind])
-      
-      # Create facet plot showing summer months in different columns
-      cmap_col = 'jet'
-      facet_plot_US(da_plot, subplot_titles='', colplot='month', colwrap=len(sum_mon), \
-                    cmap_col=cmap_col, cbar_label=myDict_labels['Monthly'][var], fig_wt=5*len(sum_mon), fig_ht=8, \
-                    fig_extent=fig_extent, show_states=True, fname=key+'_monthly_'+var+'.png')
-
-      # Merge all datasets into a single dataset 
-      da_plot = da_plot.expand_dims(Set = [key])
-
-      if (i == 0):
-         da_plot_merge = da_plot
+      # Create a composite grid and plot composite grid and difference between composite grid and original set
+      create_plot_composite(da_plot_merge, var, time_period='Annual', fname_abb='fig_regional_Annual')
+
+   # ---------- Plot monthly fluxes ----------
+   # Whether to estimate monthly total
+   est_mon_total = [True, True, False, False, False]
+   select_month = 'August'
+
+   for ind, var in enumerate(varnames):
+
+      # Average monthly (total) for summer months
+      if(est_mon_total[ind]):
+         da_plot_merge = ds_stats[var + '_summer_total'].rename(var).to_dataset()
       else:
-         da_plot_merge = xr.merge([da_plot_merge, da_plot])
+         da_plot_merge = ds_stats[var + '_summer_avg'].rename(var).to_dataset()
+
+      #iterate through dictionary
+      for i, key in enumerate(myDict_caseid):
+
+         da_plot = da_plot_merge[var].sel(Set = key, drop=True)
+
+         # Create facet plot showing summer months in different columns
+         cmap_col = 'jet'
+         facet_plot_US(da_plot, subplot_titles='', colplot='month', colwrap=len(sum_mon), \
+                       cmap_col=cmap_col, cbar_label=myDict_labels['Monthly'][var], fig_wt=5*len(sum_mon), fig_ht=8, \
+                       fig_extent=fig_extent, show_states=True, fname=key+'_monthly_'+var+'.png')
+
+      # Create a composite grid and plot composite grid and difference between composite grid and original set
+      create_plot_composite(da_plot_merge, var, time_period='Monthly', fname_abb='Summer_months')
 
-   # Create a composite grid and plot composite grid and difference between composite grid and original set
-   create_plot_composite(da_plot_merge, var, time_period='Monthly', fname_abb='Summer_months')
+# -----------------------------------------------------------
+if __name__ == '__main__':
+   main()
@@ -1,3 +1,5 @@
+import argparse
+import functools
 import pandas as pd
 import xarray as xr
 import matplotlib.pyplot as plt
@@ -10,86 +12,77 @@ from util_myDict_labels import *
 from util_estimate_dataset_stats import *
 from util_vector_plots import *
 from util_site_estimate import *
+from util_case_ensemble import *
 
 # -----------------------------------------------------------
+def main():
+   """ Make bar plots comparing annual simulated vs observed fluxes at AmeriFlux sites """
+   #   python plot_annual_site_model_obs.py --nproc 7
+   parser = argparse.ArgumentParser(description='Make bar plots comparing annual simulated vs observed fluxes at AmeriFlux sites')
+   parser.add_argument('--nproc', type=int, default=None, help='Number of cases read in parallel (default one per case up to the number of cores)')
+   args = parser.parse_args()
 
-# Read observational site lat and lon
-site_data_corn_orig    = pd.read_csv('site_loc.csv')
-site_data_soybean_orig = pd.read_csv('site_loc.csv')
+   # Read observational site lat and lon
+   site_data_corn_orig    = pd.read_csv('site_loc.csv')
+   site_data_soybean_orig = pd.read_csv('site_loc.csv')
 
-# List of variable names that we want to keep
-varnames = ['GPP', 'ER', 'EFLX_LH_TOT']
+   # List of variable names that we want to keep
+   varnames = ['GPP', 'ER', 'EFLX_LH_TOT']
 
-time_period = 'Annual'
+   time_period = 'Annual'
 
-# Whether to estimate monthly total
-est_mon_total = [True, True, False]
+   # Whether to estimate monthly total
+   est_mon_total = [True, True, False]
 
-for ind, var in enumerate(varnames):
+   for ind, var in enumerate(varnames):
 
-   if(var in ['GPP','ER']):
-      # Subset sites that have carbon flux data
-      site_data_corn    = site_data_corn_orig[site_data_corn_orig['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
-      site_data_soybean = site_data_soybean_orig[site_data_soybean_orig['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
-   elif(var == 'EFLX_LH_TOT'):
-      # Remove column that checks for carbon flux data
-      site_data_corn    = site_data_corn_orig.drop(['carbon_flux'], axis=1)
-      site_data_soybean = site_data_soybean_orig.drop(['carbon_flux'], axis=1)
+      if(var in ['GPP','ER']):
+         # Subset sites that have carbon flux data
+         site_data_corn    = site_data_corn_orig[site_data_corn_orig['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
+         site_data_soybean = site_data_soybean_orig[site_data_soybean_orig['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
+      elif(var == 'EFLX_LH_TOT'):
+         # Remove column that checks for carbon flux data
+         site_data_corn    = site_data_corn_orig.drop(['carbon_flux'], axis=1)
+         site_data_soybean = site_data_soybean_orig.drop(['carbon_flux'], axis=1)
 
-   # Read and add observed flux to the site data data frame
-   site_data_corn    = add_obs_site_data(site_data_corn, 'corn', var, obs_conv_factor[var], time_period, est_mon_total[ind])
-   site_data_soybean = add_obs_site_data(site_data_soybean, 'soybean', var, obs_conv_factor[var], time_period, est_mon_total[ind])
+      # Read and add observed flux to the site data data frame
+      site_data_corn    = add_obs_site_data(site_data_corn, 'corn', var, obs_conv_factor[var], time_period, est_mon_total[ind])
+      site_data_soybean = add_obs_site_data(site_data_soybean, 'soybean', var, obs_conv_factor[var], time_period, est_mon_total[ind])
 
-   #iterate through dictionary
-   for i, key in enumerate(myDict_caseid):
+      # Read regridded output and estimate statistics for all cases (in parallel with --nproc)
+      da_plot_merge = read_case_ensemble(functools.partial(case_regridded_mean_annual, var=var, est_mon_total=est_mon_total[ind]), nproc=args.nproc)
 
-      # Read ELM model output for select variables
-      fpath = '/compyfs/sinh210/e3sm_scratch/regridded_output/'
-      if(var in ['GPP','EFLX_LH_TOT']):
-         fname = myDict_caseid[key] + '_regridded.nc'
-      
-         ds_model = xr.open_mfdataset(fpath + fname)
+      #iterate through dictionary
+      for i, key in enumerate(myDict_caseid):
 
-         # Subset data for corn and soybean
-         ds_model = ds_model.sel(pft = ds_model.pft.isin(['corn', 'soybean']))
+         da_plot = da_plot_merge.sel(Set = key, drop=True)
 
-      elif(var == 'ER'):
-         fname = myDict_caseid[key] + '_column_regridded.nc'
-      
-         ds_model = xr.open_mfdataset(fpath + fname)
+         # Interpolate ELM outputs for site lat lon save in data frame
+         site_data_corn    = site_data_interp(site_data_corn, 'corn', da_plot, key)
+         site_data_soybean = site_data_interp(site_data_soybean, 'soybean', da_plot, key)
 
-         # Subset data for corn and soybean
-         ds_model = ds_model.sel(col = ds_model.col.isin([217, 223]))
-         ds_model = ds_model.assign_coords(time=ds_model.time.values, col=['corn','soybean'], lat=ds_model.lat.values, lon=ds_model.lon.values)
+      # Update site data output to add composite set result as new column
+      site_data_corn    = site_data_add_composite(site_data_corn)
+      site_data_soybean = site_data_add_composite(site_data_soybean)
 
-         # Rename coordinates
-         ds_model = ds_model.rename({'col': 'pft'})
+      bar_plot(site_data_corn,    ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_corn.png')
+      bar_plot(site_data_soybean, ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_soybean.png')
 
-      # Estimate mean annual from monthly data
-      da_plot = create_mean_annual_da(ds_model[var], var, conv_factor[var], est_mon_total[ind])
+      # Make bar plots with facetting for corn and soybean
+      bar_subplots(site_data_corn, site_data_soybean, title_1='Corn', title_2='Soybean', \
+                   ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_pft.png')
 
-      # Interpolate ELM outputs for site lat lon save in data frame
-      site_data_corn    = site_data_interp(site_data_corn, 'corn', da_plot, key)
-      site_data_soybean = site_data_interp(site_data_soybean, 'soybean', da_plot, key)
+      site_data_corn.loc[:,'Default_per_diff'] = 100 * (site_data_corn['Default'] - site_data_corn['Observed'])/site_data_corn['Observed']
+      site_data_corn.loc[:,'Composite_per_diff'] = 100 * (site_data_corn['Composite'] - site_data_corn['Observed'])/site_data_corn['Observed']
 
-   # Update site data output to add composite set result as new column
-   site_data_corn    = site_data_add_composite(site_data_corn)
-   site_data_soybean = site_data_add_composite(site_data_soybean)
+      site_data_soybean.loc[:,'Default_per_diff'] = 100 * (site_data_soybean['Default'] - site_data_soybean['Observed'])/site_data_soybean['Observed']
+      site_data_soybean.loc[:,'Composite_per_diff'] = 100 * (site_data_soybean['Composite'] - site_data_soybean['Observed'])/site_data_soybean['Observed']
 
-   bar_plot(site_data_corn,    ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_corn.png')
-   bar_plot(site_data_soybean, ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_soybean.png')
+      site_data_corn[['SiteID','Observed','Default','Composite','Default_per_diff','Composite_per_diff']].to_csv(\
+                     '../figures/Sitelevel_'+time_period+'_'+var+'_corn.txt', sep=',', float_format='%.2f',mode='w', index=False)
+      site_data_soybean[['SiteID','Observed','Default','Composite','Default_per_diff','Composite_per_diff']].to_csv(\
+                     '../figures/Sitelevel_'+time_period+'_'+var+'_soybean.txt', sep=',', float_format='%.2f', mode='w', index=False)
 
-   # Make bar plots with facetting for corn and soybean
-   bar_subplots(site_data_corn, site_data_soybean, title_1='Corn', title_2='Soybean', \
-                ylabel=myDict_labels['Annual'][var], fname='Sitelevel_'+time_period+'_'+var+'_pft.png')
-
-   site_data_corn.loc[:,'Default_per_diff'] = 100 * (site_data_corn['Default'] - site_data_corn['Observed'])/site_data_corn['Observed']
-   site_data_corn.loc[:,'Composite_per_diff'] = 100 * (site_data_corn['Composite'] - site_data_corn['Observed'])/site_data_corn['Observed']
-
-   site_data_soybean.loc[:,'Default_per_diff'] = 100 * (site_data_soybean['Default'] - site_data_soybean['Observed'])/site_data_soybean['Observed']
-   site_data_soybean.loc[:,'Composite_per_diff'] = 100 * (site_data_soybean['Composite'] - site_data_soybean['Observed'])/site_data_soybean['Observed']
-
-   site_data_corn[['SiteID','Observed','Default','Composite','Default_per_diff','Composite_per_diff']].to_csv(\
-                  '../figures/Sitelevel_'+time_period+'_'+var+'_corn.txt', sep=',', float_format='%.2f',mode='w', index=False)
-   site_data_soybean[['SiteID','Observed','Default','Composite','Default_per_diff','Composite_per_diff']].to_csv(\
-                  '../figures/Sitelevel_'+time_period+'_'+var+'_soybean.txt', sep=',', float_format='%.2f', mode='w', index=False)
+# -----------------------------------------------------------
+if __name__ == '__main__':
+   main()
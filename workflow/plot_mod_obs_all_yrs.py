@@ -7,6 +7,8 @@ from optparse import OptionParser
 
 import matplotlib.pyplot as plt
 
+from util_read_data import read_valid_model_data
+
 __author__ = 'Eva Sinha'
 __email__  = 'eva.sinha@pnnl.gov'
 
@@ -33,32 +35,6 @@ parser.add_option("--fnamepre", dest="fnamepre", default="", \
 
 (options, args) = parser.parse_args()
 
-#----------------------------------------------------------
-def read_valid_model_data(rundir, caseid, crop_yrs, varnames):
-    """Read ELM validation model output for all ensemble members for specified case and year range and subset for variables
-    :param: rundir:     path to the run directory
-    :param: caseid:     case name
-    :param: crop_yrs:   crop years for reading data
-    :param: varnames:   list of variable names of interest
-    :return:            single data array containing validation model results for select years and variables
-    """
-
-    # Read names of all NetCDF files within the given year range
-    fnames = []
-    for yr in crop_yrs:
-        fnames.append(rundir + '/' + caseid + '.elm.h0.' + str(yr) + '-01-01-00000.nc')
-
-    # Open a multiple netCDF data file and load the data into xarrays
-    with xr.open_mfdataset(fnames, concat_dim='time') as ds: 
-
-        # Drop landgrid dimension
-        ds = ds.isel(lndgrid=0)
-
-        # Only keep select variables in the data array
-        ds = ds[varnames]
-
-    return (ds)
-
 #----------------------------------------------------------
 def plot_ts_model_obs_all_yrs(ds_model, ds_obs, varnames, site, ylabel, conv_fact_model, conv_fact_obs, fname):
     """Plot timeseries from input xarray
@@ -1,3 +1,5 @@
+import argparse
+import functools
 import pandas as pd
 import xarray as xr
 import matplotlib.pyplot as plt
@@ -10,91 +12,82 @@ from util_myDict_labels import *
 from util_estimate_dataset_stats import *
 from util_vector_plots import *
 from util_site_estimate import *
+from util_case_ensemble import *
 
 # -----------------------------------------------------------
+def main():
+   """ Make line plots comparing monthly simulated vs observed fluxes at AmeriFlux sites """
+   #   python plot_monthly_site_model_obs.py --nproc 7
+   parser = argparse.ArgumentParser(description='Make line plots comparing monthly simulated vs observed fluxes at AmeriFlux sites')
+   parser.add_argument('--nproc', type=int, default=None, help='Number of cases read in parallel (default one per case up to the number of cores)')
+   args = parser.parse_args()
 
-# Read observational site lat and lon
-site_data_corn_orig    = pd.read_csv('site_loc.csv')
-site_data_soybean_orig = pd.read_csv('site_loc.csv')
+   # Read observational site lat and lon
+   site_data_corn_orig    = pd.read_csv('site_loc.csv')
+   site_data_soybean_orig = pd.read_csv('site_loc.csv')
 
-# Adding month name and repeating rows for all specified months
-for ind, mon in enumerate(all_mon_str):
-    if(ind == 0):
-        site_data_corn_mon    = site_data_corn_orig.assign(month=mon)
-        site_data_soybean_mon = site_data_soybean_orig.assign(month=mon)
-    else:
-        site_data_corn_mon    = pd.concat([site_data_corn_mon,    site_data_corn_orig.assign(month=mon)], ignore_index=True)
-        site_data_soybean_mon = pd.concat([site_data_soybean_mon, site_data_soybean_orig.assign(month=mon)], ignore_index=True)
+   # Adding month name and repeating rows for all specified months
+   for ind, mon in enumerate(all_mon_str):
+       if(ind == 0):
+           site_data_corn_mon    = site_data_corn_orig.assign(month=mon)
+           site_data_soybean_mon = site_data_soybean_orig.assign(month=mon)
+       else:
+           site_data_corn_mon    = pd.concat([site_data_corn_mon,    site_data_corn_orig.assign(month=mon)], ignore_index=True)
+           site_data_soybean_mon = pd.concat([site_data_soybean_mon, site_data_soybean_orig.assign(month=mon)], ignore_index=True)
 
-# List of variable names that we want to keep
-varnames = ['GPP', 'ER', 'EFLX_LH_TOT']
+   # List of variable names that we want to keep
+   varnames = ['GPP', 'ER', 'EFLX_LH_TOT']
 
-time_period = 'Monthly'
+   time_period = 'Monthly'
 
-# Whether to estimate monthly total
-est_mon_total = [True, True, False]
+   # Whether to estimate monthly total
+   est_mon_total = [True, True, False]
 
-for ind, var in enumerate(varnames):
+   for ind, var in enumerate(varnames):
 
-   if(var in ['GPP','ER']):
-      # Subset sites that have carbon flux data
-      site_data_corn    = site_data_corn_mon[site_data_corn_mon['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
-      site_data_soybean = site_data_soybean_mon[site_data_soybean_mon['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
-   elif(var == 'EFLX_LH_TOT'):
-      # Remove column that checks for carbon flux data
-      site_data_corn    = site_data_corn_mon.drop(['carbon_flux'], axis=1)
-      site_data_soybean = site_data_soybean_mon.drop(['carbon_flux'], axis=1)
+      if(var in ['GPP','ER']):
+         # Subset sites that have carbon flux data
+         site_data_corn    = site_data_corn_mon[site_data_corn_mon['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
+         site_data_soybean = site_data_soybean_mon[site_data_soybean_mon['carbon_flux'] == True].drop(['carbon_flux'], axis=1)
+      elif(var == 'EFLX_LH_TOT'):
+         # Remove column that checks for carbon flux data
+         site_data_corn    = site_data_corn_mon.drop(['carbon_flux'], axis=1)
+         site_data_soybean = site_data_soybean_mon.drop(['carbon_flux'], axis=1)
 
-   # Read and add observed flux to the site data data frame
-   site_data_corn    = add_obs_site_data(site_data_corn, 'corn', var, obs_conv_factor[var], time_period, est_mon_total[ind])
-   site_data_soybean = add_obs_site_data(site_data_soybean, 'soybean', var, obs_conv_factor[var], time_period, est_mon_total[ind])
+      # Read and add observed flux to the site data data frame
+      site_data_corn    = add_obs_site_data(site_data_corn, 'corn', var, obs_conv_factor[var], time_period, est_mon_total[ind])
+      site_data_soybean = add_obs_site_data(site_data_soybean, 'soybean', var, obs_conv_factor[var], time_period, est_mon_total[ind])
 
-   #iterate through dictionary
-   for i, key in enumerate(myDict_caseid):
+      # Read regridded output and estimate statistics for all cases (in parallel with --nproc)
+      da_plot_merge = read_case_ensemble(functools.partial(case_regridded_average_monthly, var=var, est_mon_total=est_mon_total[ind]), nproc=args.nproc)
 
-      # Read ELM model output for select variables
-      fpath = '/compyfs/sinh210/e3sm_scratch/regridded_output/'
+      #iterate through dictionary
+      for i, key in enumerate(myDict_caseid):
 
-      if(var in ['GPP','EFLX_LH_TOT']):
-         fname = myDict_caseid[key] + '_regridded.nc'
-   
-         ds_model = xr.open_mfdataset(fpath + fname)
+         da_plot = da_plot_merge.sel(Set = key, drop=True)
 
-         # Subset data for corn and soybean
-         ds_model = ds_model.sel(pft = ds_model.pft.isin(['corn', 'soybean']))
-      elif(var == 'ER'):
-         fname = myDict_caseid[key] + '_column_regridded.nc'
-      
-         ds_model = xr.open_mfdataset(fpath + fname)
+         # Interpolate ELM outputs for site lat lon save in data frame
+         site_data_corn    = site_data_interp_monthly(site_data_corn, 'corn', da_plot, key)
+         site_data_soybean = site_data_interp_monthly(site_data_soybean, 'soybean', da_plot, key)
 
-         # Subset data for corn and soybean
-         ds_model = ds_model.sel(col = ds_model.col.isin([217, 223]))
-         ds_model = ds_model.assign_coords(time=ds_model.time.values, col=['corn','soybean'], lat=ds_model.lat.values, lon=ds_model.lon.values)
+      # Update site data output to add composite set result as new column
+      site_data_corn    = site_data_add_composite(site_data_corn)
+      site_data_soybean = site_data_add_composite(site_data_soybean)
 
-         # Rename coordinates
-         ds_model = ds_model.rename({'col': 'pft'})
+      # Add as columns to site location data frame
+      site_data_corn['Crop']    = 'Corn'
+      site_data_soybean['Crop'] = 'Soybean'
 
-      # Estimate average monthly for summer months
-      da_plot = create_summer_average_monthly(ds_model[var], all_mon, all_mon_str, var, conv_factor[var], est_mon_total[ind])
-    
-      # Interpolate ELM outputs for site lat lon save in data frame
-      site_data_corn    = site_data_interp_monthly(site_data_corn, 'corn', da_plot, key)
-      site_data_soybean = site_data_interp_monthly(site_data_soybean, 'soybean', da_plot, key)
+      # Row bind into a single data frame
+      site_data = pd.concat([site_data_corn, site_data_soybean])
 
-   # Update site data output to add composite set result as new column
-   site_data_corn    = site_data_add_composite(site_data_corn)
-   site_data_soybean = site_data_add_composite(site_data_soybean)
+      site_data = site_data.melt(id_vars=['SiteID', 'lat', 'lon', 'month', 'Crop'])
 
-   # Add as columns to site location data frame
-   site_data_corn['Crop']    = 'Corn'
-   site_data_soybean['Crop'] = 'Soybean'
+      # Only keep data for 'Observed','Default','Composite'
+      site_data = site_data.loc[site_data['variable'].isin(['Observed','Default','Composite'])]
 
-   # Row bind into a single data frame
-   site_data = pd.concat([site_data_corn, site_data_soybean])
+      facet_grid_line(site_data, ylabel=myDict_labels[time_period][var], xtick_labels=all_mon_str, fname='Sitelevel_'+var+'_pft_lineplot.png')
 
-   site_data = site_data.melt(id_vars=['SiteID', 'lat', 'lon', 'month', 'Crop'])
-
-   # Only keep data for 'Observed','Default','Composite'
-   site_data = site_data.loc[site_data['variable'].isin(['Observed','Default','Composite'])]
-
-   facet_grid_line(site_data, ylabel=myDict_labels[time_period][var], xtick_labels=all_mon_str, fname='Sitelevel_'+var+'_pft_lineplot.png')
+# -----------------------------------------------------------
+if __name__ == '__main__':
+   main()
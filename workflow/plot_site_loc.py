@@ -8,7 +8,6 @@ mpl.use('agg')
 import pandas as pd
 import numpy as np
 import xarray as xr
-import pickle
 
 import matplotlib.pyplot as plt 
 import cartopy.crs as ccrs
@@ -18,6 +17,7 @@ __author__ = 'Eva Sinha'
 __email__  = 'eva.sinha@pnnl.gov'
 
 from util_spatial_plots import *
+from util_region_mask import *
 
 # -----------------------------------------------------------
 def create_region_da(da):
@@ -31,32 +31,18 @@ def create_region_da(da):
     lat  = da.lsmlat
     lon  = da.lsmlon
 
-    nlat = len(lat.values)
-    nlon = len(lon.values)
-
-    # Create empty gridded array
-    composite_grid = np.empty([nlat, nlon])
-
-    # Adding dimensions and coordinates
-    composite_grid = xr.DataArray(composite_grid, dims=('lat', 'lon'))
-    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values)
-    composite_grid.name = 'Region'
-
     # Dictionary for subregions
     myDict_region = {'Set1': 'Northern_Rockies',
                      'Set2': 'Upper_Midwest',
                      'Set3': 'Ohio_Valley'}
 
-    pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
-
-    #iterate through dictionary
-    for i, key in enumerate(myDict_region):
-    
-        # load pickle to read lon_lat coordinates for three sets
-        notnull_coords = pickle.load(open(pickle_fname.replace('Northern_Rockies', myDict_region[key]), 'rb'))
+    # Read cached region mask for the grid
+    region_mask = read_region_mask(lat.values, lon.values, list(myDict_region.values()))
 
-        for lon, lat in notnull_coords:
-            composite_grid.loc[lat, lon] = i
+    # Adding dimensions and coordinates, grid cells outside all regions are nan
+    composite_grid = xr.DataArray(np.where(region_mask >= 0, region_mask, np.nan), dims=('lat', 'lon'))
+    composite_grid = composite_grid.assign_coords(lat=lat.values, lon=lon.values)
+    composite_grid.name = 'Region'
 
     return composite_grid
 
@@ -7,6 +7,8 @@ from optparse import OptionParser
 from estaverage import estimate_daily_average_across_years
 from plotdailymean import *
 
+from util_read_data import read_valid_model_data
+
 __author__ = 'Eva Sinha'
 __email__  = 'eva.sinha@pnnl.gov'
 
@@ -30,31 +32,6 @@ parser.add_option("--fnamepre", dest="fnamepre", default="", \
 (options, args) = parser.parse_args()
 
 #----------------------------------------------------------
-def read_valid_model_data(rundir, caseid, crop_yrs, varnames):
-    """Read ELM validation model output for all ensemble members for specified case and year range and subset for variables
-    :param: rundir:     path to the run directory
-    :param: caseid:     case name
-    :param: crop_yrs:   crop years for reading data
-    :param: varnames:   list of variable names of interest
-    :return:            single data array containing validation model results for select years and variables
-    """
-
-    # Read names of all NetCDF files within the given year range
-    fnames = []
-    for yr in crop_yrs:
-        fnames.append(rundir + '/' + caseid + '.elm.h0.' + str(yr) + '-01-01-00000.nc')
-
-    # Open a multiple netCDF data file and load the data into xarrays
-    with xr.open_mfdataset(fnames, concat_dim='time') as ds:
-
-        # Drop landgrid dimension
-        ds = ds.isel(lndgrid=0)
-
-        # Only keep select variables in the data array
-        ds = ds[varnames]
-
-    return (ds)
-#----------------------------------------------------------
 
 # List of variable names that we want to keep
 varnames = ['GPP', 'ER', 'EFLX_LH_TOT', 'FSH']
@@ -63,8 +40,12 @@ varnames = ['GPP', 'ER', 'EFLX_LH_TOT', 'FSH']
 rotation_yrs = pd.read_csv('../info_obsdata/' + options.site + '_corn_soybean_rotation_years.csv', comment='#')
 crop_yrs     = rotation_yrs[options.crop].dropna().astype(int)
 
+# Variables read later for LAI, canopy height, harvest and growing season
+site_varnames = ['TLAI', 'HTOP', 'CRPYLD', 'PLANTDAY', 'HARVESTDAY']
+
 # Read ELM validation model output for specified case and year range and subset for variables
-ds_model = read_valid_model_data(options.rundir, options.caseid, crop_yrs, varnames)
+# Yearly files are only opened once, later variables are read from memory
+ds_model = read_valid_model_data(options.rundir, options.caseid, crop_yrs, varnames, preload_varnames=site_varnames)
 
 # Open a netcdf containing observed data
 ds_obs = xr.open_dataset('/home/ac.eva.sinha/ELM-Bioenergy/timeseries_plots/' + options.obsdir + options.obsfname)
@@ -207,7 +188,7 @@ crop_yrs     = pd.concat([rotation_yrs['corn'], rotation_yrs['soybean']]).dropna
 
 # Read ELM validation model output for specified case and year range and subset for variables
 var      = 'TLAI'
-ds_model = read_valid_model_data(options.rundir, options.caseid, crop_yrs, varnames=[var])
+ds_model = read_valid_model_data(options.rundir, options.caseid, crop_yrs, varnames=[var], preload_varnames=['CRPYLD'])
 
 fname = options.site + '_LAI.csv'
 
@@ -0,0 +1,37 @@
+"""
+Inspect or clear the on-disk cache of derived statistics (annual means, summer monthly climatologies, ...)
+"""
+import time
+import argparse
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+import util_stats_cache
+from util_stats_cache import *
+
+#   python stats_cache.py --list
+#   python stats_cache.py --max_mb 500
+#   python stats_cache.py --clear
+parser = argparse.ArgumentParser(description='Inspect or clear the on-disk cache of derived statistics')
+parser.add_argument('--cache_dir', default=stats_cache_dir, help='Cache directory')
+parser.add_argument('--list', action='store_true', help='List cached files from most to least recently used')
+parser.add_argument('--max_mb', type=float, default=None, help='Evict least recently used files above this total size')
+parser.add_argument('--clear', action='store_true', help='Remove all cached files')
+args = parser.parse_args()
+
+util_stats_cache.stats_cache_dir = args.cache_dir
+
+if args.list:
+    for fname, size, mtime in list_stats_cache():
+        print('%s  %8.2f MB  %s' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)), size/1e6, fname))
+
+if args.clear:
+    removed = evict_stats_cache(0)
+    print('Removed %d files' % len(removed))
+elif args.max_mb is not None:
+    removed = evict_stats_cache(args.max_mb)
+    print('Removed %d files' % len(removed))
+
+entries = list_stats_cache()
+print('%s: %d files, %.2f MB' % (args.cache_dir, len(entries), sum(size for fname, size, mtime in entries)/1e6))
@@ -176,28 +176,9 @@ for ind, key in enumerate(myDict):
     pnames = mu.read_textlist('pnames.txt', dim)
     outnames = [str(j+1) for j in range(nout_plot)]
 
-    all_totsens = np.zeros((nout_plot, dim))
-    all_mainsens = np.zeros((nout_plot, dim))
-    for i in range(nout_plot):
-        iout = ind_plot[i]
-        print("================================================================")
-        print("Output %d / %d" % (iout + 1, nout))
-        print("================================================================")
-        if results_all[iout] is not None:
-            #print(results_all[iout].keys())
-            mindex = results_all[iout]['mindex']
-            pccf = results_all[iout]['cfs']
-            a, b = mu.encode_mindex(mindex)
-            # for i, j in zip(a, b):
-            #     print(i, j)
-
-            mainsens, totsens, jointsens, mean, var = mu.pce_sens('LU',
-                                                                  mindex,
-                                                                  pccf,
-                                                                  mv=True)
-
-            all_totsens[i, :] = totsens
-            all_mainsens[i, :] = mainsens
+    # Sensitivities of all outputs of the variable, outputs sharing a multiindex are computed together
+    all_mainsens, all_totsens = mu.results_sens(results_all, ind_plot, 'LU', ndim=dim)
+    print("%s: outputs %d - %d / %d" % (key, ind_plot[0] + 1, ind_plot[-1] + 1, nout))
 
     np.savetxt(options.site + '_' + options.crop + '_' + 'allsens_main.dat', all_mainsens)
     np.savetxt(options.site + '_' + options.crop + '_' + 'allsens_tot.dat', all_totsens)
@@ -61,28 +61,9 @@ for ind, key in enumerate(myDict):
     pnames = mu.read_textlist('pnames.txt', dim)
     outnames = [str(j+1) for j in range(nout_plot)]
 
-    all_totsens = np.zeros((nout_plot, dim))
-    all_mainsens = np.zeros((nout_plot, dim))
-    for i in range(nout_plot):
-        iout = ind_plot[i]
-        print("================================================================")
-        print("Output %d / %d" % (iout + 1, nout))
-        print("================================================================")
-        if results_all[iout] is not None:
-            #print(results_all[iout].keys())
-            mindex = results_all[iout]['mindex']
-            pccf = results_all[iout]['cfs']
-            a, b = mu.encode_mindex(mindex)
-            # for i, j in zip(a, b):
-            #     print(i, j)
-
-            mainsens, totsens, jointsens, mean, var = mu.pce_sens('LU',
-                                                                  mindex,
-                                                                  pccf,
-                                                                  mv=True)
-
-            all_totsens[i, :] = totsens
-            all_mainsens[i, :] = mainsens
+    # Sensitivities of all outputs of the variable, outputs sharing a multiindex are computed together
+    all_mainsens, all_totsens = mu.results_sens(results_all, ind_plot, 'LU', ndim=dim)
+    print("%s: outputs %d - %d / %d" % (key, ind_plot[0] + 1, ind_plot[-1] + 1, nout))
 
     #colors = ut.set_colors(22)
     cmap = plt.get_cmap('tab20')
@@ -93,9 +74,7 @@ for ind, key in enumerate(myDict):
     else:
         xtick_labels = False
 
-    df = pd.DataFrame(all_mainsens, columns=pnames)
-    df = pd.melt(df, var_name='pnames')
-    df['QoI'] = key
+    df = mu.sens_dataframe(all_mainsens, all_totsens, pnames, qoi=key)
 
     if(ind == 0):
        df_plot = df
@@ -104,8 +83,8 @@ for ind, key in enumerate(myDict):
        df_plot = pd.concat([df_plot, df], axis=0)
 
 # make bar plot
-g = sns.catplot(data=df_plot, x='pnames', y='value', row='QoI',  kind='bar', palette=colors, height=3, aspect=2)
-#g = sns.catplot(data=df_plot, x='pnames', y='value', row='QoI',  kind='bar', errorbar='sd',  palette=colors, height=3, aspect=2)
+g = sns.catplot(data=df_plot, x='pnames', y='main', row='QoI',  kind='bar', palette=colors, height=3, aspect=2)
+#g = sns.catplot(data=df_plot, x='pnames', y='main', row='QoI',  kind='bar', errorbar='sd',  palette=colors, height=3, aspect=2)
 
 # Rotate xtick labels
 g.set_xticklabels(labels=pnames, rotation=90)
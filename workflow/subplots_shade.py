@@ -9,9 +9,10 @@ import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.dates import DateFormatter
-from scipy.stats.mstats import mquantiles
 import scipy.stats
 
+import utils as mu
+
 #----------------------------------------------------------
 
 plt.rc('legend', loc='best', fontsize=18)
@@ -39,13 +40,81 @@ def per_bias(model, obs):
 ##########################################################################
 
 
+def shade_probs(nq):
+    """Probabilities of the nq - 1 quantiles bounding the shaded bands"""
+    return [float(i + 1) / float(nq) for i in range(nq - 1)]
+
+
+def quantile_bands(ydata, prob, alphap=0.4, betap=0.4):
+    """Quantiles of each row of ydata (nx, nsam), same as mquantiles(ydata, prob, alphap, betap, axis=1)
+    but with a single sort of the plain array for all probabilities (np.partition with the many order
+    statistics of 20-50 bands is slower than a full sort)"""
+    ydata = np.asarray(ydata, dtype=float)
+    n = ydata.shape[1]
+    prob = np.asarray(prob, dtype=float)
+
+    # Plotting positions of mquantiles, interpolated between the k-th and (k+1)-th order statistics
+    aleph = n * prob + alphap + prob * (1. - alphap - betap)
+    k = np.floor(np.clip(aleph, 1, n - 1)).astype(int)
+    gamma = np.clip(aleph - k, 0, 1)
+
+    ysort = np.sort(ydata, axis=1)
+
+    return (1. - gamma) * ysort[:, k - 1] + gamma * ysort[:, k]
+
+
+def streaming_quantile_bands(ensemble, cols, prob, nbins=2048, chunk_size=1000):
+    """Approximate quantiles of outputs cols of ensemble (nsam, nout), e.g. a memory map, reading
+    chunk_size samples at a time, memory is bounded by chunk_size x len(cols) + nbins x len(cols)
+    A first pass finds the range of each output, a second pass fills a histogram of nbins bins per output
+    and quantiles are interpolated linearly within the bin. The error of each quantile is at most one bin
+    width (max - min) / nbins of that output, plus the difference between the plotting position of
+    mquantiles and the empirical CDF (at most about one sample spacing)"""
+    cols = np.asarray(cols)
+    nx = len(cols)
+    nsam = ensemble.shape[0]
+    prob = np.asarray(prob, dtype=float)
+
+    ymin = np.full(nx, np.inf)
+    ymax = np.full(nx, -np.inf)
+    for start in range(0, nsam, chunk_size):
+        block = np.asarray(ensemble[start:start + chunk_size, cols], dtype=float)
+        ymin = np.minimum(ymin, block.min(axis=0))
+        ymax = np.maximum(ymax, block.max(axis=0))
+
+    width = np.where(ymax > ymin, (ymax - ymin) / nbins, 1.0)
+
+    counts = np.zeros(nx * nbins)
+    offset = np.arange(nx) * nbins
+    for start in range(0, nsam, chunk_size):
+        block = np.asarray(ensemble[start:start + chunk_size, cols], dtype=float)
+        ibin = np.clip(((block - ymin) / width).astype(int), 0, nbins - 1)
+        counts += np.bincount((ibin + offset).ravel(), minlength=nx * nbins)
+    counts = counts.reshape(nx, nbins)
+    cdf = np.cumsum(counts, axis=1)
+
+    # Bin containing each quantile, found for all outputs at once on the cdf shifted by output
+    target = prob * nsam
+    rows = np.arange(nx)[:, np.newaxis]
+    ibin = np.searchsorted((cdf + rows * (nsam + 1)).ravel(), (target + rows * (nsam + 1)).ravel())
+    ibin = np.clip(ibin.reshape(nx, -1) - rows * nbins, 0, nbins - 1)
+
+    below = cdf[rows, ibin] - counts[rows, ibin]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.clip(np.nan_to_num((target - below) / counts[rows, ibin]), 0, 1)
+
+    return ymin[:, np.newaxis] + (ibin + frac) * width[:, np.newaxis]
+
+
 def plot_shade(ax, xdata, ydata, nq=51, cmap=mpl.cm.BuGn,
-               bounds_show=False, grid_show=True):
+               bounds_show=False, grid_show=True, mq=None):
+    """Shaded bands between quantiles of ydata (nx, nsam), or of precomputed quantiles mq (nx, nq - 1)"""
+    if mq is None:
+        mq = quantile_bands(ydata, shade_probs(nq))
+
     nx = xdata.shape[0]
-    assert(nx == ydata.shape[0])
+    assert(nx == mq.shape[0])
 
-    mq = mquantiles(ydata, prob=[float(i + 1) / float(nq)
-                                 for i in range(nq - 1)], axis=1)
     #ax.sca(ax)
 
     normalize = mpl.colors.Normalize(vmin=0.01, vmax=0.5)
@@ -100,6 +169,8 @@ parser.add_argument("-l", "--xticklabels", dest="xticklabels_file",
                     type=str, default=None, help="Xtick labels file")
 parser.add_argument("-ylb", "--ylim_bot", dest="ylim_bot",
                     type=float, default=None, help="yaxis bottom limit")
+parser.add_argument("-nb", "--approx_bins", dest="approx_bins",
+                    type=int, default=0, help="Number of histogram bins for approximate streaming quantiles (0 for exact)")
 
 args = parser.parse_args()
 
@@ -113,6 +184,7 @@ xdata_file = args.xdata_file
 ncol = args.ncol
 custom_xlabel = args.xlabel
 ylim_bot = args.ylim_bot
+approx_bins = args.approx_bins
 
 os.chdir('../site_calib_outputs/')
 
@@ -122,15 +194,17 @@ if args.xticklabels_file is not None:
 
     #custom_xticklabels = np.loadtxt(args.xticklabels, dtype=str) # ideally read
 
+# Ensembles are memory mapped when converted with convert_calib_ensembles.py,
+# only the outputs sliced for each variable are read from disk
 prior_out_flag = False
 if prior_output_file is not None:
-    prior_output = np.loadtxt(prior_output_file)
+    prior_output = mu.load_calib_array(prior_output_file)
     prior_out_flag = True
     nout = prior_output.shape[1]
 
 post_out_flag = False
 if post_output_file is not None:
-    post_output = np.loadtxt(post_output_file)
+    post_output = mu.load_calib_array(post_output_file)
     post_out_flag = True
     nout = post_output.shape[1]
 
@@ -152,22 +226,22 @@ for i, key in enumerate(myDict):
     ind_z_stat_file = site + '_' + crop + '_' + 'ind_z_stat_' + key + '.dat'
 
     if indplot_file is not None:
-        ind_plot = np.loadtxt(indplot_file, dtype=int)
+        ind_plot = mu.load_calib_array(indplot_file, dtype=int)
     else:
         ind_plot = np.arange(nout)
 
     if ind_y_stat_file is not None:
-        ind_y_stat = np.loadtxt(ind_y_stat_file, dtype=int)
+        ind_y_stat = mu.load_calib_array(ind_y_stat_file, dtype=int)
     else:
         ind_y_stat = np.arange(nout)
 
     if ind_z_stat_file is not None:
-        ind_z_stat = np.loadtxt(ind_z_stat_file, dtype=int)
+        ind_z_stat = mu.load_calib_array(ind_z_stat_file, dtype=int)
     else:
         ind_z_stat = np.arange(nout)
 
     if xdata_file is not None:
-        xdata = np.loadtxt(xdata_file)[ind_plot, ncol]
+        xdata = mu.load_calib_array(xdata_file)[ind_plot, ncol]
     else:
         xdata = np.arange(nout)
 
@@ -175,21 +249,30 @@ for i, key in enumerate(myDict):
 
     thisax = ax[i]
 
-    if prior_out_flag:
-        plot_shade(thisax, xdata,
-                  prior_output[:, ind_plot].T, cmap=cm.OrRd, grid_show=True)
-    if post_out_flag:
-        plot_shade(thisax, xdata,
-                  post_output[:, ind_plot].T, nq=21, grid_show=True)
+    if approx_bins > 0:
+        # Quantiles from histograms filled by reading chunks of samples
+        if prior_out_flag:
+            plot_shade(thisax, xdata, None, cmap=cm.OrRd, grid_show=True,
+                       mq=streaming_quantile_bands(prior_output, ind_plot, shade_probs(51), nbins=approx_bins))
+        if post_out_flag:
+            plot_shade(thisax, xdata, None, nq=21, grid_show=True,
+                       mq=streaming_quantile_bands(post_output, ind_plot, shade_probs(21), nbins=approx_bins))
+    else:
+        if prior_out_flag:
+            plot_shade(thisax, xdata,
+                      prior_output[:, ind_plot].T, cmap=cm.OrRd, grid_show=True)
+        if post_out_flag:
+            plot_shade(thisax, xdata,
+                      post_output[:, ind_plot].T, nq=21, grid_show=True)
 
 
     #thisax.set_xticks(xdata)
 
     if data_file is not None:
-        bcg_data = np.loadtxt(data_file, ndmin=2)
+        bcg_data = mu.load_calib_array(data_file, ndmin=2)
         for j in range(bcg_data.shape[1]):
             if datastd_file is not None:
-                bcg_data_std = np.loadtxt(datastd_file, ndmin=2)
+                bcg_data_std = mu.load_calib_array(datastd_file, ndmin=2)
                 thisax.errorbar(xdata, bcg_data[:, j], yerr=bcg_data_std[:, j],
                                 ecolor='k', fmt='ko', label='Data', ms=12, zorder=100000)
             else:
@@ -0,0 +1,137 @@
+"""
+Python modules for reading and reducing ELM output of an ensemble of cases (myDict_caseid), optionally in parallel
+"""
+import os
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_myDict_labels import *
+from util_read_data import *
+from util_estimate_dataset_stats import *
+from util_regrid_cases import rundir, regridded_dir
+
+# -----------------------------------------------------------
+def timed_case_fn(case_fn, caseid):
+    """ Read and reduce output of a single case and load the result into memory
+    :param case_fn: function taking the caseid and returning a data array or dataset
+    :param caseid:  model run case id
+    :return:        (result, elapsed time in seconds)
+    """
+    start  = time.time()
+    result = case_fn(caseid).load()
+
+    return result, time.time() - start
+
+# -----------------------------------------------------------
+def read_case_ensemble(case_fn, cases=myDict_caseid, nproc=1):
+    """ Read and reduce output of all cases (optionally using a process pool) and concatenate along the Set dimension
+    :param case_fn: picklable function taking the caseid and returning a data array or dataset
+                    (module level function or functools.partial of one)
+    :param cases:   dictionary of Set name and model run case id
+    :param nproc:   number of processes (default 1, serial; None for one per case up to the number of cores)
+                    workers re-import the calling script under spawn/forkserver, so nproc other than 1 requires
+                    the driver code of the calling script to be under an if __name__ == '__main__': guard
+    :return:        data array or dataset with Set dimension
+    """
+    keys    = list(cases.keys())
+    caseids = [cases[key] for key in keys]
+
+    if nproc is None:
+        nproc = min(len(caseids), os.cpu_count())
+
+    fn = functools.partial(timed_case_fn, case_fn)
+    if (nproc > 1):
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            results = list(pool.map(fn, caseids))
+    else:
+        results = [fn(caseid) for caseid in caseids]
+
+    for key, (result, elapsed) in zip(keys, results):
+        print('%s: %.1f s' % (key, elapsed))
+
+    # Single concatenation, sorted to keep the Set order of merging one case at a time
+    ds_ensemble = xr.concat([result for result, elapsed in results], dim=pd.Index(keys, name='Set'))
+    ds_ensemble = ds_ensemble.sortby('Set')
+
+    return ds_ensemble
+
+# -----------------------------------------------------------
+def case_monthly_stats(caseid, varnames):
+    """ Annual and summer monthly statistics from monthly ELM h0 output of a case
+    Each history file of the case is read once for all variables
+    :param caseid:   model run case id
+    :param varnames: ELM output variable names
+    """
+    fpath    = rundir + caseid + '/run/'
+    ds_model = read_model_output(yr_start, yr_end, fpath, caseid, varnames)
+
+    return reduce_monthly_stats(ds_model, varnames, conv_factor, sum_mon, sum_mon_str)
+
+# -----------------------------------------------------------
+def case_regridded_stats(caseid, wts_varnames, varnames):
+    """ Annual and summer monthly statistics of corn and soybean from regridded pft level output of a case
+    :param caseid:       model run case id
+    :param wts_varnames: variables read from output with PCT_CROP and PCT_CFT weights applied
+    :param varnames:     variables read from output without weights
+    """
+    # Read regridded output and subset data for corn and soybean
+    ds_model     = read_regridded_output(regridded_dir + caseid + '_regridded_weight_applied.nc', ['corn', 'soybean'])
+    ds_stats_wts = reduce_monthly_stats(ds_model, wts_varnames, conv_factor, sum_mon, sum_mon_str)
+
+    ds_model     = read_regridded_output(regridded_dir + caseid + '_regridded.nc', ['corn', 'soybean'])
+    ds_stats     = reduce_monthly_stats(ds_model, varnames, conv_factor, sum_mon, sum_mon_str)
+
+    return xr.merge([ds_stats_wts, ds_stats])
+
+# -----------------------------------------------------------
+def case_regridded_corn_soybean(caseid, var):
+    """ Regridded pft level (or column level for ER) output of a case for corn and soybean
+    :param caseid: model run case id
+    :param var:    ELM output variable name
+    :return:       data array [time * pft * lat * lon]
+    """
+    if(var == 'ER'):
+        fname = regridded_dir + caseid + '_column_regridded.nc'
+
+        # Read regridded output (dense or compact) and subset data for corn and soybean
+        ds_model = read_regridded_output(fname, [217, 223], type_dim='col')
+        ds_model = ds_model.assign_coords(time=ds_model.time.values, col=['corn','soybean'], lat=ds_model.lat.values, lon=ds_model.lon.values)
+
+        # Rename coordinates
+        ds_model = ds_model.rename({'col': 'pft'})
+
+        # Input file is used for caching derived statistics
+        ds_model = set_source_files(ds_model, [fname])
+    else:
+        # Read regridded output and subset data for corn and soybean
+        ds_model = read_regridded_output(regridded_dir + caseid + '_regridded.nc', ['corn', 'soybean'])
+
+    return ds_model[var]
+
+# -----------------------------------------------------------
+def case_regridded_mean_annual(caseid, var, est_mon_total):
+    """ Mean annual of corn and soybean from regridded output of a case
+    :param caseid:        model run case id
+    :param var:           ELM output variable name
+    :param est_mon_total: whether to estimate monthly total
+    """
+    da_model = case_regridded_corn_soybean(caseid, var)
+
+    return create_mean_annual_da(da_model, var, conv_factor[var], est_mon_total)
+
+# -----------------------------------------------------------
+def case_regridded_average_monthly(caseid, var, est_mon_total):
+    """ Average monthly for all months of corn and soybean from regridded output of a case
+    :param caseid:        model run case id
+    :param var:           ELM output variable name
+    :param est_mon_total: whether to estimate monthly total
+    """
+    da_model = case_regridded_corn_soybean(caseid, var)
+
+    return create_summer_average_monthly(da_model, all_mon, all_mon_str, var, conv_factor[var], est_mon_total)
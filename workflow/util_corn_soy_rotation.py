@@ -0,0 +1,58 @@
+"""
+Python modules for applying corn soybean rotation to the PCT_CFT variable of a land use timeseries
+"""
+import numpy as np
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+# -----------------------------------------------------------
+def coord_inds(coord, values):
+   """ Index of each value in a coordinate variable
+   :param coord:  coordinate variable values
+   :param values: values to be located
+   :return:       index of each value, IndexError if any value is missing
+   """
+   match = (np.asarray(values)[:, np.newaxis] == np.asarray(coord)[np.newaxis, :])
+   if not match.any(axis=1).all():
+      raise IndexError('Values not found in coordinate: ' + str(np.asarray(values)[~match.any(axis=1)]))
+
+   return match.argmax(axis=1)
+
+# -----------------------------------------------------------
+def apply_corn_soy_rotation(ds_old, outVar, hist_trans, corn=2, soybean=8):
+   """ Swap corn soybean area in grid cells with rotation, one hyperslab read and write per year
+   :param ds_old:     source landuse timeseries netcdf dataset
+   :param outVar:     PCT_CFT variable of the new landuse timeseries
+   :param hist_trans: fraction of grid with rotation [lsmlat * lsmlon], nan where no rotation occurs
+   :param corn:       cft index of corn
+   :param soybean:    cft index of soybean
+   """
+   lat_inds  = coord_inds(ds_old['lsmlat'][:], hist_trans['lsmlat'].values)
+   lon_inds  = coord_inds(ds_old['lsmlon'][:], hist_trans['lsmlon'].values)
+
+   # Grid cells with rotation, as indices into the bounding box of the LUH2 subset
+   lat_box   = slice(lat_inds.min(), lat_inds.max()+1)
+   lon_box   = slice(lon_inds.min(), lon_inds.max()+1)
+   rot_frac  = hist_trans.values
+   valid     = ~np.isnan(rot_frac)
+   lat_valid = np.broadcast_to(lat_inds[:, np.newaxis], valid.shape)[valid] - lat_box.start
+   lon_valid = np.broadcast_to(lon_inds[np.newaxis, :], valid.shape)[valid] - lon_box.start
+   rot_frac  = rot_frac[valid]
+
+   # Even years add rotation fraction of soybean to corn, odd years add rotation fraction of corn to soybean
+   for yr in range(2000, 2016):
+      if (yr % 2 == 0):
+         gain, loss = corn, soybean
+      else:
+         gain, loss = soybean, corn
+
+      time_inds = coord_inds(ds_old['time'][:], [yr])[0]
+      slab      = ds_old['PCT_CFT'][time_inds, :, lat_box, lon_box]
+
+      cft_gain  = slab[gain, lat_valid, lon_valid]
+      cft_loss  = slab[loss, lat_valid, lon_valid]
+      slab[gain, lat_valid, lon_valid] = cft_gain + rot_frac * cft_loss
+      slab[loss, lat_valid, lon_valid] = (1 - rot_frac) * cft_loss
+
+      outVar[time_inds, :, lat_box, lon_box] = slab
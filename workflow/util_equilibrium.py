@@ -0,0 +1,225 @@
+"""
+Python modules for evaluating whether ELM spinup has reached equilibrium at every grid cell
+
+The drift of each variable is the least squares slope over the last nyears of the spinup, estimated for all
+variables and grid cells at once. A cell is converged for a variable when the absolute drift (units per year)
+is below abs_tol or the drift relative to the mean over the window (fraction per year) is below rel_tol,
+so carbon pools are judged relative to the pool size and fluxes close to zero by their absolute drift.
+
+For monitoring a running spinup, update_spinup_state keeps a state file with every time step of the select
+variables of each history file already read and only reads history files written (or modified) since the
+previous update, so the drift is estimated from the same time steps as when reading all history files.
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_read_data import history_drop_variables
+
+#----------------------------------------------------------
+def equilibrium_drift(ds, varnames, nyears=20, abs_tol=1.0, rel_tol=1e-3):
+    """Estimate drift over the last years of spinup and flag cells that have not converged
+    :param: ds:            xarray dataset with numeric time in years
+    :param: varnames:      list of variable names
+    :param: nyears:        number of years at the end of spinup used for estimating drift
+    :param: abs_tol:       tolerance on the absolute drift [units per year]
+    :param: rel_tol:       tolerance on the drift relative to the mean [fraction per year]
+    :return:               xarray dataset [variable * ...] with mean, slope, rel_drift, nvalid and converged
+    """
+    time_vals = ds['time'].values
+    if not np.issubdtype(time_vals.dtype, np.number):
+        raise ValueError('equilibrium_drift requires numeric time in years (read with decode_times=False)')
+
+    # All variables of the window are read at once
+    window = ds[varnames].sel(time = time_vals >= time_vals.max() - nyears)
+    da     = window.to_array('variable').transpose('variable', 'time', ...).load()
+
+    y     = da.values.astype(np.float64)
+    x     = window['time'].values.astype(np.float64).reshape((1, -1) + (1,) * (y.ndim - 2))
+    valid = ~np.isnan(y)
+
+    # Least squares slope with missing values skipped
+    nvalid = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(valid, x, 0).sum(axis=1) / nvalid
+        y_mean = np.nansum(y, axis=1) / nvalid
+
+        dx    = np.where(valid, x - x_mean[:, np.newaxis], 0)
+        dy    = np.where(valid, y - y_mean[:, np.newaxis], 0)
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+        slope = np.where(nvalid >= 2, slope, np.nan)
+
+        rel_drift = slope / np.abs(y_mean)
+
+    converged = (np.abs(slope) <= abs_tol) | (np.abs(rel_drift) <= rel_tol)
+
+    template = da.isel(time=0, drop=True)
+    ds_drift = xr.Dataset({'mean':      (template.dims, y_mean),
+                           'slope':     (template.dims, slope),
+                           'rel_drift': (template.dims, rel_drift),
+                           'nvalid':    (template.dims, nvalid),
+                           'converged': (template.dims, converged)},
+                          coords=template.coords)
+
+    # Cells without data are neither converged nor unconverged
+    ds_drift['converged'] = ds_drift['converged'].where(ds_drift['nvalid'] >= 2)
+
+    ds_drift.attrs = {'nyears': nyears, 'abs_tol': abs_tol, 'rel_tol': rel_tol,
+                      'time_start': float(window['time'].min()), 'time_end': float(window['time'].max())}
+
+    return ds_drift
+
+#----------------------------------------------------------
+def equilibrium_summary(ds_drift):
+    """Number and fraction of cells that have not converged for each variable
+    :param: ds_drift:      xarray dataset from equilibrium_drift
+    :return:               pandas dataframe with one row for each variable
+    """
+    has_data = ds_drift['converged'].notnull()
+    other    = [dim for dim in ds_drift['converged'].dims if dim != 'variable']
+
+    ncells       = has_data.sum(dim=other)
+    nunconverged = (has_data & (ds_drift['converged'] == 0)).sum(dim=other)
+
+    df = pd.DataFrame({'cells':         ncells.values,
+                       'not_converged': nunconverged.values,
+                       'fraction':      (nunconverged / ncells).values,
+                       'max_abs_slope': abs(ds_drift['slope']).max(dim=other).values,
+                       'max_rel_drift': abs(ds_drift['rel_drift']).max(dim=other).values},
+                      index=ds_drift['variable'].values)
+
+    return df
+
+#----------------------------------------------------------
+def write_equilibrium_report(ds_drift, fname, only_unconverged=False):
+    """Write a compact report with one row for each grid cell and variable with data
+    :param: ds_drift:          xarray dataset from equilibrium_drift
+    :param: fname:             csv file name
+    :param: only_unconverged:  only write cells that have not converged
+    :return:                   pandas dataframe written to the file
+    """
+    df = ds_drift.to_dataframe()
+    df = df[df['converged'].notnull()]
+    if only_unconverged:
+        df = df[df['converged'] == 0]
+
+    df['converged'] = df['converged'].astype(bool)
+    df['nvalid']    = df['nvalid'].astype(int)
+
+    df.to_csv(fname, float_format='%.6g')
+
+    return df
+
+#----------------------------------------------------------
+def spinup_history_fnames(yr_start, yr_end, yr_step, fpath, caseid, mon_day_str, min_age=60):
+    """Names of spinup history files written so far
+    :param: yr_start:      start year
+    :param: yr_end:        end year
+    :param: yr_step:       years between history files
+    :param: fpath:         directory path
+    :param: caseid:        model run case id
+    :param: mon_day_str:   month and day in the file names
+    :param: min_age:       files modified less than min_age seconds ago are skipped (still being written)
+    :return:               list of existing file names
+    """
+    fnames = []
+    for yr in range(int(yr_start), int(yr_end)+1, yr_step):
+        fname = fpath + '/' + caseid + '.elm.h0.' + str(yr).zfill(4) + mon_day_str + '-00000.nc'
+        if (os.path.exists(fname) and time.time() - os.path.getmtime(fname) >= min_age):
+            fnames.append(fname)
+
+    return fnames
+
+#----------------------------------------------------------
+def read_spinup_state(state_fname, varnames):
+    """Read the state file of already read spinup history files
+    :param: state_fname:   state file name
+    :param: varnames:      list of variable names
+    :return:               xarray dataset, None if there is no state file or it has other variables
+    """
+    if not os.path.exists(state_fname):
+        return None
+
+    with xr.open_dataset(state_fname, decode_times=False) as ds_state:
+        ds_state = ds_state.load()
+
+    # State files with only the mean of each history file are read again
+    if ('source_ntime' not in ds_state.attrs):
+        return None
+
+    if (sorted(np.atleast_1d(ds_state.attrs['varnames'])) != sorted(varnames)):
+        return None
+
+    return ds_state
+
+#----------------------------------------------------------
+def read_spinup_file(fname, varnames):
+    """Every time step of select variables of a single spinup history file
+    :param: fname:         history file name
+    :param: varnames:      list of variable names
+    :return:               xarray dataset
+    """
+    drop_variables = history_drop_variables(fname, varnames)
+
+    with xr.open_dataset(fname, decode_times=False, drop_variables=drop_variables) as ds:
+        ds_file = ds[varnames].load()
+
+    return ds_file
+
+#----------------------------------------------------------
+def update_spinup_state(state_fname, yr_start, yr_end, yr_step, fpath, caseid, mon_day_str, varnames, min_age=60):
+    """Read only spinup history files written (or modified) since the last update and save the state
+    The state file keeps every time step of select variables (time is not decoded) as read_spinup_model_output,
+    and the name, number of time steps and modification time of the files it was read from
+    :param: state_fname:   state file name
+    :param: min_age:       files modified less than min_age seconds ago are skipped (still being written)
+    :return:               (xarray dataset of all time steps read, list of newly read file names)
+    """
+    fnames = spinup_history_fnames(yr_start, yr_end, yr_step, fpath, caseid, mon_day_str, min_age)
+    if (len(fnames) == 0):
+        raise FileNotFoundError('No spinup history files for ' + caseid + ' in ' + fpath)
+
+    # Time steps and modification time of each file in the state
+    state    = {}
+    ds_state = read_spinup_state(state_fname, varnames)
+    if ds_state is not None:
+        offset = 0
+        for name, ntime, mtime in zip(np.atleast_1d(ds_state.attrs['source_files']),
+                                      np.atleast_1d(ds_state.attrs['source_ntime']),
+                                      np.atleast_1d(ds_state.attrs['source_mtimes'])):
+            state[str(name)] = (slice(offset, offset + int(ntime)), float(mtime))
+            offset += int(ntime)
+
+    # Time steps of unmodified files are kept, only new (or modified) files are read
+    ds_list    = []
+    new_fnames = []
+    for fname in fnames:
+        name = os.path.basename(fname)
+        if (name in state and os.path.getmtime(fname) <= state[name][1]):
+            ds_list.append(ds_state[varnames].isel(time=state[name][0]))
+        else:
+            ds_list.append(read_spinup_file(fname, varnames))
+            new_fnames.append(fname)
+
+    if (len(new_fnames) == 0 and ds_state is not None and
+        [os.path.basename(fname) for fname in fnames] == list(np.atleast_1d(ds_state.attrs['source_files']))):
+        return ds_state, new_fnames
+
+    ds_new = xr.concat(ds_list, dim='time')
+    ds_new.attrs = {'varnames':      list(varnames),
+                    'source_files':  [os.path.basename(fname) for fname in fnames],
+                    'source_ntime':  [ds.sizes['time'] for ds in ds_list],
+                    'source_mtimes': [os.path.getmtime(fname) for fname in fnames]}
+
+    # Write to a temporary file so a partial state is never read
+    os.makedirs(os.path.dirname(os.path.abspath(state_fname)), exist_ok=True)
+    tmp_fname = state_fname + '.' + str(os.getpid()) + '.tmp'
+    ds_new.to_netcdf(tmp_fname)
+    os.replace(tmp_fname, state_fname)
+
+    return ds_new, new_fnames
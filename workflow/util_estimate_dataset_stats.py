@@ -9,8 +9,10 @@ __email__  = 'eva.sinha@pnnl.gov'
 
 from util_myDict_labels import *
 from util_read_data import *
+from util_stats_cache import *
 
 #----------------------------------------------------------
+@cached_stat
 def create_summer_average_monthly(ds, sum_mon, sum_mon_str, varname, conv_factor, est_mon_total):
     """Estimate average monthly for summer months
     :param: ds:            xarray
@@ -56,6 +58,7 @@ def create_summer_average_monthly(ds, sum_mon, sum_mon_str, varname, conv_factor
     return ds_summer_avg
 
 #----------------------------------------------------------
+@cached_stat
 def create_mean_annual_da(ds, varname, conv_factor, est_mon_total):
     """Estimate mean annual flux from monthly data
     :param: ds:            xarray
@@ -107,6 +110,7 @@ def create_mean_annual_da(ds, varname, conv_factor, est_mon_total):
 
 # -----------------------------------------------------------
 
+@cached_stat
 def estimate_mean_annual_yield(da, varname):
     """Estimate mean annual yield
     :param: da:         input dataarray
@@ -122,6 +126,7 @@ def estimate_mean_annual_yield(da, varname):
     return da_annual_avg
 
 # -----------------------------------------------------------
+@cached_stat
 def estimate_mean_annual_dates(da, varname):
     """Estimate mean annual planting and harvest
     :param: da:         input dataarray
@@ -140,6 +145,147 @@ def estimate_mean_annual_dates(da, varname):
    
     return da_annual_avg
 
+#----------------------------------------------------------
+def nan_mean(acc_sum, acc_count):
+    """Mean from accumulated sum and count of non-nan values, nan where there is no value
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(acc_count > 0, acc_sum / acc_count, np.nan)
+
+#----------------------------------------------------------
+@cached_stat
+def reduce_monthly_stats(ds, varnames, conv_factor, sum_mon, sum_mon_str, years_per_chunk=1):
+    """Estimate annual and summer monthly statistics of several variables in a single pass through monthly data
+    :param: ds:              xarray dataset with monthly data
+    :param: varnames:        list of variable names
+    :param: conv_factor:     dictionary of conversion factor for each variable (1 if missing)
+    :param: sum_mon:         list of summer months (ascending)
+    :param: sum_mon_str:     list of summer month names
+    :param: years_per_chunk: number of years read from disk at a time
+    :return:                 xarray dataset with for each variable
+                             <var>_annual_total same as create_mean_annual_da(est_mon_total=True)
+                             <var>_annual_mean  same as create_mean_annual_da(est_mon_total=False)
+                             <var>_annual_max   same as estimate_mean_annual_yield
+                             <var>_summer_avg   same as create_summer_average_monthly(est_mon_total=False)
+                             <var>_summer_total same as create_summer_average_monthly(est_mon_total=True)
+                             <var>_dec_mean     same as estimate_mean_annual_dates
+    """
+    if(max(ds.time.dt.day.values) == 31):
+        raise ValueError('reduce_monthly_stats only supports monthly data')
+
+    years = ds.time.dt.year.values
+
+    # Accumulated sum and count of non-nan values across years (and months)
+    acc = {}
+    for var in varnames:
+        shape    = ds[var].shape[1:]
+        acc[var] = {stat: [np.zeros(shape), np.zeros(shape)] for stat in ['annual_total', 'annual_mean', 'annual_max', 'dec_mean']}
+        for stat in ['summer_avg', 'summer_total']:
+            acc[var][stat] = [np.zeros((len(sum_mon),) + shape), np.zeros((len(sum_mon),) + shape)]
+
+    unique_years = pd.unique(years)
+    for ind in range(0, len(unique_years), years_per_chunk):
+        time_inds = np.where(np.isin(years, unique_years[ind:ind+years_per_chunk]))[0]
+
+        # Each chunk of time is read from disk once for all variables
+        chunk        = ds[varnames].isel(time=slice(time_inds[0], time_inds[-1]+1)).load()
+        chunk_years  = chunk.time.dt.year.values
+        chunk_months = chunk.time.dt.month.values
+        month_length = chunk.time.dt.days_in_month.values
+
+        for var in varnames:
+            values = chunk[var].values
+            scaled = values / conv_factor.get(var, 1)
+            days   = month_length.reshape((-1,) + (1,) * (values.ndim - 1))
+            totals = scaled * days
+
+            for yr in pd.unique(chunk_years):
+                in_yr = (chunk_years == yr)
+
+                # Annual total is nan if any month is nan (skipna=False), other statistics skip nan
+                annual_stats = {'annual_total': totals[in_yr].sum(axis=0),
+                                'annual_mean':  nan_mean(np.nansum(scaled[in_yr], axis=0), (~np.isnan(scaled[in_yr])).sum(axis=0)),
+                                'annual_max':   np.fmax.reduce(values[in_yr], axis=0)}
+                for stat, annual in annual_stats.items():
+                    acc[var][stat][0] += np.nan_to_num(annual)
+                    acc[var][stat][1] += ~np.isnan(annual)
+
+            # Summer monthly climatology
+            for i, mon in enumerate(sum_mon):
+                in_mon = (chunk_months == mon)
+                for stat, data in [('summer_avg', scaled), ('summer_total', totals)]:
+                    acc[var][stat][0][i] += np.nansum(data[in_mon], axis=0)
+                    acc[var][stat][1][i] += (~np.isnan(data[in_mon])).sum(axis=0)
+
+            # Planting and harvest dates in December, 999 and 0 (grids with no crops) are nan
+            dec = values[chunk_months == 12]
+            dec = np.where((dec == 999) | (dec == 0), np.nan, dec)
+            acc[var]['dec_mean'][0] += np.nansum(dec, axis=0)
+            acc[var]['dec_mean'][1] += (~np.isnan(dec)).sum(axis=0)
+
+    ds_stats = xr.Dataset()
+    for var in varnames:
+        template = ds[var].isel(time=0, drop=True)
+        for stat in ['annual_total', 'annual_mean', 'annual_max', 'dec_mean']:
+            ds_stats[var + '_' + stat] = xr.DataArray(nan_mean(*acc[var][stat]), dims=template.dims, coords=template.coords)
+        for stat in ['summer_avg', 'summer_total']:
+            ds_stats[var + '_' + stat] = xr.DataArray(nan_mean(*acc[var][stat]), dims=('month',) + template.dims,
+                                                      coords=template.coords).assign_coords({'month': sum_mon_str})
+
+    return ds_stats
+
+#----------------------------------------------------------
+@cached_stat
+def reduce_obs_climatology(ds, months, month_str, time_periods=('Annual', 'Monthly')):
+    """Estimate annual and monthly climatologies of all time varying variables of daily (or monthly) observations
+    in one pass, without conversion factor (statistics are divided by the conversion factor when used)
+    :param: ds:            xarray dataset
+    :param: months:        list of months (ascending)
+    :param: month_str:     list of month names
+    :param: time_periods:  climatologies to estimate (Annual and/or Monthly)
+    :return:               xarray dataset with for each variable
+                           <var>_annual_total  same as create_mean_annual_da(est_mon_total=True)
+                           <var>_annual_mean   same as create_mean_annual_da(est_mon_total=False)
+                           <var>_monthly_total same as create_summer_average_monthly(est_mon_total=True)
+                           <var>_monthly_mean  same as create_summer_average_monthly(est_mon_total=False)
+    """
+    varnames   = [var for var in ds.data_vars if 'time' in ds[var].dims and ds[var].dtype.kind in 'fiu']
+    ds         = ds[varnames]
+    daily_data = (max(ds.time.dt.day.values) == 31)
+
+    if(daily_data):
+        # Daily data, annual total is the sum of all days
+        ds_total = ds
+    else:
+        # Monthly data, estimate monthly total from days in each month
+        ds_total = ds * ds.time.dt.days_in_month
+
+    stats = {}
+    if ('Annual' in time_periods):
+        stats['annual_total'] = ds_total.groupby('time.year').sum(dim='time', skipna=False).mean(dim='year')
+        stats['annual_mean']  = ds.groupby('time.year').mean().mean(dim='year')
+
+    if ('Monthly' in time_periods):
+        if(daily_data):
+            # Monthly total is the sum of days in the month (labelled by month start)
+            ds_month_total = ds.resample(time='MS').sum(skipna=False)
+        else:
+            ds_month_total = ds_total
+
+        stats['monthly_total'] = ds_month_total.sel(time = ds_month_total.time.dt.month.isin(months)).groupby('time.month').mean()
+        stats['monthly_mean']  = ds.sel(time = ds.time.dt.month.isin(months)).groupby('time.month').mean()
+
+    ds_stats = xr.Dataset()
+    for stat, ds_stat in stats.items():
+        for var in varnames:
+            ds_stats[var + '_' + stat] = ds_stat[var]
+
+    # Modify month coordinates to string
+    if ('Monthly' in time_periods):
+        ds_stats = ds_stats.assign_coords({'month': month_str})
+
+    return ds_stats
+
 #----------------------------------------------------------
 # Clip to Midwest region
 def clip_to_midwest_region(ds, var):
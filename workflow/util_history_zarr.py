@@ -0,0 +1,136 @@
+"""
+Python modules for converting yearly ELM history files of a case into a single Zarr store
+
+The store <caseid>.elm.<hist>.zarr is written next to the yearly files with
+  - one chunk along time per variable (time-contiguous), split along other dimensions only for large variables
+  - compression with the default Zarr codec
+  - consolidated metadata, so opening the store is a single metadata read
+The store attributes record name, number of time steps and modification time of each yearly file,
+so readers can select the time steps of the requested files and ignore a store older than its files.
+"""
+import os
+import re
+import shutil
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+# Maximum size of a single chunk in the Zarr store
+max_chunk_mb = 64
+
+# Encoding kept from the NetCDF files (NetCDF chunking and compression settings are dropped)
+keep_encoding = ['units', 'calendar', 'dtype', '_FillValue', 'missing_value', 'scale_factor', 'add_offset']
+
+# -----------------------------------------------------------
+def history_zarr_store(fname):
+    """Zarr store name for the yearly history files of a case
+    :param: fname:         name of a yearly history file (<caseid>.elm.h0.<yr>-02-01-00000.nc)
+    :return:               store name (<caseid>.elm.h0.zarr)
+    """
+    return re.sub(r'\.[0-9]{4}-[0-9]{2}-[0-9]{2}-[0-9]{5}\.nc$', '.zarr', fname)
+
+# -----------------------------------------------------------
+def time_contiguous_chunks(da):
+    """Chunk sizes with all time steps in one chunk, the largest other dimension is split if the chunk is too large
+    :param: da:            xarray data array
+    :return:               dictionary of chunk size for each dimension
+    """
+    chunks = dict(zip(da.dims, da.shape))
+
+    other_dims = [dim for dim in da.dims if dim != 'time']
+    if (len(other_dims) > 0):
+        largest = max(other_dims, key=lambda dim: chunks[dim])
+        nbytes  = da.dtype.itemsize * np.prod(da.shape)
+        nsplit  = int(np.ceil(nbytes / (max_chunk_mb * 1e6)))
+        chunks[largest] = max(1, int(np.ceil(chunks[largest] / nsplit)))
+
+    return chunks
+
+# -----------------------------------------------------------
+def convert_history_to_zarr(fnames):
+    """Convert yearly history files into a single chunked, compressed Zarr store with consolidated metadata
+    :param: fnames:        list of yearly history file names
+    :return:               store name
+    """
+    store = history_zarr_store(fnames[0])
+
+    source_ntime = []
+    for fname in fnames:
+        with xr.open_dataset(fname, decode_times=False) as ds:
+            source_ntime.append(ds.sizes['time'])
+
+    with xr.open_mfdataset(fnames, combine='nested', concat_dim='time', data_vars='minimal',
+                           coords='minimal', compat='override') as ds:
+
+        for var in list(ds.variables):
+            ds[var].encoding = {k: v for k, v in ds[var].encoding.items() if k in keep_encoding}
+            if (ds[var].ndim > 0 and var not in ds.dims):
+                ds[var] = ds[var].chunk(time_contiguous_chunks(ds[var]))
+
+        ds.attrs['source_files']  = [os.path.basename(fname) for fname in fnames]
+        ds.attrs['source_ntime']  = source_ntime
+        ds.attrs['source_mtimes'] = [os.path.getmtime(fname) for fname in fnames]
+
+        # Write to a temporary store so readers never see a partial store
+        tmp_store = store + '.tmp'
+        if os.path.exists(tmp_store):
+            shutil.rmtree(tmp_store)
+        ds.to_zarr(tmp_store, mode='w', consolidated=True)
+
+    if os.path.exists(store):
+        shutil.rmtree(store)
+    os.rename(tmp_store, store)
+
+    return store
+
+# -----------------------------------------------------------
+def read_history_zarr(fnames, varnames=None, decode_times=True, data_vars='minimal'):
+    """Read yearly history files from the Zarr store of the case if present and up to date
+    :param: fnames:        list of yearly history file names
+    :param: varnames:      variable name or list of variable names (default all)
+    :param: decode_times:  decode times
+    :param: data_vars:     layout of the NetCDF reader that is replaced, 'minimal' or 'all' (as in open_mfdataset,
+                           with 'all' data variables without time, e.g. pfts1d_ixy, get the time dimension)
+    :return:               xarray dataset (or data array for a single variable name), None if there is no usable store
+    """
+    store = history_zarr_store(fnames[0])
+    if not os.path.exists(store):
+        return None
+
+    ds = xr.open_zarr(store, consolidated=True, decode_times=decode_times)
+
+    source_files  = list(ds.attrs['source_files'])
+    source_mtimes = list(ds.attrs['source_mtimes'])
+    time_offset   = np.concatenate([[0], np.cumsum(ds.attrs['source_ntime'])])
+
+    time_inds = []
+    for fname in fnames:
+        if os.path.basename(fname) not in source_files:
+            return None
+
+        ind = source_files.index(os.path.basename(fname))
+
+        # Yearly file modified after conversion (yearly files can be removed after conversion)
+        if (os.path.exists(fname) and os.path.getmtime(fname) > source_mtimes[ind]):
+            return None
+
+        time_inds.extend(range(time_offset[ind], time_offset[ind+1]))
+
+    # Contiguous years are read as a single slice
+    if (len(time_inds) > 0 and np.all(np.diff(time_inds) == 1)):
+        ds = ds.isel(time=slice(time_inds[0], time_inds[-1]+1))
+    else:
+        ds = ds.isel(time=time_inds)
+
+    if (data_vars == 'all'):
+        # Same dimensions as concatenating the yearly files along time with open_mfdataset(data_vars='all')
+        for var in ds.data_vars:
+            if ('time' not in ds[var].dims):
+                ds[var] = ds[var].expand_dims(time=ds['time'])
+
+    if varnames is not None:
+        ds = ds[varnames]
+
+    return ds
@@ -1,6 +1,31 @@
+import functools
+import numpy as np
 import xarray as xr
+import netCDF4 as nc
 
 from util_estimate_dataset_stats import *
+from util_regridding import read_compact_regridded
+from util_stats_cache import set_source_files
+from util_history_zarr import read_history_zarr, history_zarr_store
+
+# -----------------------------------------------------------
+def history_drop_variables(fname, varnames):
+    """List of variables in a history file that are not needed for reading select variables
+    :param: fname:       history file name (first file of the series)
+    :param: varnames:    variable name or list of variable names to keep
+    :return:             list of variable names to drop at open time
+    """
+    varnames = list(np.atleast_1d(varnames))
+
+    with nc.Dataset(fname) as ds:
+        # Keep coordinate variables of the dimensions used by the select variables
+        keep_dims = set(['time'])
+        for var in varnames:
+            keep_dims.update(ds.variables[var].dimensions)
+
+        drop_variables = [var for var in ds.variables if var not in varnames and var not in keep_dims]
+
+    return drop_variables
 
 # -----------------------------------------------------------
 def read_model_output(yr_start, yr_end, fpath, caseid, varnames):
@@ -18,12 +43,24 @@ def read_model_output(yr_start, yr_end, fpath, caseid, varnames):
     for yr in range(int(yr_start), int(yr_end)+1):
         fnames.append(fpath + '/' + caseid + '.elm.h0.' + str(yr) + '-02-01-00000.nc')
 
+    # Prefer the Zarr store of the case created by convert_history_zarr.py
+    ds = read_history_zarr(fnames, varnames)
+    if ds is not None:
+        return(set_source_files(ds, [history_zarr_store(fnames[0])]))
+
+    # Only decode select variables, every file has the same variables as the first file
+    drop_variables = history_drop_variables(fnames[0], varnames)
+
     # Open a multiple netCDF data file and load the data into xarrays
-    with xr.open_mfdataset(fnames, combine='nested', concat_dim='time') as ds:
+    with xr.open_mfdataset(fnames, combine='nested', concat_dim='time', drop_variables=drop_variables,
+                           data_vars='minimal', coords='minimal', compat='override', parallel=True) as ds:
 
         # Only keep select variables in the data array
         ds = ds[varnames]
 
+    # Input files are used for caching derived statistics
+    ds = set_source_files(ds, fnames)
+
     return(ds)
 
 # -----------------------------------------------------------
@@ -42,12 +79,24 @@ def read_spinup_model_output(yr_start, yr_end, yr_step, fpath, caseid, mon_day_s
     for yr in range(int(yr_start), int(yr_end)+1, yr_step):
         fnames.append(fpath + '/' + caseid + '.elm.h0.' + str(yr).zfill(4) + mon_day_str + '-00000.nc')
 
+    # Prefer the Zarr store of the case created by convert_history_zarr.py
+    ds = read_history_zarr(fnames, varnames, decode_times)
+    if ds is not None:
+        return(set_source_files(ds, [history_zarr_store(fnames[0])]))
+
+    # Only decode select variables, every file has the same variables as the first file
+    drop_variables = history_drop_variables(fnames[0], varnames)
+
     # Open a multiple netCDF data file and load the data into xarrays
-    with xr.open_mfdataset(fnames, decode_times=decode_times, combine='nested', concat_dim='time', data_vars='minimal') as ds:
+    with xr.open_mfdataset(fnames, decode_times=decode_times, combine='nested', concat_dim='time', drop_variables=drop_variables,
+                           data_vars='minimal', coords='minimal', compat='override', parallel=True) as ds:
 
         # Only keep select variables in the data array
         ds = ds[varnames]
 
+    # Input files are used for caching derived statistics
+    ds = set_source_files(ds, fnames)
+
     return(ds)
 
 # -----------------------------------------------------------
@@ -65,11 +114,86 @@ def read_col_lev_model_output(yr_start, yr_end, filepath, caseid):
     for yr in range(int(yr_start), int(yr_end)+1):
         fnames.append(filepath + '/' + caseid + '.elm.h1.' + str(yr) + '-02-01-00000.nc')
 
+    # Prefer the Zarr store of the case created by convert_history_zarr.py
+    ds = read_history_zarr(fnames, data_vars='all')
+    if ds is not None:
+        return(ds)
+
     # Open a multiple netCDF data file and load the data into xarray
-    ds = xr.open_mfdataset(fnames, combine='nested', concat_dim='time')
+    ds = xr.open_mfdataset(fnames, combine='nested', concat_dim='time', data_vars='all')
 
     return(ds)
 
+# -----------------------------------------------------------
+def read_regridded_output(fname, pfts, type_dim='pft'):
+    """Read regridded pft (or column) level model output (dense or compact format) for select pfts (or columns)
+    :param: fname:       regridded output file name
+    :param: pfts:        list of pft names (or column types) for subsetting
+    :param: type_dim:    pft or col
+    :return:             data array with regridded model output [time * pft * lat * lon]
+    """
+    with xr.open_dataset(fname) as ds:
+        compact = (ds.attrs.get('regrid_format') == 'compact')
+
+    if(compact):
+        # Only read entries for select pfts
+        ds = read_compact_regridded(fname, types=pfts)
+    else:
+        ds = xr.open_mfdataset(fname)
+        ds = ds.sel({type_dim: ds[type_dim].isin(pfts)})
+
+    # Input file is used for caching derived statistics
+    ds = set_source_files(ds, [fname])
+
+    return(ds)
+
+# Yearly site history files already read, keyed by file name (lndgrid=0, in memory)
+site_history_cache = {}
+
+# -----------------------------------------------------------
+def read_valid_model_data(rundir, caseid, crop_yrs, varnames, preload_varnames=[]):
+    """Read ELM site level model output for specified case and year range and subset for variables
+    Each yearly file is opened once (read from the Zarr store of the case if present), later requests for the
+    same years and variables are served from memory
+    :param: rundir:            path to the run directory
+    :param: caseid:            case name
+    :param: crop_yrs:          crop years for reading data
+    :param: varnames:          list of variable names of interest
+    :param: preload_varnames:  list of variables needed by later requests, read together with varnames
+    :return:                   single dataset containing model results for select years and variables
+    """
+    # Read names of all NetCDF files within the given year range
+    fnames = []
+    for yr in crop_yrs:
+        fnames.append(rundir + '/' + caseid + '.elm.h0.' + str(yr) + '-01-01-00000.nc')
+
+    for fname in fnames:
+        ds_cached = site_history_cache.get(fname, xr.Dataset())
+
+        if all(var in ds_cached for var in varnames):
+            continue
+
+        load_varnames = [var for var in dict.fromkeys(list(varnames) + list(preload_varnames)) if var not in ds_cached]
+
+        # Prefer the Zarr store of the case created by convert_history_zarr.py
+        ds = read_history_zarr([fname], load_varnames)
+        if ds is None:
+            ds = xr.open_dataset(fname)
+
+        # Variables are read lazily, so only variables not yet in memory are read
+        with ds:
+
+            # Drop landgrid dimension
+            ds = ds.isel(lndgrid=0)[load_varnames].load()
+
+        site_history_cache[fname] = xr.merge([ds_cached, ds])
+
+    # Same time order as combining the yearly files by coordinates
+    ds = xr.concat([site_history_cache[fname][varnames] for fname in fnames], dim='time')
+    ds = ds.sortby('time')
+
+    return (ds)
+
 # -----------------------------------------------------------
 def read_FluxCom_data(yr_start, yr_end, fpath, fname, varname):
     """Read ELM model output for select variables
@@ -107,25 +231,49 @@ def read_MODIS_monthly_data(fpath, fname):
    return ds
 
 # -----------------------------------------------------------
-# Read site level observations
-def read_site_level_obs(site, crop, var, conv_factor, time_period, est_mon_total, select_month='August'):
+# Directory containing observed data for each site and crop
+site_obs_dir = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/timeseries_plots/'
 
-   basedir = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/timeseries_plots/' 
-   obsdir  = basedir + site + '_' + crop + '/' 
+# -----------------------------------------------------------
+# Read netcdf containing observed data for a site and crop
+def read_site_obs_dataset(site, crop):
+
+   obsdir   = site_obs_dir + site + '_' + crop + '/'
    obsfname = site + '_' + crop + '_select_var.nc'
 
    # Open a netcdf containing observed data
-   ds_obs = xr.open_dataset(obsdir + obsfname)
+   with xr.open_dataset(obsdir + obsfname) as ds_obs:
+      ds_obs = ds_obs.load()
+
+   # Input file is used for caching derived statistics
+   ds_obs = set_source_files(ds_obs, [obsdir + obsfname])
+
+   return(ds_obs)
+
+# -----------------------------------------------------------
+# Annual or monthly climatologies of all observed variables, estimated once for each site, crop and time period
+# and kept in memory for the most recently used sites and crops
+@functools.lru_cache(maxsize=32)
+def site_obs_climatology(site, crop, time_period):
+
+   ds_obs = read_site_obs_dataset(site, crop)
+
+   return(reduce_obs_climatology(ds_obs, all_mon, all_mon_str, time_periods=(time_period,)))
+
+# -----------------------------------------------------------
+# Read site level observations
+def read_site_level_obs(site, crop, var, conv_factor, time_period, est_mon_total, select_month='August'):
+
+   ds_clim = site_obs_climatology(site, crop, time_period)
 
    # Observations are at daily time scale
    # Therefore just adding data for all days in the year will provide annual total
+   stat = 'total' if est_mon_total else 'mean'
+
    if(time_period == 'Annual'):
-      da_plot = create_mean_annual_da(ds_obs[var], var, conv_factor, est_mon_total).values
+      da_plot = ds_clim[var + '_annual_' + stat]/conv_factor
    elif(time_period == 'Monthly'):
-      da_plot = create_summer_average_monthly(ds_obs[var], all_mon, all_mon_str, var, conv_factor, est_mon_total)
-
       # Only keep data for a select month
-      da_plot = da_plot.sel(month = select_month).values
-
-   return(da_plot)
+      da_plot = ds_clim[var + '_monthly_' + stat].sel(month = select_month)/conv_factor
 
+   return(da_plot.values)
@@ -0,0 +1,130 @@
+"""
+Python modules for creating and caching masks of the US-Midwest subregions
+"""
+import os
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+# Pickles with lon_lat coordinates of grid cells within each subregion
+pickle_fname = '/qfs/people/sinh210/wrk/E3SM_SFA/ELM-Bioenergy/spatial_plots/figures/domain.lnd.Northern_Rockies_cruncep_c220216.out'
+
+# Directory for saving region masks next to the pickles
+region_mask_dir = os.path.dirname(pickle_fname)
+
+# In memory caches shared by all composite grids and region plots
+region_coords_cache = {}
+region_hash_cache   = {}
+region_mask_cache   = {}
+
+#----------------------------------------------------------
+def region_pickle_fname(region):
+    """File name of the pickle containing lon_lat coordinates for a subregion
+    :param: region:        subregion name
+    """
+    return pickle_fname.replace('Northern_Rockies', region)
+
+#----------------------------------------------------------
+def read_region_coords(region):
+    """Read lon_lat coordinates of grid cells within a subregion, only unpickling each file once
+    :param: region:        subregion name
+    :return:               list of (lon, lat) coordinates
+    """
+    if region not in region_coords_cache:
+        # load pickle to read lon_lat coordinates for the subregion
+        with open(region_pickle_fname(region), 'rb') as f:
+            region_coords_cache[region] = pickle.load(f)
+
+    return region_coords_cache[region]
+
+#----------------------------------------------------------
+def region_file_hash(region):
+    """Content hash of the pickle containing lon_lat coordinates for a subregion
+    :param: region:        subregion name
+    """
+    if region not in region_hash_cache:
+        with open(region_pickle_fname(region), 'rb') as f:
+            region_hash_cache[region] = hashlib.sha1(f.read()).hexdigest()
+
+    return region_hash_cache[region]
+
+#----------------------------------------------------------
+def create_region_index(lat, lon, region_coords):
+    """Create an integer raster with the position of the subregion each grid cell belongs to
+    :param: lat:           latitude values of the grid
+    :param: lon:           longitude values of the grid
+    :param: region_coords: list containing list of (lon, lat) coordinates for each subregion
+    :return:               int8 array [lat * lon], -1 for grid cells outside all subregions
+    """
+    lat_index = pd.Index(np.asarray(lat))
+    lon_index = pd.Index(np.asarray(lon))
+
+    region_index = np.full([len(lat_index), len(lon_index)], -1, dtype=np.int8)
+
+    # Later subregions overwrite earlier ones for grid cells listed more than once
+    for i, notnull_coords in enumerate(region_coords):
+        if (len(notnull_coords) == 0):
+            continue
+
+        coords   = np.asarray(notnull_coords)
+        lat_inds = lat_index.get_indexer(coords[:, 1])
+        lon_inds = lon_index.get_indexer(coords[:, 0])
+
+        if ((lat_inds < 0).any() or (lon_inds < 0).any()):
+            raise KeyError('Subregion coordinates not found on the model grid')
+
+        region_index[lat_inds, lon_inds] = i
+
+    return region_index
+
+#----------------------------------------------------------
+def read_region_mask(lat, lon, regions):
+    """Read region mask for the model grid from the in memory cache, the saved npz file, or create it
+    :param: lat:           latitude values of the grid
+    :param: lon:           longitude values of the grid
+    :param: regions:       list of subregion names
+    :return:               int8 array [lat * lon] with position of the subregion in regions, -1 outside subregions
+    """
+    lat = np.ascontiguousarray(lat, dtype=float)
+    lon = np.ascontiguousarray(lon, dtype=float)
+
+    mem_key = (lat.tobytes(), lon.tobytes(), tuple(regions))
+    if mem_key in region_mask_cache:
+        return region_mask_cache[mem_key]
+
+    # Content hash of the grid and the subregion coordinate pickles
+    sha = hashlib.sha1()
+    sha.update(lat.tobytes())
+    sha.update(lon.tobytes())
+    for region in regions:
+        sha.update(region.encode())
+        sha.update(region_file_hash(region).encode())
+    content_hash = sha.hexdigest()
+
+    mask_fname = os.path.join(region_mask_dir, 'region_mask_' + content_hash[:16] + '.npz')
+
+    region_mask = None
+    if os.path.exists(mask_fname):
+        with np.load(mask_fname) as npz:
+            if (str(npz['content_hash']) == content_hash):
+                region_mask = npz['region_mask']
+
+    if region_mask is None:
+        region_coords = [read_region_coords(region) for region in regions]
+        region_mask   = create_region_index(lat, lon, region_coords)
+
+        try:
+            np.savez_compressed(mask_fname, region_mask=region_mask, lat=lat, lon=lon,
+                                regions=np.array(regions), content_hash=np.array(content_hash))
+        except OSError:
+            # Directory is not writable, keep the mask in memory only
+            pass
+
+    region_mask.setflags(write=False)
+    region_mask_cache[mem_key] = region_mask
+
+    return region_mask
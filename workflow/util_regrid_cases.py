@@ -0,0 +1,138 @@
+"""
+Python modules for regridding ELM h1 output for multiple cases in parallel
+"""
+import os
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+from util_pftname import *
+from util_read_data import *
+from util_regridding import *
+
+# Directory containing ELM case directories
+rundir = '/compyfs/sinh210/e3sm_scratch/'
+
+# Directory for writing regridded output
+regridded_dir = '/compyfs/sinh210/e3sm_scratch/regridded_output/'
+
+# Directory for saving regrid plans shared by all cases with the same surface dataset
+regrid_plan_dir = '/compyfs/sinh210/e3sm_scratch/regridded_output/regrid_plans/'
+
+# land use timeseries with and without corn soybean rotation
+lu_fname_rot    = '/compyfs/sinh210/mygetregionaldata/landuse.timeseries_20x34pt_f19_US_Midwest_sub_cru_hist_50pfts_corn_soy_rot_c220216.nc'
+lu_fname_no_rot = '/compyfs/sinh210/mygetregionaldata/landuse.timeseries_20x34pt_f19_US_Midwest_sub_cru_hist_50pfts_c220413.nc'
+
+# Position of the 36 cfts along the pft and column dimensions
+cft_slice = {'pft': slice(15, 51),
+             'col': slice(215, 251)}
+
+# -----------------------------------------------------------
+def landuse_fname(caseid):
+    """ Land use timeseries used for the case
+    :param caseid: model run case id
+    """
+    if ('corn_soy_rot' in caseid):
+        return lu_fname_rot
+    else:
+        return lu_fname_no_rot
+
+# -----------------------------------------------------------
+def regrid_case(caseid, varnames, type_dim='pft', yr_start=2001, yr_end=2010, cropwts_vars=[],
+                out_suffix='_regridded', chunk_size=12, compact=False):
+    """ Regrid ELM h1 output for select variables of a case and write a single output file
+    :param caseid:       model run case id
+    :param varnames:     list of ELM output variable names
+    :param type_dim:     pft or col level output
+    :param yr_start:     start year for reading model output
+    :param yr_end:       end year for reading model output
+    :param cropwts_vars: list of variables with PCT_CROP and PCT_CFT weights applied to cfts
+    :param out_suffix:   suffix of the output file name
+    :param chunk_size:   number of months regridded at a time
+    :param compact:      only write occupied (pft, grid cell) pairs
+    :return:             (output file name, elapsed time in seconds)
+    """
+    start = time.time()
+
+    # Read ELM h1 output file containing output in 1D vector format
+    fpath  = rundir + caseid + '/run/'
+    mod_ds = read_col_lev_model_output(yr_start, yr_end, fpath, caseid)
+
+    if (type_dim == 'pft'):
+        plan        = pft_regrid_plan(mod_ds, regrid_plan_dir)
+        type_coords = pftname
+    elif (type_dim == 'col'):
+        # Restart file to access cols1d_ityp value that is not stored in h1 files
+        fname_res   = fpath + '/' + caseid + '.elm.r.' + str(yr_end) + '-01-01-00000.nc'
+        plan        = col_regrid_plan(mod_ds, fname_res, regrid_plan_dir)
+        type_coords = range(0, plan.ntype+1)
+
+    # Apply crop weight mask to cfts
+    chunk_fns = {}
+    if (len(cropwts_vars) > 0):
+        cropwts = create_cropwts(landuse_fname(caseid), yr_start, yr_end)
+        for var in cropwts_vars:
+            chunk_fns[var] = functools.partial(apply_cropwts_chunk, cropwts=cropwts, cft_slice=cft_slice[type_dim])
+
+    out_fname = regridded_dir + caseid + out_suffix + '.nc'
+    regrid_to_netcdf(mod_ds, varnames, plan, out_fname, type_dim, type_coords, chunk_size, chunk_fns, compact)
+
+    return out_fname, time.time() - start
+
+# -----------------------------------------------------------
+def regrid_cases(caseids, nproc=1, **kwargs):
+    """ Regrid ELM h1 output for multiple cases using a process pool
+    :param caseids: list of model run case ids
+    :param nproc:   number of processes
+    :param kwargs:  arguments passed to regrid_case
+    :return:        list of output file names
+    """
+    case_fn = functools.partial(regrid_case, **kwargs)
+
+    if (nproc > 1):
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            results = list(pool.map(case_fn, caseids))
+    else:
+        results = [case_fn(caseid) for caseid in caseids]
+
+    for caseid, (out_fname, elapsed) in zip(caseids, results):
+        print('%s: %.1f s' % (out_fname, elapsed))
+
+    return [out_fname for out_fname, elapsed in results]
+
+# -----------------------------------------------------------
+def plot_cropwts_mask(lu_fname, fname, time_ind=150):
+    """ Diagnostic plot of corn and soybean crop weight mask (opt-in, batch regridding does not plot)
+    :param lu_fname: land use timeseries file name
+    :param fname:    output figure file name
+    :param time_ind: time index of the land use timeseries to plot
+    """
+    # Imported here so that regridding never loads matplotlib or cartopy
+    from util_spatial_plots import facet_plot_US
+    from util_myDict_labels import fig_extent
+
+    with xr.open_dataset(lu_fname, decode_times=False) as lu_ts:
+        da_plot = cropwts_mask(lu_ts).isel(time=time_ind, cft=[2, 8]).load()
+
+    # Replace zero values with nan
+    da_plot = da_plot.where(da_plot != 0)
+
+    subplot_titles = ['Corn','Soybean']
+    cmap_col = 'jet'
+
+    facet_plot_US(da_plot, subplot_titles, colplot='cft', colwrap=1, cmap_col=cmap_col, cbar_label='Crop weight mask [unitless]',
+                  fig_wt=11, fig_ht=14, fig_extent=fig_extent, show_states=True, fname=fname)
+
+# -----------------------------------------------------------
+def plot_cases_cropwts_mask(caseids):
+    """ Diagnostic plot of crop weight mask for each land use timeseries used by the cases
+    :param caseids: list of model run case ids
+    """
+    for lu_fname in sorted(set(landuse_fname(caseid) for caseid in caseids)):
+        if (lu_fname == lu_fname_rot):
+            plot_cropwts_mask(lu_fname, fname='cropwtsmask_US_Midwest_corn_soybean_rot.png')
+        else:
+            plot_cropwts_mask(lu_fname, fname='cropwtsmask_US_Midwest_corn_soybean.png')
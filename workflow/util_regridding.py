@@ -0,0 +1,384 @@
+"""
+Python modules for regridding ELM h1 output from 1D vector format [time, pft] to gridded format [time, pft, lat, lon]
+
+Output is regridded and written one time chunk at a time. All variables of a chunk are read at once and
+regridded one variable at a time, so peak memory is bounded by a single chunk:
+    chunk_size * nvars * npfts1d * 8 bytes              (1D model output of all variables read for the chunk)
+  + chunk_size * (npft+1) * nlat * nlon * 8 bytes       (gridded buffer reused for every variable)
+For the 360x720 grid with 51 pfts the gridded chunk of 12 months needs ~1.3 GB and of 1 month ~110 MB,
+independent of the number of years in the run. The 1D part grows with the number of variables regridded.
+
+In compact format only the occupied (pft, grid cell) pairs are written as float32 [time * entry],
+together with the flat index of each entry in the [pft * lat * lon] grid. Entries are sorted by pft
+and pft_offset holds the first entry of each pft (CSR-like), so a single pft is a contiguous slice.
+"""
+import os
+import hashlib
+import numpy as np
+import xarray as xr
+import netCDF4 as nc
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+# -----------------------------------------------------------
+def hash_metadata(arrays):
+    """Content hash of 1D vector metadata arrays
+    :param arrays: list of arrays (ixy, jxy, type, ...) or labels
+    """
+    sha = hashlib.sha1()
+    for arr in arrays:
+        if isinstance(arr, str):
+            sha.update(arr.encode())
+            continue
+        arr = np.ascontiguousarray(arr, dtype=np.int64)
+        sha.update(str(arr.shape).encode())
+        sha.update(arr.tobytes())
+
+    return sha.hexdigest()
+
+# -----------------------------------------------------------
+class RegridPlan:
+    """Flat linear indices for scattering the ELM 1D vector into the [type * lat * lon] grid
+
+    The mapping only depends on the pfts1d/cols1d metadata, so a single plan is reused for every
+    variable and every case sharing a surface dataset.
+    """
+
+    def __init__(self, flat_index, grid_shape, key):
+        self.flat_index = np.asarray(flat_index, dtype=np.int64)
+        self.grid_shape = tuple(int(n) for n in grid_shape)
+        self.key        = key
+
+    @classmethod
+    def from_metadata(cls, itype, jxy, ixy, nlat, nlon, key=None):
+        """Create plan from the 1D vector metadata
+        :param itype: pft (or column) type of each vector element
+        :param jxy:   1-based latitude index of each vector element
+        :param ixy:   1-based longitude index of each vector element
+        :param nlat:  number of latitudes
+        :param nlon:  number of longitudes
+        :param key:   plan key (default hash of the metadata)
+        """
+        itype = np.asarray(itype).astype(int)
+        jind  = np.asarray(jxy).astype(int) - 1
+        iind  = np.asarray(ixy).astype(int) - 1
+
+        grid_shape = (itype.max()+1, nlat, nlon)
+        flat_index = np.ravel_multi_index((itype, jind, iind), grid_shape)
+
+        if key is None:
+            key = hash_metadata([itype, jind, iind, grid_shape])
+
+        return cls(flat_index, grid_shape, key)
+
+    @property
+    def ntype(self):
+        """Maximum pft (or column) type"""
+        return self.grid_shape[0] - 1
+
+    def save(self, fname):
+        """Save plan to npz file"""
+        np.savez(fname, flat_index=self.flat_index, grid_shape=np.array(self.grid_shape), key=np.array(self.key))
+
+    @classmethod
+    def load(cls, fname):
+        """Read plan from npz file"""
+        with np.load(fname) as npz:
+            return cls(npz['flat_index'], npz['grid_shape'], str(npz['key']))
+
+    def scatter(self, chunk_data, out=None):
+        """Scatter 1D output into the grid
+        :param chunk_data: ELM output [time * pft]
+        :param out:        preallocated buffer [time * type * lat * lon] (default new array filled with nan)
+        :return:           gridded output [time * type * lat * lon], nan where no pft exists
+        """
+        chunk_data = np.asarray(chunk_data)
+        ntime      = chunk_data.shape[0]
+
+        if out is None:
+            out = np.full([ntime, *self.grid_shape], np.nan)
+
+        out.reshape(ntime, -1)[:, self.flat_index] = chunk_data
+
+        return out
+
+    def compact_index(self):
+        """Sorted flat indices of the occupied (type, grid cell) pairs
+        :return: (flat index of each entry, offset of the first entry of each type [ntype+2])
+        """
+        entry_index = np.unique(self.flat_index)
+        entry_type  = entry_index // (self.grid_shape[1] * self.grid_shape[2])
+        type_offset = np.searchsorted(entry_type, np.arange(self.grid_shape[0] + 1))
+
+        return entry_index, type_offset
+
+# -----------------------------------------------------------
+def load_regrid_plan(plan_dir, key, create_plan):
+    """Read a saved regrid plan or create and save it
+    :param plan_dir:    directory with saved plans (None to not save plans)
+    :param key:         plan key
+    :param create_plan: function returning a new RegridPlan
+    """
+    if plan_dir is None:
+        return create_plan()
+
+    plan_fname = os.path.join(plan_dir, 'regrid_plan_' + key[:16] + '.npz')
+
+    if os.path.exists(plan_fname):
+        plan = RegridPlan.load(plan_fname)
+        if (plan.key == key):
+            return plan
+
+    plan = create_plan()
+    os.makedirs(plan_dir, exist_ok=True)
+    plan.save(plan_fname)
+
+    return plan
+
+# -----------------------------------------------------------
+def pft_regrid_plan(mod_ds, plan_dir=None):
+    """Regrid plan for pft level ELM h1 output
+    :param mod_ds:   ELM h1 output in xarray format
+    :param plan_dir: directory with saved plans
+    """
+    nlat    = len(mod_ds.lat) # For smallville - mod_ds.lat[0]
+    nlon    = len(mod_ds.lon) # For smallville - mod_ds.lon[0]
+    ixy     = mod_ds.pfts1d_ixy.isel(time=0).values
+    jxy     = mod_ds.pfts1d_jxy.isel(time=0).values
+    vegtype = mod_ds.pfts1d_itype_veg.isel(time=0).values
+
+    key = hash_metadata(['pft', nlat, nlon, ixy, jxy, vegtype])
+
+    return load_regrid_plan(plan_dir, key, lambda: RegridPlan.from_metadata(vegtype, jxy, ixy, nlat, nlon, key))
+
+# -----------------------------------------------------------
+def col_regrid_plan(mod_ds, fname_res, plan_dir=None):
+    """Regrid plan for column level ELM h1 output
+    :param mod_ds:    ELM h1 output in xarray format
+    :param fname_res: ELM restart file containing cols1d_ityp that is not stored in h1 files
+    :param plan_dir:  directory with saved plans
+    """
+    nlat = len(mod_ds.lat)
+    nlon = len(mod_ds.lon)
+    ixy  = mod_ds.cols1d_ixy.isel(time=0).values
+    jxy  = mod_ds.cols1d_jxy.isel(time=0).values
+
+    # Key on the column metadata in the h1 file so the restart file is only read when the plan is created
+    key_arrays = ['col', nlat, nlon, ixy, jxy]
+    if 'cols1d_itype_lunit' in mod_ds:
+        key_arrays.append(mod_ds.cols1d_itype_lunit.isel(time=0).values)
+    key = hash_metadata(key_arrays)
+
+    def create_plan():
+        with xr.open_dataset(fname_res) as mod_res:
+            coltype = mod_res.cols1d_ityp.values
+        return RegridPlan.from_metadata(coltype, jxy, ixy, nlat, nlon, key)
+
+    return load_regrid_plan(plan_dir, key, create_plan)
+
+# -----------------------------------------------------------
+def create_regridded_netcdf(out_fname, time, type_dim, type_coords, lat, lon):
+    """Create NetCDF file containing only the coordinates of the regridded output
+    :param out_fname:   output file name
+    :param time:        time coordinate of ELM output
+    :param type_dim:    name of pft (or column) dimension
+    :param type_coords: pft names (or column types)
+    :param lat:         latitude values
+    :param lon:         longitude values
+    """
+    ds_coords = xr.Dataset(coords={'time': time.values, type_dim: type_coords, 'lat': lat, 'lon': lon})
+
+    # Keep the time units and calendar of the ELM output
+    time_encoding = {key: time.encoding[key] for key in ['units', 'calendar'] if key in time.encoding}
+
+    ds_coords.to_netcdf(path=out_fname, mode='w', format='NETCDF4', encoding={'time': time_encoding})
+
+# -----------------------------------------------------------
+def create_compact_regridded_netcdf(out_fname, time, type_dim, type_coords, lat, lon, plan):
+    """Create NetCDF file containing the coordinates and entry index of the compact regridded output
+    :param out_fname:   output file name
+    :param time:        time coordinate of ELM output
+    :param type_dim:    name of pft (or column) dimension
+    :param type_coords: pft names (or column types)
+    :param lat:         latitude values
+    :param lon:         longitude values
+    :param plan:        RegridPlan for the 1D vector
+    """
+    create_regridded_netcdf(out_fname, time, type_dim, type_coords, lat, lon)
+
+    entry_index, type_offset = plan.compact_index()
+
+    with nc.Dataset(out_fname, 'a') as ds_out:
+        ds_out.setncattr('regrid_format', 'compact')
+        ds_out.setncattr('type_dim', type_dim)
+
+        ds_out.createDimension('entry', len(entry_index))
+        ds_out.createDimension('offset', len(type_offset))
+
+        out_var = ds_out.createVariable('entry_index', 'i8', ('entry',))
+        out_var.long_name = 'flat index of entry in the [' + type_dim + ' * lat * lon] grid'
+        out_var[:] = entry_index
+
+        out_var = ds_out.createVariable(type_dim + '_offset', 'i8', ('offset',))
+        out_var.long_name = 'first entry of each ' + type_dim
+        out_var[:] = type_offset
+
+# -----------------------------------------------------------
+def regrid_to_netcdf(mod_ds, varnames, plan, out_fname, type_dim, type_coords, chunk_size=12, chunk_fns={}, compact=False):
+    """Regrid select variables and write them to a single NetCDF file in one pass over the time axis
+    :param mod_ds:      ELM h1 output in xarray format (lazily loaded)
+    :param varnames:    list of ELM output variable names
+    :param plan:        RegridPlan for the 1D vector
+    :param out_fname:   output file name
+    :param type_dim:    name of pft (or column) dimension
+    :param type_coords: pft names (or column types)
+    :param chunk_size:  number of time steps regridded at a time
+    :param chunk_fns:   dictionary of functions applied to the (time slice, gridded chunk) of a variable
+    :param compact:     only write occupied (pft, grid cell) pairs as float32
+    """
+    lat = mod_ds.lat.values # For smallville - mod_ds.lat[0]
+    lon = mod_ds.lon.values # For smallville - mod_ds.lon[0]
+
+    # Create output file containing the coordinates of the regridded output
+    if(compact):
+        create_compact_regridded_netcdf(out_fname, mod_ds.time, type_dim, type_coords, lat, lon, plan)
+    else:
+        create_regridded_netcdf(out_fname, mod_ds.time, type_dim, type_coords, lat, lon)
+
+    with nc.Dataset(out_fname, 'a') as ds_out:
+
+        out_vars = {}
+        for var in varnames:
+            if(compact):
+                out_vars[var] = ds_out.createVariable(var, 'f4', ('time', 'entry'), fill_value=np.float32(np.nan))
+            else:
+                out_vars[var] = ds_out.createVariable(var, 'f8', ('time', type_dim, 'lat', 'lon'), fill_value=np.nan)
+
+            # Copy attributes
+            out_vars[var].setncatts({k: v for k, v in mod_ds[var].attrs.items() if k != '_FillValue'})
+
+        if(compact):
+            entry_index = ds_out['entry_index'][:]
+
+        # Gridded buffers reused for every variable and chunk, one per chunk length (the last chunk may be shorter)
+        ntime   = len(mod_ds.time)
+        buffers = {n: np.empty([n, *plan.grid_shape]) for n in {min(chunk_size, ntime), ntime % chunk_size} if n > 0}
+
+        for t_start in range(0, ntime, chunk_size):
+            t_slice = slice(t_start, min(t_start + chunk_size, ntime))
+
+            # Read all variables for the current chunk at once
+            ds_chunk = mod_ds[varnames].isel(time=t_slice).load()
+
+            for var in varnames:
+                # Reset the buffer so grid cells without the pft stay nan
+                buffer = buffers[t_slice.stop - t_slice.start]
+                buffer.fill(np.nan)
+
+                gridded = plan.scatter(ds_chunk[var].values, out=buffer)
+
+                if var in chunk_fns:
+                    t_slice, gridded = chunk_fns[var](t_slice, gridded)
+
+                if(compact):
+                    out_vars[var][t_slice] = gridded.reshape(gridded.shape[0], -1)[:, entry_index].astype(np.float32)
+                else:
+                    out_vars[var][t_slice] = gridded
+
+# -----------------------------------------------------------
+def apply_cropwts_chunk(t_slice, gridded, cropwts, cft_slice):
+    """Apply crop weight mask to cfts of a gridded chunk
+    :param t_slice:   time slice of the chunk
+    :param gridded:   gridded chunk [time * pft * lat * lon]
+    :param cropwts:   crop weight mask [years * cft * lat * lon], nan where crop area is <0.5%
+    :param cft_slice: slice of cfts along the pft dimension
+    :return:          (time slice, gridded chunk with crop weights applied to cfts)
+    """
+    # Monthly output, so each set of 12 time steps belongs to the next year
+    year_inds = np.arange(t_slice.start, t_slice.stop) // 12
+
+    gridded[:, cft_slice] *= cropwts[year_inds]
+
+    return t_slice, gridded
+
+# Crop weight masks already read, keyed by (land use file, modification time, yr_start, yr_end)
+cropwts_cache = {}
+
+# -----------------------------------------------------------
+def cropwts_mask(lu_ts, yr_start=None, yr_end=None):
+    """ Crop weight mask for cfts from land use timeseries (lazy, no data is read)
+    :param lu_ts:    land use timeseries with time in years
+    :param yr_start: start year of model output (default all years)
+    :param yr_end:   end year of model output (default all years)
+    :return:         crop weight mask [time * cft * lsmlat * lsmlon], nan where crop area is <0.5%
+    """
+    # Defining proportion of each crop type (pctcft) within the grid crop area (pctcrop)
+    cropwts = (lu_ts.PCT_CFT/100) * (lu_ts.PCT_CROP/100)
+
+    # Masking regions with crop area <0.5%
+    cropwts = cropwts.where(cropwts>0.005)
+
+    # Subset masks between years
+    if (yr_start is not None):
+        cropwts = cropwts.sel(time = cropwts.time.isin(range(yr_start, yr_end+1)))
+
+    return cropwts
+
+# -----------------------------------------------------------
+def create_cropwts(lu_fname, yr_start, yr_end):
+    """ Create crop weight mask for cfts from land use timeseries, read once per file and year range
+    :param lu_fname: land use timeseries file name
+    :param yr_start: start year of model output
+    :param yr_end:   end year of model output
+    :return:         read-only crop weight mask [years * cft * lat * lon], nan where crop area is <0.5%
+    """
+    key = (os.path.abspath(lu_fname), os.path.getmtime(lu_fname), yr_start, yr_end)
+
+    if key not in cropwts_cache:
+        with xr.open_dataset(lu_fname, decode_times=False) as lu_ts:
+            cropwts = cropwts_mask(lu_ts, yr_start, yr_end).values
+
+        # Shared by all cases using the land use file, so guard against modification
+        cropwts.flags.writeable = False
+        cropwts_cache[key]      = cropwts
+
+    return cropwts_cache[key]
+
+# -----------------------------------------------------------
+def read_compact_regridded(fname, varnames=None, types=None):
+    """Read compact regridded output and create a dense view for select pfts (or columns)
+    :param fname:    compact regridded output file name
+    :param varnames: list of variable names (default all variables)
+    :param types:    list of pft names (or column types) (default all)
+    :return:         xarray dataset [time * pft * lat * lon]
+    """
+    with xr.open_dataset(fname) as ds:
+
+        type_dim    = ds.attrs['type_dim']
+        type_coords = ds[type_dim].values
+        nlat        = len(ds.lat)
+        nlon        = len(ds.lon)
+        type_offset = ds[type_dim + '_offset'].values
+
+        if varnames is None:
+            varnames = [var for var in ds.data_vars if 'entry' in ds[var].dims and var != 'entry_index']
+        if types is None:
+            types = type_coords
+
+        type_inds = [int(np.nonzero(type_coords == t)[0][0]) for t in types]
+
+        ds_dense = xr.Dataset(coords={'time': ds.time, type_dim: type_coords[type_inds], 'lat': ds.lat, 'lon': ds.lon})
+        for var in varnames:
+            dense = np.full([len(ds.time), len(type_inds), nlat, nlon], np.nan, dtype=np.float32)
+
+            for k, type_ind in enumerate(type_inds):
+                # Only read the contiguous entries of the pft
+                entries  = slice(type_offset[type_ind], type_offset[type_ind+1])
+                cell_ind = ds['entry_index'].values[entries] % (nlat * nlon)
+
+                dense[:, k].reshape(len(ds.time), -1)[:, cell_ind] = ds[var].isel(entry=entries).values
+
+            ds_dense[var] = xr.DataArray(dense, dims=('time', type_dim, 'lat', 'lon'), attrs=ds[var].attrs)
+
+    return ds_dense
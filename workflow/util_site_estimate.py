@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import xarray as xr
 import matplotlib.pyplot as plt
@@ -8,18 +9,27 @@ __email__  = 'eva.sinha@pnnl.gov'
 from util_read_data import *
 from util_myDict_labels import *
 from util_estimate_dataset_stats import *
+from util_site_weights import *
+
+# Set used for the composite result at each site
+site_composite_set = {'US-Ne3': 'Set1',
+                      'US-Ro1': 'Set2',
+                      'US-UiC': 'Set3',
+                      'US-Br1': 'Set2',
+                      'US-Bo1': 'Set3',
+                      'US-IB1': 'Set3'}
 
 # -----------------------------------------------------------
 # Read and add observed flux to the site data data frame
 def add_obs_site_data(site_data, site_pft, var, conv_factor, time_period, est_mon_total):
 
-   obs_values = []
-   for index, site in site_data.iterrows():
-      # Read site level observations
-      if(time_period == 'Annual'):
-         obs_values.append(read_site_level_obs(site.SiteID, site_pft, var, conv_factor, time_period, est_mon_total))
-      if(time_period == 'Monthly'):
-         obs_values.append(read_site_level_obs(site.SiteID, site_pft, var, conv_factor, time_period, est_mon_total, site.month))
+   # Observations are read once for each site, crop and time period (climatologies memoized in site_obs_climatology)
+   if(time_period == 'Annual'):
+      obs_values = [read_site_level_obs(site_id, site_pft, var, conv_factor, time_period, est_mon_total)
+                    for site_id in site_data.SiteID]
+   if(time_period == 'Monthly'):
+      obs_values = [read_site_level_obs(site_id, site_pft, var, conv_factor, time_period, est_mon_total, month)
+                    for site_id, month in zip(site_data.SiteID, site_data.month)]
 
    # Add as columns to site location data frame
    site_data['Observed'] = obs_values
@@ -30,19 +40,29 @@ def add_obs_site_data(site_data, site_pft, var, conv_factor, time_period, est_mo
    return(site_data)
 
 # -----------------------------------------------------------
-# Interpolate ELM outputs for site lat lon and save in data frame
-def site_data_interp(site_data, site_pft, da_plot, col_name):
+# Interpolate data for all site lat lon with bilinear weights estimated once for the grid and sites
+def interp_sites(da, site_data, select_month=False):
+   """ Interpolate data at all sites using precomputed bilinear site weights
+   :param da:           data array with lat and lon dimensions
+   :param site_data:    data frame with lat and lon (and month) for each site
+   :param select_month: select month of each site (month column) from the month dimension
+   :return:             numpy array with value for each site
+   """
+   site_wts = site_bilinear_weights(da['lat'].values, da['lon'].values, site_data)
 
-   site_values = []
-   for index, site in site_data.iterrows():
+   site_da = apply_site_weights(da, site_wts)
 
-      # Interpolate data for specified lat and lon
-      site_value = da_plot.sel(pft = site_pft).interp(lat = site.lat, lon = site.lon).values
+   if(select_month):
+      site_da = site_da.sel(month = xr.DataArray(site_data['month'].values, dims='site'))
 
-      site_values.append(site_value)
+   return(site_da.values)
+
+# -----------------------------------------------------------
+# Interpolate ELM outputs for site lat lon and save in data frame
+def site_data_interp(site_data, site_pft, da_plot, col_name):
 
    # Add as columns to site location data frame
-   site_data[col_name] = site_values
+   site_data[col_name] = interp_sites(da_plot.sel(pft = site_pft), site_data)
 
    # Convert column to numeric
    site_data[col_name] = site_data[col_name].astype(float)
@@ -53,16 +73,8 @@ def site_data_interp(site_data, site_pft, da_plot, col_name):
 # Interpolate ELM outputs for site lat lon and save in data frame
 def site_data_interp_monthly(site_data, site_pft, da_plot, col_name):
 
-   site_values = []
-   for index, site in site_data.iterrows():
-
-      # Interpolate data for specified lat and lon
-      site_value = da_plot.sel(pft = site_pft, month = site.month).interp(lat = site.lat, lon = site.lon).values
-
-      site_values.append(site_value)
-
    # Add as columns to site location data frame
-   site_data[col_name] = site_values
+   site_data[col_name] = interp_sites(da_plot.sel(pft = site_pft), site_data, select_month=True)
 
    # Convert column to numeric
    site_data[col_name] = site_data[col_name].astype(float)
@@ -73,17 +85,13 @@ def site_data_interp_monthly(site_data, site_pft, da_plot, col_name):
 # Update site data output to add composite set result as new column
 def site_data_add_composite(site_data):
 
-   # Add column for composite
-   site_values = []
-   for index, site in site_data.iterrows():
-      if(site.SiteID == 'US-Ne3'): site_values.append(site.Set1)
-      if(site.SiteID == 'US-Ro1'): site_values.append(site.Set2)
-      if(site.SiteID == 'US-UiC'): site_values.append(site.Set3)
-      if(site.SiteID == 'US-Br1'): site_values.append(site.Set2)
-      if(site.SiteID == 'US-Bo1'): site_values.append(site.Set3)
-      if(site.SiteID == 'US-IB1'): site_values.append(site.Set3)
+   # Set used for each site
+   site_sets = site_data['SiteID'].map(site_composite_set)
+   if(site_sets.isna().any()):
+      raise KeyError('No composite set for sites: ' + str(site_data['SiteID'][site_sets.isna()].tolist()))
 
    # Add as a new column
-   site_data['Composite'] = site_values
+   set_inds, set_names = pd.factorize(site_sets)
+   site_data['Composite'] = site_data[list(set_names)].to_numpy()[np.arange(len(site_data)), set_inds]
 
    return(site_data)
@@ -0,0 +1,166 @@
+"""
+Python modules for interpolating gridded ELM output at a fixed list of sites with precomputed bilinear weights
+
+The four neighbouring grid cells and bilinear weights of each site are estimated once for each
+(grid, site list) and kept in memory and on disk (site_weights_<grid hash>_<site hash>.nc in the
+stats cache directory). Applying the weights to a data array is a gather of the four neighbours
+and a weighted sum over the trailing lat and lon axes, which gives the same values as
+da.interp(lat=..., lon=...) (NaN for sites outside the grid or next to missing values).
+"""
+import os
+import hashlib
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+import util_stats_cache
+
+# Site weights already estimated in this process
+site_weights_cache = {}
+
+#----------------------------------------------------------
+def coords_hash(*coords):
+    """Hash of coordinate values
+    :param: coords:        one or more arrays of coordinate values
+    :return:               hash string
+    """
+    sha = hashlib.sha1()
+    for values in coords:
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        sha.update(str(values.shape).encode())
+        sha.update(values.tobytes())
+
+    return sha.hexdigest()
+
+#----------------------------------------------------------
+def linear_neighbours(coord, points):
+    """Lower neighbour index and weight of the upper neighbour for linear interpolation along a coordinate
+    :param: coord:         increasing coordinate values of the grid
+    :param: points:        site coordinate values
+    :return:               (lower neighbour index, upper neighbour weight, whether point is inside the grid)
+    """
+    coord  = np.asarray(coord, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+
+    if (coord.size < 2 or np.any(np.diff(coord) <= 0)):
+        raise ValueError('Grid coordinate has to be strictly increasing with at least two values')
+
+    ind    = np.clip(np.searchsorted(coord, points, side='right') - 1, 0, coord.size - 2)
+    frac   = (points - coord[ind]) / (coord[ind+1] - coord[ind])
+    inside = (points >= coord[0]) & (points <= coord[-1])
+
+    return ind, frac, inside
+
+#----------------------------------------------------------
+def estimate_site_weights(lat, lon, site_lat, site_lon, site_ids):
+    """Indices of the four neighbouring grid cells and bilinear weights of each site
+    :param: lat:           grid latitudes
+    :param: lon:           grid longitudes
+    :param: site_lat:      site latitudes
+    :param: site_lon:      site longitudes
+    :param: site_ids:      site names
+    :return:               xarray dataset with lat_ind, lon_ind and weight [site * corner]
+    """
+    lat_ind, lat_frac, lat_inside = linear_neighbours(lat, site_lat)
+    lon_ind, lon_frac, lon_inside = linear_neighbours(lon, site_lon)
+
+    # Corners ordered as (lat, lon), (lat, lon+1), (lat+1, lon), (lat+1, lon+1)
+    corner_lat_ind = np.stack([lat_ind, lat_ind, lat_ind+1, lat_ind+1], axis=1)
+    corner_lon_ind = np.stack([lon_ind, lon_ind+1, lon_ind, lon_ind+1], axis=1)
+    weight         = np.stack([(1-lat_frac)*(1-lon_frac), (1-lat_frac)*lon_frac,
+                               lat_frac*(1-lon_frac),     lat_frac*lon_frac], axis=1)
+
+    # Sites outside the grid are missing as with interp
+    weight[~(lat_inside & lon_inside), :] = np.nan
+
+    site_wts = xr.Dataset({'lat_ind': (('site', 'corner'), corner_lat_ind),
+                           'lon_ind': (('site', 'corner'), corner_lon_ind),
+                           'weight':  (('site', 'corner'), weight)},
+                          coords={'SiteID': ('site', np.asarray(site_ids, dtype=str)),
+                                  'lat':    ('site', np.asarray(site_lat, dtype=np.float64)),
+                                  'lon':    ('site', np.asarray(site_lon, dtype=np.float64))})
+
+    return site_wts
+
+#----------------------------------------------------------
+def site_bilinear_weights(lat, lon, site_data):
+    """Bilinear site weights for a grid, estimated once and cached in memory and on disk
+    :param: lat:           grid latitudes
+    :param: lon:           grid longitudes
+    :param: site_data:     data frame with lat and lon (and SiteID) for each site
+    :return:               xarray dataset with lat_ind, lon_ind and weight [site * corner]
+    """
+    site_lat = site_data['lat'].values
+    site_lon = site_data['lon'].values
+    if 'SiteID' in site_data:
+        site_ids = site_data['SiteID'].values
+    else:
+        site_ids = np.arange(len(site_data)).astype(str)
+
+    grid_key = coords_hash(lat, lon)
+    site_key = coords_hash(site_lat, site_lon)
+    key      = (grid_key, site_key, tuple(site_ids))
+
+    if key in site_weights_cache:
+        return site_weights_cache[key]
+
+    cache_fname = os.path.join(util_stats_cache.stats_cache_dir,
+                               'site_weights_' + grid_key[:16] + '_' + site_key[:16] + '.nc')
+
+    site_wts = None
+    if os.path.exists(cache_fname):
+        with xr.open_dataset(cache_fname) as ds_cache:
+            if (ds_cache.attrs.get('grid_hash') == grid_key and ds_cache.attrs.get('site_hash') == site_key):
+                site_wts = ds_cache.load()
+                site_wts = site_wts.assign_coords(SiteID=('site', np.asarray(site_ids, dtype=str)))
+                site_wts.attrs = {}
+                os.utime(cache_fname)
+
+    if site_wts is None:
+        site_wts = estimate_site_weights(lat, lon, site_lat, site_lon, site_ids)
+
+        try:
+            os.makedirs(util_stats_cache.stats_cache_dir, exist_ok=True)
+            ds_cache = site_wts.assign_attrs(grid_hash=grid_key, site_hash=site_key)
+
+            # Write to a temporary file so parallel readers never see a partial file
+            tmp_fname = cache_fname + '.' + str(os.getpid()) + '.tmp'
+            ds_cache.to_netcdf(tmp_fname)
+            os.replace(tmp_fname, cache_fname)
+        except OSError:
+            # Directory is not writable, weights are only kept in memory
+            pass
+
+    site_weights_cache[key] = site_wts
+
+    return site_wts
+
+#----------------------------------------------------------
+def gather_dot(values, lat_ind, lon_ind, weight):
+    """Weighted sum of the four neighbours of each site over the trailing lat and lon axes
+    :param: values:        numpy array [... * lat * lon]
+    :return:               numpy array [... * site]
+    """
+    return np.einsum('...sk,sk->...s', values[..., lat_ind, lon_ind], weight)
+
+#----------------------------------------------------------
+def apply_site_weights(da, site_wts):
+    """Interpolate a data array at the sites with precomputed bilinear weights
+    :param: da:            data array with lat and lon dimensions
+    :param: site_wts:      site weights from site_bilinear_weights
+    :return:               data array with the lat and lon dimensions replaced by site
+    """
+    da_site = xr.apply_ufunc(gather_dot, da,
+                             kwargs={'lat_ind': site_wts['lat_ind'].values,
+                                     'lon_ind': site_wts['lon_ind'].values,
+                                     'weight':  site_wts['weight'].values},
+                             input_core_dims=[['lat', 'lon']],
+                             output_core_dims=[['site']],
+                             dask='parallelized',
+                             output_dtypes=[np.result_type(da.dtype, np.float64)],
+                             dask_gufunc_kwargs={'output_sizes': {'site': site_wts.sizes['site']}},
+                             keep_attrs=True)
+
+    return da_site.assign_coords(SiteID=site_wts['SiteID'], lat=site_wts['lat'], lon=site_wts['lon'])
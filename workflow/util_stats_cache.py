@@ -0,0 +1,217 @@
+"""
+Python modules for caching derived statistics of model output and observations on disk
+
+Results are stored as small NetCDF files named by a content hash of
+  - path, modification time and size of each input file
+  - variable name, dimensions, shape and coordinate values of the input data
+  - fingerprint of the values of the input data (dask graph name, or hash of values already in memory),
+    so data modified after reading (ds*conv, where, ...) does not hit the statistics of the files
+  - statistic function name and its parameters (conv_factor, est_mon_total, months, ...)
+Only data read by the util_read_data readers carries the list of input files (encoding['source_files']),
+other data is never looked up in the cache. Least recently used files are evicted
+when the total size of the cache exceeds stats_cache_max_mb.
+"""
+import os
+import glob
+import hashlib
+import functools
+import inspect
+import numpy as np
+import xarray as xr
+
+__author__ = 'Eva Sinha'
+__email__  = 'eva.sinha@pnnl.gov'
+
+# Directory for saving derived statistics
+stats_cache_dir = '/compyfs/sinh210/e3sm_scratch/stats_cache/'
+
+# Maximum total size of the cache
+stats_cache_max_mb = 2048
+
+#----------------------------------------------------------
+def set_source_files(ds, fnames):
+    """Record the input files of a dataset (and each of its variables) so derived statistics can be cached
+    :param: ds:            xarray dataset or data array
+    :param: fnames:        list of input file names
+    :return:               ds
+    """
+    fnames = [os.path.abspath(fname) for fname in np.atleast_1d(fnames)]
+
+    ds.encoding['source_files'] = fnames
+    if isinstance(ds, xr.Dataset):
+        for var in ds.data_vars:
+            ds[var].encoding['source_files'] = fnames
+
+    return ds
+
+#----------------------------------------------------------
+def data_fingerprint(da):
+    """Fingerprint of the values of a data array
+    Dask graph names are deterministic tokens of the input files and every operation applied since reading,
+    values already in memory are hashed and values not yet read are those of the input files
+    :param: da:            xarray data array
+    :return:               fingerprint string
+    """
+    if da.chunks is not None:
+        return da.data.name
+
+    if da.variable._in_memory:
+        values = np.asarray(da.values)
+        if (values.dtype.kind == 'O'):
+            return hashlib.sha1(str(values.tolist()).encode()).hexdigest()
+        return hashlib.sha1(np.ascontiguousarray(values).view(np.uint8)).hexdigest()
+
+    return 'lazy'
+
+#----------------------------------------------------------
+def stats_cache_key(func_name, ds, params):
+    """Content hash of the input files, input data layout and values and statistic parameters
+    :param: func_name:     statistic function name
+    :param: ds:            xarray dataset or data array with encoding['source_files']
+    :param: params:        dictionary of statistic parameters
+    :return:               hash string, None if input files are unknown
+    """
+    fnames = ds.encoding.get('source_files')
+    if fnames is None:
+        return None
+
+    sha = hashlib.sha1()
+    sha.update(func_name.encode())
+    for fname in fnames:
+        stat = os.stat(fname)
+        sha.update(('%s %d %d' % (fname, stat.st_mtime_ns, stat.st_size)).encode())
+
+    variables = ds.data_vars.items() if isinstance(ds, xr.Dataset) else [(ds.name, ds)]
+    for name, da in variables:
+        sha.update(('%s %s %s %s' % (name, da.dims, da.shape, data_fingerprint(da))).encode())
+
+    for name, coord in ds.coords.items():
+        values = np.asarray(coord.values)
+        sha.update(str(name).encode())
+        if (values.dtype.kind == 'O'):
+            # cftime dates and other objects are hashed by their string representation
+            sha.update(str(values.tolist()).encode())
+        else:
+            sha.update(values.tobytes())
+
+    for name in sorted(params):
+        sha.update(('%s=%r' % (name, params[name])).encode())
+
+    return sha.hexdigest()
+
+#----------------------------------------------------------
+def stat_to_dataset(result):
+    """Convert statistic (data array or dataset) to a dataset for writing to the cache
+    :param: result:        xarray dataset or data array
+    """
+    if isinstance(result, xr.Dataset):
+        ds_cache = result.copy()
+        ds_cache.attrs = {'stat_type': 'dataset'}
+    else:
+        ds_cache = result.to_dataset(name='stat')
+        ds_cache.attrs = {'stat_type': 'dataarray'}
+        if result.name is not None:
+            ds_cache.attrs['stat_name'] = str(result.name)
+
+    return ds_cache
+
+#----------------------------------------------------------
+def read_cached_stat(ds_cache):
+    """Read statistic (data array or dataset) from the cache
+    :param: ds_cache:      xarray dataset opened from the cache file
+    """
+    ds_cache = ds_cache.load()
+
+    if (ds_cache.attrs['stat_type'] == 'dataset'):
+        result = ds_cache.copy()
+        result.attrs = {}
+    else:
+        result = ds_cache['stat'].rename(ds_cache.attrs.get('stat_name'))
+
+    return result
+
+#----------------------------------------------------------
+def cached_stat(func):
+    """Decorator for caching statistics estimated from data with known input files
+    The first argument of func is the xarray dataset or data array
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(ds, *args, **kwargs):
+        bound = signature.bind(ds, *args, **kwargs)
+        bound.apply_defaults()
+        params = dict(list(bound.arguments.items())[1:])
+
+        key = stats_cache_key(func.__name__, ds, params)
+        if key is None:
+            return func(ds, *args, **kwargs)
+
+        cache_fname = os.path.join(stats_cache_dir, func.__name__ + '_' + key[:16] + '.nc')
+
+        try:
+            with xr.open_dataset(cache_fname) as ds_cache:
+                if (ds_cache.attrs.get('content_hash') == key):
+                    # Update modification time for least recently used eviction
+                    os.utime(cache_fname)
+                    return read_cached_stat(ds_cache)
+        except FileNotFoundError:
+            # Not in the cache (or evicted by another process)
+            pass
+
+        result = func(ds, *args, **kwargs).load()
+
+        try:
+            os.makedirs(stats_cache_dir, exist_ok=True)
+            ds_cache = stat_to_dataset(result)
+            ds_cache.attrs['content_hash'] = key
+
+            # Write to a temporary file so parallel readers never see a partial file
+            tmp_fname = cache_fname + '.' + str(os.getpid()) + '.tmp'
+            ds_cache.to_netcdf(tmp_fname)
+            os.replace(tmp_fname, cache_fname)
+
+            evict_stats_cache(stats_cache_max_mb)
+        except OSError:
+            # Directory is not writable, only return the result
+            pass
+
+        return result
+
+    return wrapper
+
+#----------------------------------------------------------
+def list_stats_cache():
+    """List files in the cache from most to least recently used
+    :return:               list of (file name, size in bytes, modification time)
+    """
+    entries = []
+    for fname in glob.glob(os.path.join(stats_cache_dir, '*.nc')):
+        try:
+            stat = os.stat(fname)
+        except FileNotFoundError:
+            # Removed by another process
+            continue
+        entries.append((fname, stat.st_size, stat.st_mtime))
+
+    return sorted(entries, key=lambda entry: entry[2], reverse=True)
+
+#----------------------------------------------------------
+def evict_stats_cache(max_mb):
+    """Remove least recently used files until the total size of the cache is below max_mb
+    :param: max_mb:        maximum total size of the cache in MB (0 clears the cache)
+    :return:               list of removed file names
+    """
+    total   = 0
+    removed = []
+    for fname, size, mtime in list_stats_cache():
+        total += size
+        if (total > max_mb * 1e6):
+            try:
+                os.remove(fname)
+                removed.append(fname)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+
+    return removed
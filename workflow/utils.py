@@ -2,8 +2,12 @@
 
 
 import numpy as np
+import pandas as pd
 import sys
 import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.dates as mdates
@@ -310,6 +314,53 @@ def pick_ind(data, row):
 ##################################################
 
 
+def calib_npy_name(fname):
+    """Name of the binary copy of a calibration text file (<name>.npy)"""
+
+    return os.path.splitext(fname)[0] + '.npy'
+
+
+def save_calib_array(fname, dtype=float, fortran=False):
+    """Convert a calibration text file to .npy, ensembles (nsam, nout) are stored in Fortran order
+    so slicing outputs [:, ind] from the memory map reads contiguous blocks"""
+
+    data = np.loadtxt(fname, dtype=dtype)
+    if fortran:
+        data = np.asfortranarray(data)
+
+    # Write to a temporary file so a partial file is never read
+    npy = calib_npy_name(fname)
+    tmp = npy + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp, npy)
+
+    return npy
+
+
+def load_calib_array(fname, dtype=float, ndmin=0):
+    """Load a calibration array from its memory mapped binary copy (written by convert_calib_ensembles.py)
+    if it is at least as new as the text file, otherwise parse the text file"""
+
+    npy = calib_npy_name(fname)
+    if os.path.exists(npy) and (not os.path.exists(fname) or os.path.getmtime(npy) >= os.path.getmtime(fname)):
+        data = np.load(npy, mmap_mode='r')
+
+        # Same shape as np.loadtxt with ndmin
+        if data.ndim == 0 and ndmin > 0:
+            data = data.reshape((1,) * ndmin)
+        elif data.ndim == 1 and ndmin == 2:
+            data = data[:, np.newaxis]
+    else:
+        data = np.loadtxt(fname, dtype=dtype, ndmin=ndmin)
+
+    return data
+
+##################################################
+##################################################
+##################################################
+
+
 def multidim_intersect(arr1, arr2):
     arr1_view = arr1.view([('', arr1.dtype)] * arr1.shape[1])
     arr2_view = arr2.view([('', arr2.dtype)] * arr2.shape[1])
@@ -349,17 +400,252 @@ def encode_mindex(mindex):
 ##################################################
 
 
+def legendre_basis(x, maxord):
+    """Legendre polynomials P_0..P_maxord at x in [-1,1], shape x.shape + (maxord+1,)"""
+
+    x = np.asarray(x, dtype=float)
+    leg = np.empty(x.shape + (maxord + 1,))
+    leg[..., 0] = 1.0
+    if maxord > 0:
+        leg[..., 1] = x
+    for n in range(1, maxord):
+        leg[..., n + 1] = ((2 * n + 1) * x * leg[..., n] - n * leg[..., n - 1]) / (n + 1)
+
+    return leg
+
+##################################################
+##################################################
+##################################################
+
+
+def pce_basis(xdata, pctype, mi):
+    """PC basis at samples xdata (nsam, ndim) for multiindex mi (npc, ndim), shape (nsam, npc)"""
+
+    if pctype != 'LU':
+        raise ValueError('Only Legendre-Uniform (LU) PC is supported, got ' + pctype)
+
+    mi = np.atleast_2d(np.asarray(mi, dtype=int))
+    xdata = np.asarray(xdata, dtype=float).reshape(-1, mi.shape[1])
+
+    leg = legendre_basis(xdata, mi.max())
+
+    # Product over dimensions of the univariate polynomial of each term
+    psi = np.ones((xdata.shape[0], mi.shape[0]))
+    for idim in range(mi.shape[1]):
+        psi *= leg[:, idim, mi[:, idim]]
+
+    return psi
+
+##################################################
+##################################################
+##################################################
+
+
+def pce_norms(pctype, mi):
+    """Squared norms of the PC basis terms with respect to the germ density"""
+
+    if pctype != 'LU':
+        raise ValueError('Only Legendre-Uniform (LU) PC is supported, got ' + pctype)
+
+    mi = np.atleast_2d(np.asarray(mi, dtype=int))
+
+    # Legendre polynomials with uniform density on [-1,1] have E[P_n^2] = 1/(2n+1)
+    return np.prod(1.0 / (2 * mi + 1), axis=1)
+
+##################################################
+##################################################
+##################################################
+
+
 def pce_eval(xdata, pctype, mi, pccf):
-    uqtkbin = os.environ['UQTK_INS'] + os.sep + 'bin'
-    np.savetxt('mi', mi, fmt="%d")
-    np.savetxt('pccf', pccf)
-    np.savetxt('xdata.dat', xdata)
+    """Evaluate PC expansion(s) at samples xdata (nsam, ndim)
+    pccf is (npc,) for a single output or (npc, nout) for outputs sharing the multiindex"""
 
-    cmd = uqtkbin + os.sep + 'pce_eval -x PC_mi -r mi -f pccf -s ' + pctype + ' > pceval.log'
-    os.system(cmd)
+    psi = pce_basis(xdata, pctype, mi)
+    ydata = psi @ np.asarray(pccf, dtype=float)
 
+    return ydata
 
-    ydata = np.loadtxt('ydata.dat')
+##################################################
+##################################################
+##################################################
+
+
+def pce_sens_batch(pctype, mis, pccfs, ndim=None):
+    """Main, total and joint Sobol sensitivities, mean and variance of many PC expansions at once
+    mis and pccfs are lists of multiindex (npc, ndim) and coefficients, (npc,) for a single output or
+    (npc, k) for k outputs sharing the multiindex as in pce_eval, outputs are ordered as the columns
+    of the coefficients, multiindices may differ between entries but have the same dimension
+    ndim is only needed when the lists are empty
+    Returns mainsens, totsens (nout, ndim), jointsens (nout, ndim, ndim), mean, var (nout,)
+    jointsens holds second order indices in the upper triangle, main sensitivities on the diagonal
+    and zeros below the diagonal (checked against quadrature in check_pce_sens.py, compared with
+    UQTk pce_sens only by validate_pce_sens.py when UQTk is installed)"""
+
+    if len(mis) == 0:
+        if ndim is None:
+            raise ValueError('pce_sens_batch needs ndim when there are no PC expansions')
+        return np.zeros((0, ndim)), np.zeros((0, ndim)), np.zeros((0, ndim, ndim)), np.zeros(0), np.zeros(0)
+
+    mis = [np.atleast_2d(np.asarray(mi, dtype=int)) for mi in mis]
+    ndim = mis[0].shape[1]
+
+    mainsens, totsens, jointsens, mean, var = [], [], [], [], []
+    for mi, pccf in zip(mis, pccfs):
+        cfs = np.asarray(pccf, dtype=float).reshape(mi.shape[0], -1).T  # (k, npc)
+        assert(mi.shape[1] == ndim)
+
+        active = (mi > 0)
+        nactive = active.sum(axis=1)
+
+        # Variance contribution of each term of each output, the constant term gives the mean
+        varterm = cfs**2 * np.where(nactive > 0, pce_norms(pctype, mi), 0.0)
+
+        # Terms with exactly two active dimensions contribute to the joint sensitivity of that pair
+        pair = np.zeros((mi.shape[0], ndim * ndim))
+        ipair = np.where(nactive == 2)[0]
+        if len(ipair) > 0:
+            dims = np.sort(np.argsort(~active[ipair], axis=1, kind='stable')[:, :2], axis=1)
+            pair[ipair, dims[:, 0] * ndim + dims[:, 1]] = 1.0
+
+        mean.append(cfs @ (nactive == 0))
+        var.append(varterm.sum(axis=1))
+        totsens.append(varterm @ active)
+        mainsens.append(varterm @ (active & (nactive == 1)[:, np.newaxis]))
+        jointsens.append((varterm @ pair).reshape(-1, ndim, ndim))
+
+    mainsens, totsens, jointsens = np.vstack(mainsens), np.vstack(totsens), np.vstack(jointsens)
+    mean, var = np.concatenate(mean), np.concatenate(var)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mainsens /= var[:, np.newaxis]
+        totsens /= var[:, np.newaxis]
+        jointsens /= var[:, np.newaxis, np.newaxis]
+
+    idiag = np.arange(ndim)
+    jointsens[:, idiag, idiag] = mainsens
+
+    return mainsens, totsens, jointsens, mean, var
+
+##################################################
+##################################################
+##################################################
+
+
+def pce_sens_grouped(pctype, mis, pccfs, ndim=None):
+    """Main and total Sobol sensitivities, mean and variance of many PC expansions
+    Outputs with identical multiindex are grouped and their coefficient vectors stacked into a matrix,
+    so pce_sens_batch needs a few matrix products for each group
+    ndim is only needed when the lists are empty
+    Returns mainsens, totsens (nout, ndim), mean, var (nout,)"""
+
+    groups = {}
+    for i, mi in enumerate(mis):
+        mi = np.atleast_2d(np.asarray(mi, dtype=int))
+        groups.setdefault((mi.shape, mi.tobytes()), []).append(i)
+
+    group_inds = list(groups.values())
+    mainsens, totsens, jointsens, mean, var = pce_sens_batch(
+        pctype, [mis[inds[0]] for inds in group_inds],
+        [np.column_stack([np.asarray(pccfs[i], dtype=float) for i in inds]) for inds in group_inds], ndim)
+
+    # Outputs back in the order of the input lists
+    order = np.argsort(np.concatenate([np.asarray(inds, dtype=int) for inds in group_inds] + [np.zeros(0, dtype=int)]))
+
+    return mainsens[order], totsens[order], mean[order], var[order]
+
+##################################################
+##################################################
+##################################################
+
+
+def results_sens(results_all, iouts, pctype='LU', ndim=None):
+    """Main and total sensitivities of select outputs of results_all (list of dictionaries with mindex and cfs)
+    Outputs without a surrogate (None) have zero sensitivities, ndim is only needed when no output has one
+    Returns mainsens, totsens (len(iouts), ndim)"""
+
+    has_pc = [i for i, iout in enumerate(iouts) if results_all[iout] is not None]
+
+    mainsens, totsens, mean, var = pce_sens_grouped(pctype,
+                                                    [results_all[iouts[i]]['mindex'] for i in has_pc],
+                                                    [results_all[iouts[i]]['cfs'] for i in has_pc], ndim)
+
+    all_mainsens = np.zeros((len(iouts), mainsens.shape[1]))
+    all_totsens = np.zeros((len(iouts), totsens.shape[1]))
+    all_mainsens[has_pc] = mainsens
+    all_totsens[has_pc] = totsens
+
+    return all_mainsens, all_totsens
+
+##################################################
+##################################################
+##################################################
+
+
+def sens_dataframe(mainsens, totsens, pnames, qoi=''):
+    """Tidy data frame with one row per output and parameter (columns QoI, output, pnames, main, total)"""
+
+    nout, ndim = mainsens.shape
+
+    df = pd.DataFrame({'QoI': qoi,
+                       'output': np.repeat(np.arange(nout), ndim),
+                       'pnames': np.tile(pnames, nout),
+                       'main': mainsens.ravel(),
+                       'total': totsens.ravel()})
+
+    return df
+
+##################################################
+##################################################
+##################################################
+
+
+def pce_sens(pctype, mi, pccf, mv=False):
+    """Main, total and joint Sobol sensitivities (and mean, variance) of a single PC expansion"""
+
+    mainsens, totsens, jointsens, mean, var = pce_sens_batch(pctype, [mi], [pccf])
+
+    if (mv):
+        return mainsens[0], totsens[0], jointsens[0], mean[0], var[0]
+
+    else:
+        return mainsens[0], totsens[0], jointsens[0]
+
+##################################################
+##################################################
+##################################################
+
+
+def run_uqtk(app, args, workdir, logname):
+    """Run a UQTk app in workdir, raise RuntimeError with the end of the log if it fails"""
+
+    if 'UQTK_INS' not in os.environ:
+        raise RuntimeError('UQTK_INS is not set')
+    cmd = [os.environ['UQTK_INS'] + os.sep + 'bin' + os.sep + app] + args
+
+    logfile = os.path.join(workdir, logname)
+    with open(logfile, 'w') as log:
+        proc = subprocess.run(cmd, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+    if proc.returncode != 0:
+        with open(logfile) as log:
+            tail = ''.join(log.readlines()[-20:])
+        raise RuntimeError(app + ' failed with exit code %d:\n%s' % (proc.returncode, tail))
+
+####################################################################
+
+
+def pce_eval_uqtk(xdata, pctype, mi, pccf):
+    """Evaluate PC expansion with UQTk pce_eval in a temporary directory of this call"""
+
+    with tempfile.TemporaryDirectory(prefix='pce_eval_') as workdir:
+        np.savetxt(os.path.join(workdir, 'mi'), mi, fmt="%d")
+        np.savetxt(os.path.join(workdir, 'pccf'), pccf)
+        np.savetxt(os.path.join(workdir, 'xdata.dat'), xdata)
+
+        run_uqtk('pce_eval', ['-x', 'PC_mi', '-r', 'mi', '-f', 'pccf', '-s', pctype], workdir, 'pceval.log')
+
+        ydata = np.loadtxt(os.path.join(workdir, 'ydata.dat'))
 
     return ydata
 
@@ -367,18 +653,19 @@ def pce_eval(xdata, pctype, mi, pccf):
 ####################################################################
 
 
-def pce_sens(pctype, mi, pccf, mv=False):
-    uqtkbin = os.environ['UQTK_INS'] + os.sep + 'bin'
-    np.savetxt('mi', mi, fmt="%d")
-    np.savetxt('pccf', pccf)
+def pce_sens_uqtk(pctype, mi, pccf, mv=False):
+    """Sobol sensitivities of PC expansion with UQTk pce_sens in a temporary directory of this call"""
 
-    cmd = uqtkbin + os.sep + 'pce_sens -m mi -f pccf -x ' + pctype + ' > pcsens.log'
-    os.system(cmd)
+    with tempfile.TemporaryDirectory(prefix='pce_sens_') as workdir:
+        np.savetxt(os.path.join(workdir, 'mi'), mi, fmt="%d")
+        np.savetxt(os.path.join(workdir, 'pccf'), pccf)
 
-    mainsens = np.loadtxt('mainsens.dat')
-    totsens = np.loadtxt('totsens.dat')
-    jointsens = np.loadtxt('jointsens.dat')
-    varfrac = np.atleast_1d(np.loadtxt('varfrac.dat'))
+        run_uqtk('pce_sens', ['-m', 'mi', '-f', 'pccf', '-x', pctype], workdir, 'pcsens.log')
+
+        mainsens = np.loadtxt(os.path.join(workdir, 'mainsens.dat'))
+        totsens = np.loadtxt(os.path.join(workdir, 'totsens.dat'))
+        jointsens = np.loadtxt(os.path.join(workdir, 'jointsens.dat'))
+        varfrac = np.atleast_1d(np.loadtxt(os.path.join(workdir, 'varfrac.dat')))
 
     if (mv):
         mean = pccf[0]
@@ -389,3 +676,26 @@ def pce_sens(pctype, mi, pccf, mv=False):
     else:
         return mainsens, totsens, jointsens
 
+
+####################################################################
+
+
+def pce_map(func, arglist, nproc=None, pool='thread'):
+    """Run func(*args) for each args in arglist concurrently and return the results in order
+    UQTk wrappers (pce_eval_uqtk, pce_sens_uqtk) spend their time in a subprocess, so threads are enough,
+    use pool='process' for functions doing the work in python (func has to be a module level function)"""
+
+    if nproc is None:
+        nproc = os.cpu_count()
+
+    if pool == 'thread':
+        executor = ThreadPoolExecutor(max_workers=nproc)
+    elif pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=nproc)
+    else:
+        raise ValueError('pool has to be thread or process, got ' + pool)
+
+    with executor:
+        results = list(executor.map(func, *zip(*arglist)))
+
+    return results
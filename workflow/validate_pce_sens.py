@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Validate the native PCE evaluation and Sobol sensitivities in utils.py against UQTk pce_eval/pce_sens
+for the surrogates of a site and crop (results_all.pk), and compare run times
+"""
+import os
+import sys
+import time
+import numpy as np
+import pickle as pk
+from optparse import OptionParser
+
+import utils as mu
+
+parser = OptionParser();
+
+parser.add_option("--site", dest="site", default="", \
+                  help="Site ID")
+parser.add_option("--crop", dest="crop", default="", \
+                  help="Modeled crop name")
+parser.add_option("--nout", dest="nout", default=50, type="int", \
+                  help="Number of outputs compared with UQTk")
+parser.add_option("--nsam", dest="nsam", default=100, type="int", \
+                  help="Number of samples for comparing PCE evaluation")
+parser.add_option("--tol", dest="tol", default=1e-6, type="float", \
+                  help="Tolerance on the absolute difference")
+
+(options, args) = parser.parse_args()
+
+if 'UQTK_INS' not in os.environ:
+    sys.exit('UQTK_INS is not set, UQTk is needed for the comparison (check_pce_sens.py checks the native PCE without UQTk)')
+
+#----------------------------------------------------------
+os.chdir('../site_calib_outputs/')
+
+results_all = pk.load(open(options.site + '_' + options.crop + '_' + 'results_all.pk', 'rb'))
+
+iouts = [iout for iout in range(len(results_all)) if results_all[iout] is not None]
+mis   = [results_all[iout]['mindex'] for iout in iouts]
+cfs   = [results_all[iout]['cfs'] for iout in iouts]
+if (len(iouts) == 0):
+    sys.exit('No output of ' + options.site + ' ' + options.crop + ' has a surrogate')
+
+# Native sensitivities of all outputs in one call
+start = time.time()
+mainsens, totsens, jointsens, mean, var = mu.pce_sens_batch('LU', mis, cfs)
+print('Native: %d outputs in %.3f s' % (len(iouts), time.time() - start))
+
+ndim   = mis[0].shape[1]
+xdata  = np.random.default_rng(0).uniform(-1, 1, size=(options.nsam, ndim))
+maxerr = {'mainsens': 0.0, 'totsens': 0.0, 'jointsens': 0.0, 'mean': 0.0, 'var': 0.0, 'ydata': 0.0}
+
+nout = min(options.nout, len(iouts))
+
+# Each UQTk call runs in its own temporary directory, so calls run concurrently
+start = time.time()
+uqtk_sens = mu.pce_map(mu.pce_sens_uqtk, [('LU', mis[i], cfs[i], True) for i in range(nout)])
+uqtk_eval = mu.pce_map(mu.pce_eval_uqtk, [(xdata, 'LU', mis[i], cfs[i]) for i in range(nout)])
+print('UQTk:   %d outputs in %.3f s' % (nout, time.time() - start))
+
+for i in range(nout):
+    native = [mainsens[i], totsens[i], jointsens[i], mean[i], var[i]]
+    for name, nat, ref in zip(['mainsens', 'totsens', 'jointsens', 'mean', 'var'], native, uqtk_sens[i]):
+        if name == 'jointsens':
+            # Only the upper triangle and diagonal are compared
+            ref = np.triu(ref)
+        maxerr[name] = max(maxerr[name], np.max(np.abs(nat - ref)))
+
+    maxerr['ydata'] = max(maxerr['ydata'], np.max(np.abs(mu.pce_eval(xdata, 'LU', mis[i], cfs[i]) - uqtk_eval[i])))
+
+for name in maxerr:
+    print('Maximum absolute difference %-10s %.3e' % (name, maxerr[name]))
+
+failed = [name for name in maxerr if not (maxerr[name] <= options.tol)]
+if (len(failed) > 0):
+    raise AssertionError('Native PCE differs from UQTk for ' + ', '.join(failed))